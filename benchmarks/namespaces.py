@@ -0,0 +1,60 @@
+"""Compare the speed of removing namespaces from big sitemaps with the XSLT
+(`remove_namespaces`) and in place (`strip_namespaces`).
+
+Usage: python benchmarks/namespaces.py [number of URLs ...]
+"""
+from ftw.crawler.xml_utils import remove_namespaces
+from ftw.crawler.xml_utils import strip_namespaces
+from lxml import etree
+import io
+import sys
+import timeit
+
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+
+REPEAT = 5
+
+SITEMAP_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+    'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">\n')
+
+URL_ENTRY = (
+    '  <url>\n'
+    '    <loc>http://example.org/page-{0}</loc>\n'
+    '    <lastmod>2015-01-01T12:00:00Z</lastmod>\n'
+    '    <image:image><image:loc>http://example.org/image-{0}.png'
+    '</image:loc></image:image>\n'
+    '  </url>\n')
+
+
+def make_sitemap(size):
+    entries = ''.join(URL_ENTRY.format(i) for i in range(size))
+    return (SITEMAP_HEADER + entries + '</urlset>\n').encode('utf-8')
+
+
+def benchmark(func, xml):
+    # Parsing is part of every run, since strip_namespaces changes the tree
+    parse_time = min(timeit.repeat(
+        lambda: etree.parse(io.BytesIO(xml)), number=1, repeat=REPEAT))
+    total_time = min(timeit.repeat(
+        lambda: func(etree.parse(io.BytesIO(xml))), number=1, repeat=REPEAT))
+    return total_time - parse_time
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+
+    print('{:>10} {:>12} {:>14} {:>8}'.format(
+        'URLs', 'XSLT [ms]', 'in place [ms]', 'speedup'))
+    for size in sizes:
+        xml = make_sitemap(size)
+        xslt = benchmark(remove_namespaces, xml)
+        in_place = benchmark(strip_namespaces, xml)
+        print('{:>10} {:>12.1f} {:>14.1f} {:>7.1f}x'.format(
+            size, xslt * 1000, in_place * 1000, xslt / in_place))
+
+
+if __name__ == '__main__':
+    main()
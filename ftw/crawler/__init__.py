@@ -1,4 +1,5 @@
 from ftw.crawler.log import setup_logging
+from ftw.crawler.pipeline import CRAWL_STAGES
 import argparse
 import sys
 
@@ -6,6 +7,21 @@ import sys
 setup_logging()
 
 
+def stage_workers_arg(value):
+    try:
+        name, count = value.split('=')
+        count = int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            '{!r} is not of the form STAGE=N'.format(value))
+
+    if name not in CRAWL_STAGES:
+        raise argparse.ArgumentTypeError(
+            'Unknown stage {!r}, must be one of {}'.format(
+                name, ', '.join(CRAWL_STAGES)))
+    return name, count
+
+
 def parse_args(argv=None):
     if argv is None:
         argv = sys.argv[1:]
@@ -14,7 +30,9 @@ def parse_args(argv=None):
     parser.add_argument('config', help='Path to the config file')
     parser.add_argument('url', help='If given, only index the supplied URL',
                         nargs='?', default=None)
-    parser.add_argument('--tika', help='Base URL to Tika', metavar='TIKA_URL')
+    parser.add_argument('--tika', help='Base URL to Tika, or a comma '
+                        'separated list of URLs to several Tika servers',
+                        metavar='TIKA_URL')
     parser.add_argument('--solr', help='Base URL to Solr', metavar='SOLR_URL')
     parser.add_argument('--slacktoken', help='Token for Slack messages',
                         metavar='SLACK_TOKEN')
@@ -22,6 +40,24 @@ def parse_args(argv=None):
                         metavar='SLACK_CHANNEL')
     parser.add_argument('-f', '--force', help="Force crawling even if"
                         "document hasn't been modified", action='store_true')
+    parser.add_argument('-w', '--workers', help='Number of URLs to crawl '
+                        'concurrently per site (overrides the site config)',
+                        type=int, metavar='N', default=None)
+    parser.add_argument('--stage-workers', help='Number of workers for a '
+                        'single crawling stage ({}), may be given multiple '
+                        'times (overrides the site config)'.format(
+                            ', '.join(CRAWL_STAGES)),
+                        type=stage_workers_arg, metavar='STAGE=N',
+                        action='append', default=[])
+    parser.add_argument('--site-parallelism', help='Number of sites to crawl '
+                        'in parallel, each in a separate process',
+                        type=int, metavar='N', default=1)
+    parser.add_argument('--max-retries', help='Maximum number of throttled '
+                        'requests to retry per site (overrides the site '
+                        'config)', type=int, metavar='N', default=None)
+    parser.add_argument('--resume', help='Resume an interrupted crawl, '
+                        'skipping the URLs it already finished (requires '
+                        'checkpoint_dir in the config)', action='store_true')
     args = parser.parse_args(argv)
 
     return args
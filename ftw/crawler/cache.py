@@ -0,0 +1,150 @@
+from ftw.crawler.utils import mkdir_p
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+# Default size limit of the cache in bytes
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# When the cache grows over its size limit, the least recently used entries
+# are evicted until it's below this fraction of the limit again, so eviction
+# doesn't happen for every single entry added.
+EVICTION_TARGET = 0.9
+
+# Size of the chunks a file is read in for hashing
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def content_hasher():
+    """Return a new hash object for hashing the content of a resource.
+    """
+    return hashlib.sha256()
+
+
+def hash_file(filename):
+    """Return the hex SHA-256 digest of a file's content.
+    """
+    sha = content_hasher()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_content_hash(resource_info):
+    """Return the hash of a fetched resource's content, computing it only
+    once per resource.
+    """
+    if getattr(resource_info, 'content_hash', None) is None:
+        resource_info.content_hash = hash_file(resource_info.filename)
+    return resource_info.content_hash
+
+
+class ConversionCache(object):
+    """Caches the results of converting documents (e.g. with Tika) on disk.
+
+    Entries are keyed by the hash of the document's content and its content
+    type, so identical documents are only converted once, no matter under
+    which URL they're found or how often they're crawled. Values must be
+    JSON serializable.
+
+    The total size of the cached entries is limited to `max_size` bytes.
+    When it's exceeded, the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        mkdir_p(self.directory)
+        self._size = sum(size for mtime, size, path in self._entries())
+
+    def key(self, resource_info, part):
+        key = u'\0'.join((
+            get_content_hash(resource_info),
+            resource_info.content_type or u'',
+            part))
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, resource_info, part):
+        """Return the cached value for a part (e.g. ``'text'``) of the
+        resource, or ``None`` if it isn't cached.
+        """
+        path = self._path(self.key(resource_info, part))
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (IOError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, resource_info, part, value):
+        path = self._path(self.key(resource_info, part))
+        mkdir_p(os.path.dirname(path))
+
+        # Write to a temporary file first, so other processes sharing the
+        # cache never see partially written entries
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        size = os.path.getsize(tmp_path)
+        os.rename(tmp_path, path)
+
+        with self._lock:
+            self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        size = sum(entry_size for mtime, entry_size, path in entries)
+        target = self.max_size * EVICTION_TARGET
+
+        evicted = 0
+        for mtime, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            evicted += 1
+
+        self._size = size
+        log.debug(u"Evicted {} entries from the conversion cache.".format(
+            evicted))
@@ -0,0 +1,104 @@
+from ftw.crawler.utils import mkdir_p
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class Checkpoint(object):
+    """Records the progress of crawling a site, so an interrupted crawl can
+    be resumed where it left off.
+
+    Every URL that is finished (indexed, or skipped for good) and every
+    sitemap that has been crawled completely is appended to a file in
+    `directory` right away, so the progress survives even if the crawler
+    gets killed. Once the site has been crawled completely, the file is
+    removed again.
+    """
+
+    def __init__(self, directory, site_url):
+        self.directory = directory
+        self.site_url = site_url
+        name = hashlib.sha1(site_url.encode('utf-8')).hexdigest()
+        self.path = os.path.join(directory, name + '.checkpoint')
+
+        self._finished = set()
+        self._completed = set()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def open(self, resume=False):
+        """Start recording progress. If `resume` is true, the progress of the
+        previous, interrupted crawl is loaded first; otherwise it's
+        discarded.
+        """
+        mkdir_p(self.directory)
+        if resume:
+            self._load()
+            if self._finished or self._completed:
+                log.info(u"Resuming crawl of {}: skipping {} finished URL(s) "
+                         u"and {} completed sitemap(s).".format(
+                             self.site_url, len(self._finished),
+                             len(self._completed)))
+        if (resume and os.path.exists(self.path) and
+                os.path.getsize(self.path) > 0):
+            self._file = open(self.path, 'a')
+            # Don't continue a line that was cut off when we got killed
+            self._file.write('\n')
+        else:
+            self._file = open(self.path, 'w')
+
+    def is_finished(self, sitemap_url, url):
+        return (sitemap_url, url) in self._finished
+
+    def is_completed(self, sitemap_url):
+        return sitemap_url in self._completed
+
+    def finish(self, sitemap_url, url):
+        """Record that a URL of a sitemap is finished.
+        """
+        self._write({'sitemap': sitemap_url, 'url': url})
+
+    def complete(self, sitemap_url):
+        """Record that a sitemap has been crawled completely.
+        """
+        self._write({'sitemap': sitemap_url, 'completed': True})
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """Remove the checkpoint after the site has been crawled completely.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _write(self, entry):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line of a crawl that got killed while writing it
+                    continue
+                if entry.get('completed'):
+                    self._completed.add(entry['sitemap'])
+                else:
+                    self._finished.add((entry['sitemap'], entry['url']))
@@ -1,7 +1,23 @@
+from ftw.crawler.cache import DEFAULT_CACHE_SIZE
 from ftw.crawler.exceptions import NoSuchField
 from ftw.crawler.exceptions import SiteNotFound
+from ftw.crawler.ratelimit import DEFAULT_BACKOFF_RATE
+from ftw.crawler.ratelimit import HostRateLimiter
+from ftw.crawler.solr import DEFAULT_BATCH_SIZE
+from ftw.crawler.solr import DEFAULT_PAGE_SIZE
+from ftw.crawler.solr import SOLR_POOL_SIZE
+from ftw.crawler.solr import SOLR_TIMEOUT
+from ftw.crawler.tika import TIKA_COOLDOWN
+from ftw.crawler.tika import TIKA_POOL_SIZE
+from ftw.crawler.tika import TIKA_TIMEOUT
+from urlparse import urlsplit
 import imp
 import os
+import threading
+
+
+# Guards the creation of rate limiters shared between workers
+_rate_limiters_lock = threading.Lock()
 
 
 def get_config(options):
@@ -32,16 +48,46 @@ class Config(object):
 
     def __init__(self, sites, unique_field, url_field, last_modified_field,
                  fields, tika=None, solr=None,
-                 slacktoken=None, slackchannel=None):
+                 slacktoken=None, slackchannel=None,
+                 solr_page_size=DEFAULT_PAGE_SIZE,
+                 solr_batch_size=DEFAULT_BATCH_SIZE, solr_commit_within=None,
+                 solr_pool_size=SOLR_POOL_SIZE, solr_timeout=SOLR_TIMEOUT,
+                 tika_pool_size=TIKA_POOL_SIZE, tika_timeout=TIKA_TIMEOUT,
+                 tika_single_pass=False, converters=None,
+                 tika_cache_dir=None, tika_cache_size=DEFAULT_CACHE_SIZE,
+                 tika_max_concurrency=None, tika_cooldown=TIKA_COOLDOWN,
+                 etag_field=None, content_hash_field=None, state_db=None,
+                 checkpoint_dir=None):
         self.sites = sites
         self.unique_field = unique_field
         self.url_field = url_field
         self.last_modified_field = last_modified_field
+        self.etag_field = etag_field
+        self.content_hash_field = content_hash_field
+        self.state_db = state_db
+        self.checkpoint_dir = checkpoint_dir
         self.fields = fields
         self.tika = tika
         self.solr = solr
         self.slacktoken = slacktoken
         self.slackchannel = slackchannel
+        self.solr_page_size = solr_page_size
+        self.solr_batch_size = solr_batch_size
+        self.solr_commit_within = solr_commit_within
+        self.solr_pool_size = solr_pool_size
+        self.solr_timeout = solr_timeout
+        self.tika_pool_size = tika_pool_size
+        self.tika_timeout = tika_timeout
+        self.tika_single_pass = tika_single_pass
+        self.tika_cache_dir = tika_cache_dir
+        self.tika_cache_size = tika_cache_size
+        self.tika_max_concurrency = tika_max_concurrency
+        self.tika_cooldown = tika_cooldown
+
+        # Converters to use instead of Tika, by content type
+        if converters is None:
+            converters = {}
+        self.converters = converters
 
         for site in self.sites:
             site.bind(self)
@@ -65,11 +111,24 @@ class Config(object):
 class Site(object):
 
     def __init__(self, url, attributes=None, sleeptime=0.1,
-                 sitemap_urls=None, crawler_site_id=None):
+                 sitemap_urls=None, crawler_site_id=None, workers=1,
+                 stage_workers=None, requests_per_second=None,
+                 max_concurrency=None, max_retries=100, max_body_size=None):
         self.url = url
         self.sleeptime = sleeptime
         self.sitemap_urls = sitemap_urls
         self.crawler_site_id = crawler_site_id
+        self.workers = workers
+
+        if stage_workers is None:
+            stage_workers = {}
+        self.stage_workers = stage_workers
+
+        self.requests_per_second = requests_per_second
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_body_size = max_body_size
+        self._rate_limiters = {}
 
         if attributes is None:
             attributes = {}
@@ -78,6 +137,28 @@ class Site(object):
     def bind(self, config):
         self.config = config
 
+    def get_rate_limiter(self, url):
+        """Return the `HostRateLimiter` for the host of the given URL, which
+        is shared by all workers crawling this site.
+
+        Requests start out limited to `requests_per_second` (unlimited by
+        default). When the host asks us to slow down, the rate is backed off,
+        starting at one request every `sleeptime` seconds (or at
+        `DEFAULT_BACKOFF_RATE` if `sleeptime` is 0).
+        """
+        host = urlsplit(url).netloc.lower()
+        if self.sleeptime > 0:
+            backoff_rate = 1.0 / self.sleeptime
+        else:
+            backoff_rate = DEFAULT_BACKOFF_RATE
+        with _rate_limiters_lock:
+            if host not in self._rate_limiters:
+                self._rate_limiters[host] = HostRateLimiter(
+                    host, rate=self.requests_per_second,
+                    max_concurrency=self.max_concurrency,
+                    backoff_rate=backoff_rate)
+            return self._rate_limiters[host]
+
 
 class Field(object):
 
@@ -93,6 +174,7 @@ class Field(object):
 
     def bind(self, config):
         self.config = config
+        self.extractor.prepare()
 
     def __repr__(self):
         desc = "<Field '{}' type_={} required={} multivalued={} extractor={}>"
@@ -0,0 +1,142 @@
+from ftw.crawler.metadata import SimpleMetadata
+from ftw.crawler.xml_utils import MARKUP_TYPES
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+# Elements whose content isn't part of a document's plain text
+SKIPPED_TAGS = ('head', 'script', 'style', 'template')
+
+# Elements that start a new line in a document's plain text
+BLOCK_TAGS = (
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl',
+    'dt', 'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2',
+    'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p',
+    'pre', 'section', 'table', 'td', 'th', 'tr', 'ul',
+)
+
+
+class MarkupConverter(object):
+    """Extracts metadata and plain text from HTML and XML documents locally
+    with lxml, instead of uploading them to Tika.
+
+    The metadata consists of the document's <title> and its <meta> tags
+    (keyed by their ``name`` or ``property``), which results in the same
+    `SimpleMetadata` keys (title, description, keywords, creator, ...) Tika
+    provides for HTML documents.
+    """
+
+    def extract(self, resource_info):
+        log.debug(u"Extracting metadata and plain text from '{}' with "
+                  "lxml.".format(resource_info.filename))
+
+        root = resource_info.tree.getroot()
+        if root is None:
+            return SimpleMetadata({}), u''
+
+        return (SimpleMetadata(self._extract_metadata(root)),
+                self._extract_text(root))
+
+    def extract_metadata(self, resource_info):
+        root = resource_info.tree.getroot()
+        if root is None:
+            return SimpleMetadata({})
+        return SimpleMetadata(self._extract_metadata(root))
+
+    def extract_text(self, resource_info):
+        root = resource_info.tree.getroot()
+        if root is None:
+            return u''
+        return self._extract_text(root)
+
+    def _extract_metadata(self, root):
+        metadata = {}
+        for meta in root.iter('meta'):
+            key = meta.get('name') or meta.get('property')
+            value = meta.get('content')
+            if not key or value is None:
+                continue
+            if key in metadata:
+                value = u' '.join((metadata[key], value))
+            metadata[key] = value
+
+        titles = root.xpath('//title/text()')
+        if titles:
+            metadata['title'] = u''.join(titles).strip()
+        return metadata
+
+    def _extract_text(self, root):
+        lines = []
+        current = []
+
+        def walk(element):
+            if not isinstance(element.tag, basestring):
+                # Comments and processing instructions
+                if element.tail:
+                    current.append(element.tail)
+                return
+
+            block = element.tag in BLOCK_TAGS
+            if block:
+                newline()
+            if element.tag not in SKIPPED_TAGS:
+                if element.text:
+                    current.append(element.text)
+                for child in element:
+                    walk(child)
+            if block:
+                newline()
+            if element.tail:
+                current.append(element.tail)
+
+        def newline():
+            line = u' '.join(u''.join(current).split())
+            if line:
+                lines.append(line)
+            del current[:]
+
+        walk(root)
+        newline()
+        return u'\n'.join(lines)
+
+
+class ContentTypeConverter(object):
+    """Chooses the converter for a resource by its content type, falling
+    back to the `default` converter for content types without one of their
+    own. Content types are matched case-insensitively.
+    """
+
+    def __init__(self, default, converters=None):
+        self.default = default
+        if converters is None:
+            converters = {}
+        self.converters = dict(
+            (content_type.lower(), converter)
+            for content_type, converter in converters.items())
+
+    def get_converter(self, content_type):
+        if content_type is None:
+            return self.default
+        return self.converters.get(content_type.lower(), self.default)
+
+    def extract(self, resource_info):
+        converter = self.get_converter(resource_info.content_type)
+        return converter.extract(resource_info)
+
+    def extract_metadata(self, resource_info):
+        converter = self.get_converter(resource_info.content_type)
+        return converter.extract_metadata(resource_info)
+
+    def extract_text(self, resource_info):
+        converter = self.get_converter(resource_info.content_type)
+        return converter.extract_text(resource_info)
+
+
+def markup_converters():
+    """Return a mapping that has all markup content types converted with
+    the `MarkupConverter`, for use as `Config(converters=...)`.
+    """
+    converter = MarkupConverter()
+    return dict((content_type, converter) for content_type in MARKUP_TYPES)
@@ -8,6 +8,28 @@ class FetchingError(FtwCrawlerException):
     """
 
 
+class TooManyRequests(FetchingError):
+    """The server asked us to slow down and retry a request later.
+
+    `retry_after` is the number of seconds the server asked us to wait
+    (from the Retry-After header), or ``None`` if it didn't say.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super(TooManyRequests, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class ResourceTooLarge(FetchingError):
+    """The resource exceeds the maximum body size configured for its site.
+    """
+
+
+class ConversionError(FtwCrawlerException):
+    """A converter (e.g. Tika) failed to convert a resource.
+    """
+
+
 class ExtractionError(FtwCrawlerException):
     """An error happend while attempting to apply an extractor.
     """
@@ -38,6 +60,11 @@ class NotModified(FtwCrawlerException):
     """
 
 
+class ContentUnchanged(FtwCrawlerException):
+    """A resource's content is the same as the last time it got indexed.
+    """
+
+
 class ConfigError(FtwCrawlerException):
     """A configuration error occurred.
     """
@@ -51,3 +78,16 @@ class SiteNotFound(ConfigError):
 class NoSitemapFound(FtwCrawlerException):
     """No sitemap could be found for the given site.
     """
+
+
+class SiteCrawlFailed(FtwCrawlerException):
+    """Crawling a site failed.
+
+    Stores the name of the original exception's type, so failures can be
+    reported the same way no matter whether the site has been crawled in the
+    main process or in a worker process.
+    """
+
+    def __init__(self, exc_type_name, message):
+        super(SiteCrawlFailed, self).__init__(message)
+        self.exc_type_name = exc_type_name
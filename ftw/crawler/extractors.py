@@ -1,13 +1,14 @@
-from BeautifulSoup import UnicodeDammit
 from datetime import datetime
+from ftw.crawler.exceptions import ConfigError
 from ftw.crawler.exceptions import ExtractionError
 from ftw.crawler.exceptions import NoValueExtracted
+from ftw.crawler.resource import METADATA
+from ftw.crawler.resource import TEXT
 from ftw.crawler.utils import from_iso_datetime
 from ftw.crawler.utils import get_content_type
 from ftw.crawler.utils import normalize_whitespace
 from ftw.crawler.utils import safe_unicode
 from ftw.crawler.xml_utils import MARKUP_TYPES
-from ftw.crawler.xml_utils import remove_namespaces
 from lxml import etree
 from slugify import slugify
 from urllib import unquote_plus
@@ -15,12 +16,26 @@ from urlparse import urlparse
 from uuid import UUID
 import hashlib
 import logging
-import lxml.html
+import pkg_resources
 
 
 log = logging.getLogger(__name__)
 
 
+try:
+    pkg_resources.get_distribution('cssselect')
+except pkg_resources.DistributionNotFound:
+    HAS_CSSSELECT = False
+else:
+    from cssselect import GenericTranslator
+    from cssselect import SelectorError
+    HAS_CSSSELECT = True
+
+
+# XPath expression for the title in the content of a page
+CONTENT_TITLE_XPATH = "//div[@id='content']/h1"
+
+
 class Extractor(object):
     """Base class for all extractors.
     """
@@ -28,9 +43,47 @@ class Extractor(object):
     def extract_value(self, resource_info):
         raise NotImplementedError
 
+    def extract(self, resource_info):
+        """Return the value extracted from the resource, but extract it only
+        once per resource, no matter how many fields and other extractors
+        use it.
+        """
+        extracted = resource_info.extracted
+        key = self.memo_key
+        if key not in extracted:
+            try:
+                extracted[key] = self.extract_value(resource_info)
+            except NoValueExtracted:
+                extracted[key] = NoValueExtracted
+        value = extracted[key]
+        if value is NoValueExtracted:
+            raise NoValueExtracted
+        return value
+
+    @property
+    def memo_key(self):
+        """The key the extracted value is memoized under. Extractors that
+        take no arguments extract the same value whatever instance is used,
+        so they share their class as key.
+        """
+        if type(self).__init__ is object.__init__:
+            return type(self)
+        return self
+
+    def dependencies(self):
+        """Return the extractors whose values this extractor uses.
+        """
+        return []
+
     def bind(self, field):
         self.field = field
 
+    def prepare(self):
+        """Called once the field the extractor belongs to is bound to the
+        configuration. Extractors compile and validate their arguments here,
+        so a bad configuration is reported before crawling starts.
+        """
+
     def __repr__(self):
         cls = self.__class__
         name = '.'.join((cls.__module__, cls.__name__))
@@ -76,6 +129,146 @@ class SiteConfigExtractor(Extractor):
     """
 
 
+def get_extractor_conversions(extractor):
+    """Return the parts of a resource (`METADATA` and / or `TEXT`) that have
+    to be extracted by a converter for the given extractor.
+    """
+    conversions = set()
+    if isinstance(extractor, MetadataExtractor):
+        conversions.add(METADATA)
+    if isinstance(extractor, TextExtractor):
+        conversions.add(TEXT)
+    return frozenset(conversions)
+
+
+def get_required_conversions(fields):
+    """Return the parts of a resource (`METADATA` and / or `TEXT`) that have
+    to be extracted by a converter for the given fields.
+    """
+    conversions = set()
+    for field in fields:
+        conversions |= get_extractor_conversions(field.extractor)
+    return frozenset(conversions)
+
+
+def convert(resource_info, converter, conversions=None):
+    """Have the given converter extract the parts of a resource listed in
+    `conversions` (all by default) and store them on the `ResourceInfo`.
+    Other parts are only extracted if they're accessed later on.
+    """
+    resource_info.converter = converter
+    if conversions is not None:
+        resource_info.conversions = conversions
+    resource_info.convert()
+
+
+def compile_xpath(expression):
+    """Compile an XPath expression, raising a `ConfigError` if it's invalid.
+    """
+    try:
+        return etree.XPath(expression)
+    except etree.XPathSyntaxError as exc:
+        raise ConfigError(
+            "Invalid XPath expression {!r}: {}".format(expression, exc))
+
+
+def compile_css(selector):
+    """Compile a CSS selector into an XPath expression, raising a
+    `ConfigError` if it's invalid. Needs the `cssselect` package.
+    """
+    if not HAS_CSSSELECT:
+        raise ConfigError(
+            "CSS selector {!r} can't be used without the cssselect package "
+            "(install ftw.crawler with the css extra).".format(selector))
+    try:
+        expression = GenericTranslator().css_to_xpath(selector)
+    except SelectorError as exc:
+        raise ConfigError(
+            "Invalid CSS selector {!r}: {}".format(selector, exc))
+    return compile_xpath(expression)
+
+
+def get_node_text(nodes, expression, resource_info):
+    """Return the text of the first of the nodes an XPath expression
+    selected in a markup document.
+    """
+    if len(nodes) == 0:
+        raise NoValueExtracted
+
+    elif len(nodes) > 1:
+        log.warn(
+            "XPath expression '{}' returned {} results for document at "
+            "{}, using only first one".format(
+                expression, len(nodes), resource_info.url_info['loc']))
+
+    target_node = nodes[0]
+    text = target_node.text_content()
+
+    if isinstance(text, etree._ElementUnicodeResult):
+        text = unicode(text)
+    elif isinstance(text, etree._ElementStringResult):
+        text = text.decode(resource_info.encoding)
+    else:
+        log.error(
+            "Unexpected return type for xpath(), expected"
+            "'_ElementUnicodeResult'. (Node: {})".format(target_node))
+        raise NoValueExtracted
+
+    return text
+
+
+def get_dependencies(extractor, _path=()):
+    """Return all extractors whose values the given extractor uses, directly
+    or indirectly.
+    """
+    path = _path + (extractor.memo_key, )
+    dependencies = []
+    for dependency in extractor.dependencies():
+        if dependency.memo_key in path:
+            raise ConfigError(
+                "Extractor {} depends on its own value.".format(extractor))
+        dependencies.append(dependency)
+        dependencies.extend(get_dependencies(dependency, path))
+    return dependencies
+
+
+class ExtractionPlan(object):
+    """The order in which the values of the given fields are extracted.
+
+    `dependencies` maps the name of every field to the names of the fields
+    whose values its extractor uses (e.g. with a `FieldMappingExtractor`).
+    Those fields are extracted first. Since extracted values are memoized
+    per resource, each of them is extracted only once.
+    """
+
+    def __init__(self, fields):
+        fields = list(fields)
+        fields_by_key = {}
+        for field in fields:
+            fields_by_key.setdefault(field.extractor.memo_key, []).append(
+                field)
+
+        self.dependencies = {}
+        for field in fields:
+            self.dependencies[field.name] = set(
+                other.name
+                for extractor in get_dependencies(field.extractor)
+                for other in fields_by_key.get(extractor.memo_key, [])
+                if other is not field)
+
+        fields_by_name = dict((field.name, field) for field in fields)
+        self.fields = []
+        for field in fields:
+            self._add(field, fields_by_name)
+
+    def _add(self, field, fields_by_name):
+        if field in self.fields:
+            return
+        for name in sorted(self.dependencies[field.name]):
+            self._add(fields_by_name[name], fields_by_name)
+        self.fields.append(field)
+
+
 class ExtractionEngine(object):
 
     extractor_types = (
@@ -84,15 +277,22 @@ class ExtractionEngine(object):
         TextFromMarkupExtractor
     )
 
-    def __init__(self, config, resource_info, converter):
+    def __init__(self, config, resource_info, converter=None, plan=None):
         self.config = config
         self.resource_info = resource_info
 
-        self.resource_info.metadata = converter.extract_metadata(
-            self.resource_info)
+        # The plan is usually built once, when the crawler is set up
+        if plan is None:
+            plan = ExtractionPlan(config.fields)
+        self.plan = plan
 
-        self.resource_info.text = safe_unicode(converter.extract_text(
-            self.resource_info))
+        # Without a converter, metadata and text are expected to have been
+        # extracted already (see `convert()`). Otherwise they're extracted
+        # when the extractors first access them.
+        if converter is not None:
+            resource_info.converter = converter
+            resource_info.conversions = get_required_conversions(
+                config.fields)
 
     def _unkown_extractor_type(self, extractor):
         cls = extractor.__class__
@@ -123,14 +323,14 @@ class ExtractionEngine(object):
 
     def extract_field_values(self):
         field_values = {}
-        for field in self.config.fields:
+        for field in self.plan.fields:
             extractor = field.extractor
 
             if not isinstance(extractor, ExtractionEngine.extractor_types):
                 self._unkown_extractor_type(extractor)
 
             try:
-                value = extractor.extract_value(self.resource_info)
+                value = extractor.extract(self.resource_info)
             except NoValueExtracted:
                 if field.required:
                     value = self._get_field_default(field)
@@ -190,7 +390,10 @@ class TargetURLExtractor(URLInfoExtractor):
         if 'target' in resource_info.url_info:
             return safe_unicode(resource_info.url_info['target'])
         else:
-            return URLExtractor().extract_value(resource_info)
+            return URLExtractor().extract(resource_info)
+
+    def dependencies(self):
+        return [URLExtractor()]
 
 
 class TitleExtractor(MetadataExtractor, HTTPHeaderExtractor, URLInfoExtractor):
@@ -202,9 +405,8 @@ class TitleExtractor(MetadataExtractor, HTTPHeaderExtractor, URLInfoExtractor):
             return header_value.decode('base64').decode('utf-8').strip()
 
         # Next, try to get title from a `div#content h1` element
-        h1_extractor = XPathExtractor("//div[@id='content']/h1")
         try:
-            value = h1_extractor.extract_value(resource_info)
+            value = CONTENT_TITLE_EXTRACTOR.extract(resource_info)
             return value
         except NoValueExtracted:
             pass
@@ -215,11 +417,11 @@ class TitleExtractor(MetadataExtractor, HTTPHeaderExtractor, URLInfoExtractor):
         if value is None:
             try:
                 # Fall back to filename from Content-Disposition header
-                value = FilenameExtractor().extract_value(resource_info)
+                value = FilenameExtractor().extract(resource_info)
             except NoValueExtracted:
                 # As a last resort, use a slug built from the rightmost part
                 # of the resource's URL
-                value = SlugExtractor().extract_value(resource_info)
+                value = SlugExtractor().extract(resource_info)
 
         return value
 
@@ -227,62 +429,134 @@ class TitleExtractor(MetadataExtractor, HTTPHeaderExtractor, URLInfoExtractor):
         title = self._extract_title(resource_info)
         return normalize_whitespace(title)
 
+    def dependencies(self):
+        return [CONTENT_TITLE_EXTRACTOR, FilenameExtractor(), SlugExtractor()]
+
 
 class XPathExtractor(TextFromMarkupExtractor, URLInfoExtractor):
 
     def __init__(self, xpath):
         self.xpath = xpath
+        self._compiled = None
 
-    def _sniff_encoding(self, resource_info):
-        with open(resource_info.filename) as f:
-            data = f.read()
-            proposed = ["utf-8", "latin1"]
-            converted = UnicodeDammit(data, proposed, isHTML=True)
-        del data
-        return converted.originalEncoding
-
-    def _get_tree(self, resource_info, encoding):
-        # Use HTMLParser for everything, even XML / XHTML.
-        if encoding is not None:
-            parser = lxml.html.HTMLParser(encoding=encoding)
-        else:
-            parser = lxml.html.HTMLParser()
-        tree = etree.parse(resource_info.filename, parser)
-        tree = remove_namespaces(tree)
-        return tree
+    @property
+    def memo_key(self):
+        return (type(self), self.xpath)
+
+    @property
+    def compiled(self):
+        """The compiled XPath expression. Compiled when the extractor is
+        prepared, or else when it's first used.
+        """
+        self.prepare()
+        return self._compiled
+
+    def prepare(self):
+        if self._compiled is None:
+            self._compiled = compile_xpath(self.xpath)
 
     def extract_value(self, resource_info):
         if not resource_info.content_type in MARKUP_TYPES:
             raise NoValueExtracted
 
-        encoding = self._sniff_encoding(resource_info)
+        # The document is parsed only once for all extractors
+        nodes = self.compiled(resource_info.tree)
+        return get_node_text(nodes, self.xpath, resource_info)
 
-        tree = self._get_tree(resource_info, encoding)
-        nodes = tree.xpath(self.xpath)
 
-        if len(nodes) == 0:
-            raise NoValueExtracted
+# Shared by all `TitleExtractor`s, so the expression is only compiled once
+CONTENT_TITLE_EXTRACTOR = XPathExtractor(CONTENT_TITLE_XPATH)
+CONTENT_TITLE_EXTRACTOR.prepare()
 
-        elif len(nodes) > 1:
-            log.warn(
-                "XPath expression '{}' returned {} results for document at "
-                "{}, using only first one".format(
-                    self.xpath, len(nodes), resource_info.url_info['loc']))
 
-        target_node = nodes[0]
-        text = target_node.text_content()
+class MultiXPathExtractor(TextFromMarkupExtractor, URLInfoExtractor):
+    """Extracts the text of several named XPath expressions and / or CSS
+    selectors from a markup document at once, as a dict.
 
-        if isinstance(text, etree._ElementUnicodeResult):
-            text = unicode(text)
-        elif isinstance(text, etree._ElementStringResult):
-            text = text.decode(encoding)
-        else:
-            log.error(
-                "Unexpected return type for xpath(), expected"
-                "'_ElementUnicodeResult'. (Node: {})".format(target_node))
+    The expressions are compiled once, when the extractor is prepared, and
+    evaluated one after the other on the shared tree of the document in a
+    single extraction, which is done only once per document. Fields get
+    their value with an extractor returned by `select()`:
+
+        selectors = MultiXPathExtractor(
+            xpaths={'title': "//div[@id='content']/h1"},
+            css={'lead': 'p.lead'})
+        Field('title', extractor=selectors.select('title'))
+        Field('lead', extractor=selectors.select('lead'))
+
+    CSS selectors need the `cssselect` package.
+    """
+
+    def __init__(self, xpaths=None, css=None):
+        if xpaths is None:
+            xpaths = {}
+        if css is None:
+            css = {}
+        duplicates = set(xpaths) & set(css)
+        if duplicates:
+            raise ConfigError("Selector names used for both XPath and CSS: "
+                              "{}".format(', '.join(sorted(duplicates))))
+        self.xpaths = xpaths
+        self.css = css
+        self._compiled = None
+
+    @property
+    def compiled(self):
+        """The compiled expressions as (name, expression, XPath) tuples.
+        """
+        self.prepare()
+        return self._compiled
+
+    def prepare(self):
+        if self._compiled is None:
+            compiled = []
+            for name, xpath in sorted(self.xpaths.items()):
+                compiled.append((name, xpath, compile_xpath(xpath)))
+            for name, selector in sorted(self.css.items()):
+                compiled.append((name, selector, compile_css(selector)))
+            self._compiled = compiled
+
+    def select(self, name):
+        """Return an extractor for the value of the selector `name`.
+        """
+        if name not in self.xpaths and name not in self.css:
+            raise ConfigError("No selector named {!r}.".format(name))
+        return SelectedValueExtractor(self, name)
+
+    def extract_value(self, resource_info):
+        if not resource_info.content_type in MARKUP_TYPES:
             raise NoValueExtracted
 
-        return text
+        tree = resource_info.tree
+        values = {}
+        for name, expression, xpath in self.compiled:
+            try:
+                values[name] = get_node_text(
+                    xpath(tree), expression, resource_info)
+            except NoValueExtracted:
+                continue
+        return values
+
+
+class SelectedValueExtractor(TextFromMarkupExtractor, URLInfoExtractor):
+    """Extracts the value of one of the selectors of a `MultiXPathExtractor`.
+    """
+
+    def __init__(self, selectors, name):
+        self.selectors = selectors
+        self.name = name
+
+    def prepare(self):
+        self.selectors.prepare()
+
+    def dependencies(self):
+        return [self.selectors]
+
+    def extract_value(self, resource_info):
+        values = self.selectors.extract(resource_info)
+        if self.name not in values:
+            raise NoValueExtracted
+        return values[self.name]
 
 
 class DescriptionExtractor(MetadataExtractor):
@@ -308,14 +582,17 @@ class SnippetTextExtractor(TextExtractor, MetadataExtractor,
 
     def _get_title(self, resource_info):
         extractor = TitleExtractor()
-        title = extractor.extract_value(resource_info)
+        title = extractor.extract(resource_info)
         return title.strip()
 
     def _get_plain_text(self, resource_info):
         extractor = PlainTextExtractor()
-        plain_text = extractor.extract_value(resource_info)
+        plain_text = extractor.extract(resource_info)
         return plain_text.strip()
 
+    def dependencies(self):
+        return [PlainTextExtractor(), TitleExtractor()]
+
     def extract_value(self, resource_info):
         plain_text = safe_unicode(self._get_plain_text(resource_info))
         title = safe_unicode(self._get_title(resource_info))
@@ -340,9 +617,12 @@ class LastModifiedExtractor(URLInfoExtractor, HTTPHeaderExtractor):
             utc_dt = from_iso_datetime(resource_info.headers['last-modified'])
             return utc_dt
 
-        utc_dt = IndexingTimeExtractor().extract_value(resource_info)
+        utc_dt = IndexingTimeExtractor().extract(resource_info)
         return utc_dt
 
+    def dependencies(self):
+        return [IndexingTimeExtractor()]
+
 
 class FilenameExtractor(HTTPHeaderExtractor):
 
@@ -360,6 +640,31 @@ class FilenameExtractor(HTTPHeaderExtractor):
         raise NoValueExtracted
 
 
+class ETagExtractor(HTTPHeaderExtractor):
+    """Extracts the resource's ETag, to be stored in `Config.etag_field` for
+    conditional requests on the next crawl.
+    """
+
+    def extract_value(self, resource_info):
+        # TODO: We rely on requests.structures.CaseInsensitiveDict here
+        etag = resource_info.headers.get('etag')
+        if etag is None:
+            raise NoValueExtracted
+        return safe_unicode(etag)
+
+
+class ContentHashExtractor(HTTPHeaderExtractor):
+    """Extracts the hash of the resource's content, to be stored in
+    `Config.content_hash_field` so unchanged content can be skipped on the
+    next crawl. Like the headers, the hash is determined by the fetcher.
+    """
+
+    def extract_value(self, resource_info):
+        if resource_info.content_hash is None:
+            raise NoValueExtracted
+        return safe_unicode(resource_info.content_hash)
+
+
 class KeywordsExtractor(MetadataExtractor):
 
     def extract_value(self, resource_info):
@@ -455,9 +760,12 @@ class FieldMappingExtractor(HTTPHeaderExtractor):
         else:
             raise NoValueExtracted
 
+    def _get_mapped_field(self):
+        return self.field.config.get_field(self.field_name)
+
     def extract_value(self, resource_info):
-        mapped_field = self.field.config.get_field(self.field_name)
-        field_value = mapped_field.extractor.extract_value(resource_info)
+        mapped_field = self._get_mapped_field()
+        field_value = mapped_field.extractor.extract(resource_info)
         if field_value is None:
             # Field not extracted
             return self._default_or_raise()
@@ -467,3 +775,6 @@ class FieldMappingExtractor(HTTPHeaderExtractor):
         else:
             # Field present but not mapped
             return self._default_or_raise()
+
+    def dependencies(self):
+        return [self._get_mapped_field().extractor]
@@ -1,16 +1,28 @@
+from ftw.crawler.cache import content_hasher
 from ftw.crawler.exceptions import AttemptedRedirect
+from ftw.crawler.exceptions import ContentUnchanged
 from ftw.crawler.exceptions import FetchingError
 from ftw.crawler.exceptions import NotModified
+from ftw.crawler.exceptions import ResourceTooLarge
+from ftw.crawler.exceptions import TooManyRequests
+from ftw.crawler.ratelimit import HostRateLimiter
 from ftw.crawler.utils import from_iso_datetime
 from ftw.crawler.utils import get_content_type
+from ftw.crawler.utils import parse_retry_after
+from ftw.crawler.utils import to_http_datetime
+from urlparse import urlsplit
 import logging
+import os
 import tempfile
-import time
 
 
 log = logging.getLogger(__name__)
 
 
+# Size of the chunks (in bytes) a resource is downloaded in
+CHUNK_SIZE = 64 * 1024
+
+
 class ResourceFetcher(object):
 
     def __init__(self, resource_info, session, tempdir, options):
@@ -20,10 +32,21 @@ class ResourceFetcher(object):
         self.tempdir = tempdir
         self.options = options
 
+        url = self.url_info['loc'] if self.url_info else None
+        if resource_info.site is not None:
+            self.rate_limiter = resource_info.site.get_rate_limiter(url)
+        else:
+            self.rate_limiter = HostRateLimiter(urlsplit(url or '').netloc)
+
     def _mktmp(self):
         return tempfile.NamedTemporaryFile(dir=self.tempdir, delete=False)
 
     def is_modified(self):
+        """Return whether the resource has been modified since it was last
+        indexed, according to the sitemap's ``lastmod``. Without a
+        ``lastmod``, the server decides by answering the conditional GET
+        sent by `fetch()`.
+        """
         if self.resource_info.last_indexed is None:
             return True
 
@@ -31,53 +54,143 @@ class ResourceFetcher(object):
             last_modified = self.url_info['lastmod']
             last_modified = from_iso_datetime(last_modified)
             return last_modified > self.resource_info.last_indexed
-
-        # No 'lastmod' in urlinfo - fall back to a HEAD request
-        response = self.session.head(self.url_info['loc'])
-        if 'last-modified' in response.headers:
-            # TODO: Use 'closing' context manager in order to avoid
-            # blocking connection pool
-            last_modified = response.headers['last-modified']
-            last_modified = from_iso_datetime(last_modified)
-            return last_modified > self.resource_info.last_indexed
         return True
 
+    def get_conditional_headers(self):
+        """Return the headers that make the GET request for the resource
+        conditional, so the server responds with ``304 Not Modified`` instead
+        of the body if the resource didn't change since it was last indexed.
+        """
+        headers = {}
+        resource_info = self.resource_info
+        if resource_info.etag:
+            headers['If-None-Match'] = resource_info.etag
+
+        # The sitemap's lastmod already told us the resource was modified
+        if (resource_info.last_indexed is not None and
+                'lastmod' not in self.url_info):
+            headers['If-Modified-Since'] = to_http_datetime(
+                resource_info.last_indexed)
+        return headers
+
     def fetch(self):
+        """Fetch the resource and save it to a temporary file.
+
+        Unless forced, resources that were indexed before are requested with
+        a conditional GET, and `NotModified` is raised if the server responds
+        with ``304 Not Modified``.
+
+        The body is streamed to the file in chunks and hashed on the way.
+        If it's larger than the site's `max_body_size`, the download is
+        aborted and `ResourceTooLarge` is raised. If its hash is the same as
+        the one of the content that was indexed last time, the file is
+        removed again and `ContentUnchanged` is raised (unless forced).
+
+        If the server responds with 429 Too Many Requests (or with 503
+        Service Unavailable and a Retry-After header), `TooManyRequests` is
+        raised, telling the caller after how many seconds (if at all) the
+        server asked for the request to be retried. The host's rate limiter
+        backs off in any case.
+        """
         resource_info = self.resource_info
         url = self.url_info['loc']
 
-        modified = self.is_modified()
-        if not self.options.force and not modified:
+        headers = {}
+        if not self.options.force:
+            if not self.is_modified():
+                raise NotModified
+            headers = self.get_conditional_headers()
+
+        # The host's concurrency slot is held until the streamed body has
+        # been downloaded and the connection released
+        self.rate_limiter.acquire()
+        status_code = None
+        try:
+            response = self.session.get(
+                url, allow_redirects=False, stream=True, headers=headers)
+            status_code = resource_info.status_code = response.status_code
+            try:
+                self._check_response(response)
+                filename, content_hash = self._download(response)
+            finally:
+                # Releases the connection, even if the body hasn't been read
+                response.close()
+        finally:
+            self.rate_limiter.release(status_code)
+
+        if (not self.options.force and
+                content_hash == resource_info.last_content_hash):
+            os.unlink(filename)
+            raise ContentUnchanged
+
+        content_type = get_content_type(response.headers.get('Content-Type'))
+
+        resource_info.filename = filename
+        resource_info.content_hash = content_hash
+        resource_info.content_type = content_type
+        resource_info.headers = response.headers
+
+        log.debug(u"Resource saved to {}".format(resource_info.filename))
+        return resource_info
+
+    def _check_response(self, response):
+        url = self.url_info['loc']
+        if response.status_code == 304:
             raise NotModified
 
-        response = self.session.get(url, allow_redirects=False)
         if response.is_redirect:
             # TODO: With redirects it's unclear which URL to use as the
             # canonical URL - so we don't allow them for now.
             log.warn(u"URL {} attempted a redirect - skipped.".format(url))
             raise AttemptedRedirect(url)
 
-        while response.status_code == 429:
-            log.warn(u"429 Too Many Requests, sleeping for {}s".format(
-                self.resource_info.site.sleeptime))
-            time.sleep(self.resource_info.site.sleeptime)
-            response = self.session.get(url, allow_redirects=False)
-            if response.status_code == 429:
-                self.resource_info.site.sleeptime *= 2
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if response.status_code == 429 or (
+                response.status_code == 503 and retry_after is not None):
+            raise TooManyRequests(
+                u"{} Too Many Requests for {}".format(
+                    response.status_code, url),
+                retry_after=retry_after)
 
         if not response.status_code == 200:
             raise FetchingError(u"Could not fetch {}. Got status {}".format(
                 url, response.status_code))
 
+        max_size = self.max_body_size
+        content_length = response.headers.get('Content-Length')
+        if (max_size is not None and content_length is not None and
+                content_length.isdigit() and int(content_length) > max_size):
+            raise self._too_large(int(content_length))
+
+    def _download(self, response):
+        """Stream the response body to a temporary file in chunks, and
+        return the file's name and the hash of its content.
+        """
+        max_size = self.max_body_size
+        size = 0
+        hasher = content_hasher()
         with self._mktmp() as resource_file:
-            resource_file.write(response.content)
-
-        content_type = get_content_type(response.headers.get('Content-Type'))
-
-        resource_info.filename = resource_file.name
-        resource_info.content_type = content_type
-        resource_info.headers = response.headers
-        resource_info.filename = resource_file.name
-
-        log.debug(u"Resource saved to {}".format(resource_info.filename))
-        return resource_info
+            try:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise self._too_large(size)
+                    resource_file.write(chunk)
+                    hasher.update(chunk)
+            except:
+                resource_file.close()
+                os.unlink(resource_file.name)
+                raise
+        return resource_file.name, hasher.hexdigest()
+
+    @property
+    def max_body_size(self):
+        site = self.resource_info.site
+        if site is None:
+            return None
+        return site.max_body_size
+
+    def _too_large(self, size):
+        return ResourceTooLarge(
+            u"body of at least {} bytes exceeds the maximum of {}".format(
+                size, self.max_body_size))
@@ -0,0 +1,78 @@
+from ftw.crawler.utils import from_iso_datetime
+
+
+class IndexedDocs(object):
+    """The documents of a site that are currently indexed in Solr, as
+    returned by a search for the unique, URL and last modified (and ETag
+    and content hash) fields.
+
+    Iterating over it yields the documents. Lookups by URL are done through
+    a mapping that is built once, and last modified dates are only parsed
+    when they're asked for.
+
+    The ETag and content hash are looked up in `etag_field` and
+    `content_hash_field`, by default the ones named in the `Config`.
+    """
+
+    def __init__(self, config, docs, etag_field=None,
+                 content_hash_field=None):
+        self.unique_field = config.unique_field
+        self.url_field = config.url_field
+        self.last_modified_field = config.last_modified_field
+        if etag_field is None:
+            etag_field = config.etag_field
+        self.etag_field = etag_field
+        if content_hash_field is None:
+            content_hash_field = config.content_hash_field
+        self.content_hash_field = content_hash_field
+
+        self.docs = list(docs)
+        self._docs_by_url = {}
+        for doc in self.docs:
+            self._docs_by_url.setdefault(doc[self.url_field], doc)
+        self._indexing_times = {}
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, url):
+        return url in self._docs_by_url
+
+    def get(self, url):
+        return self._docs_by_url.get(url)
+
+    def get_indexing_time(self, url):
+        """Return the time the document with the given URL was last indexed
+        as a datetime, or ``None`` if it isn't indexed.
+        """
+        if url not in self._indexing_times:
+            doc = self._docs_by_url.get(url)
+            isodate = None
+            if doc is not None:
+                isodate = doc.get(self.last_modified_field)
+            if isodate is not None:
+                self._indexing_times[url] = from_iso_datetime(isodate)
+            else:
+                self._indexing_times[url] = None
+        return self._indexing_times[url]
+
+    def get_etag(self, url):
+        """Return the ETag the document with the given URL had when it was
+        last indexed, or ``None`` if it's unknown.
+        """
+        return self._get_value(url, self.etag_field)
+
+    def get_content_hash(self, url):
+        """Return the hash of the content the document with the given URL
+        had when it was last indexed, or ``None`` if it's unknown.
+        """
+        return self._get_value(url, self.content_hash_field)
+
+    def _get_value(self, url, field):
+        doc = self._docs_by_url.get(url)
+        if doc is None or field is None:
+            return None
+        return doc.get(field)
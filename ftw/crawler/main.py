@@ -1,27 +1,60 @@
 from ftw.crawler import parse_args
+from ftw.crawler.cache import ConversionCache
+from ftw.crawler.checkpoint import Checkpoint
 from ftw.crawler.configuration import get_config
+from ftw.crawler.converters import ContentTypeConverter
 from ftw.crawler.exceptions import AttemptedRedirect
+from ftw.crawler.exceptions import ConfigError
+from ftw.crawler.exceptions import ContentUnchanged
+from ftw.crawler.exceptions import ConversionError
 from ftw.crawler.exceptions import FetchingError
 from ftw.crawler.exceptions import NotModified
+from ftw.crawler.exceptions import ResourceTooLarge
+from ftw.crawler.exceptions import SiteCrawlFailed
+from ftw.crawler.exceptions import TooManyRequests
+from ftw.crawler.extractors import convert
 from ftw.crawler.extractors import ExtractionEngine
+from ftw.crawler.extractors import ExtractionPlan
+from ftw.crawler.extractors import get_extractor_conversions
+from ftw.crawler.extractors import get_required_conversions
 from ftw.crawler.fetcher import ResourceFetcher
+from ftw.crawler.indexed_docs import IndexedDocs
+from ftw.crawler.pipeline import CRAWL_STAGES
+from ftw.crawler.pipeline import Pipeline
+from ftw.crawler.pipeline import RetryLater
+from ftw.crawler.pipeline import Stage
 from ftw.crawler.purging import purge_removed_docs_from_index
 from ftw.crawler.resource import ResourceInfo
 from ftw.crawler.sitemap import SitemapIndexFetcher
+from ftw.crawler.solr import BatchIndexer
 from ftw.crawler.solr import SolrConnector
 from ftw.crawler.solr import solr_escape
+from ftw.crawler.state import CONTENT_HASH_KEY
+from ftw.crawler.state import CrawlState
+from ftw.crawler.state import ETAG_KEY
 from ftw.crawler.tika import TikaConverter
-from ftw.crawler.utils import from_iso_datetime
+from ftw.crawler.utils import create_session
+from Queue import Queue
 import logging
+import multiprocessing
 import os
-import requests
 import shutil
+import signal
 import tempfile
+import threading
 import pkg_resources
 
 
 log = logging.getLogger(__name__)
 
+# Longest Retry-After (in seconds) we're willing to wait for before giving
+# up on a throttled URL
+MAX_RETRY_AFTER = 600
+
+# Set when the crawler has been asked to stop (SIGTERM): documents in
+# progress are finished and indexed, but no new ones are started
+shutdown_requested = threading.Event()
+
 
 try:
     pkg_resources.get_distribution('slacker')
@@ -46,126 +79,667 @@ def display_fields(field_values):
     log.debug(u"")
 
 
-def get_indexed_docs(config, solr, site):
+def create_solr_connector(config):
+    return SolrConnector(
+        config.solr, page_size=config.solr_page_size,
+        pool_size=config.solr_pool_size, timeout=config.solr_timeout)
+
+
+def create_converter(config):
+    cache = None
+    if config.tika_cache_dir:
+        cache = ConversionCache(
+            config.tika_cache_dir, max_size=config.tika_cache_size)
+
+    converter = TikaConverter(
+        config.tika, pool_size=config.tika_pool_size,
+        timeout=config.tika_timeout, single_pass=config.tika_single_pass,
+        cache=cache, max_concurrency=config.tika_max_concurrency,
+        cooldown=config.tika_cooldown)
+    if config.converters:
+        converter = ContentTypeConverter(converter, config.converters)
+    return converter
+
+
+def report_conversions(config):
+    """Log which parts of the documents the configured fields need Tika (or
+    another converter) to extract.
+    """
+    for field in config.fields:
+        conversions = get_extractor_conversions(field.extractor)
+        if conversions:
+            log.debug(u"Field {} needs the {} of documents.".format(
+                field.name, u' and '.join(sorted(conversions))))
+
+    conversions = get_required_conversions(config.fields)
+    if conversions:
+        log.info(u"Configured fields need the {} of documents.".format(
+            u' and '.join(sorted(conversions))))
+    else:
+        log.info(u"Configured fields need neither metadata nor text of "
+                 u"documents, not converting them.")
+
+
+def report_extraction_plan(config):
+    """Log which fields use the values of other fields. Building the plan
+    also makes sure the fields don't depend on each other in a cycle.
+    """
+    plan = ExtractionPlan(config.fields)
+    for field in plan.fields:
+        dependencies = plan.dependencies[field.name]
+        if dependencies:
+            log.debug(u"Field {} uses the value of {}.".format(
+                field.name, u', '.join(sorted(dependencies))))
+
+
+def create_crawl_state(config):
+    if config.state_db is None:
+        return None
+    return CrawlState(config.state_db)
+
+
+def get_indexed_docs(config, solr, site, state=None):
+    """Return the documents of a site that are indexed as `IndexedDocs`.
+
+    If a crawl state is used and the site has been crawled with it before,
+    they're taken from the crawl state. Otherwise Solr is queried, and the
+    crawl state (if any) is built from the result.
+    """
+    if state is not None and state.has_site(site.url):
+        log.info(u"Using indexed documents of {} recorded in {}".format(
+            site.url, state.path))
+        return IndexedDocs(config, state.get_indexed_docs(config, site.url),
+                           etag_field=ETAG_KEY,
+                           content_hash_field=CONTENT_HASH_KEY)
+
     if site.crawler_site_id is not None:
         query = 'crawler_site_id:{}'.format(site.crawler_site_id)
     else:
         query = '{}:{}*'.format(config.url_field, solr_escape(site.url))
 
-    indexed_docs = solr.search(
-        query,
-        fl=(config.unique_field, config.url_field, config.last_modified_field))
+    fl = [config.unique_field, config.url_field, config.last_modified_field]
+    for field in (config.etag_field, config.content_hash_field):
+        if field is not None:
+            fl.append(field)
+
+    indexed_docs = IndexedDocs(config, solr.search_iter(
+        query, sort='{} asc'.format(config.unique_field), fl=fl))
+    if state is not None:
+        state.import_indexed_docs(site.url, indexed_docs)
     return indexed_docs
 
 
-def get_indexing_time(url, indexed_docs, config):
-    for doc in indexed_docs:
-        if doc[config.url_field] == url:
-            isodate = doc[config.last_modified_field]
-            return from_iso_datetime(isodate)
-    return None
+def request_shutdown(signum, frame):
+    log.warn(u"Received signal {}, finishing the documents in progress "
+             u"before stopping...".format(signum))
+    shutdown_requested.set()
 
 
 def crawl_and_index(tempdir, config, options):
-    solr = SolrConnector(config.solr)
+    if getattr(options, 'resume', False) and config.checkpoint_dir is None:
+        raise ConfigError(
+            'Resuming a crawl requires a checkpoint_dir in the config.')
 
     if HAS_SLACK:
         slacklogger = SlackLogger(options.slacktoken)
 
+    sites = []
     for site in config.sites:
         # Skip non-matching sites if we're only indexing a specific URL
         if options.url and not options.url.startswith(site.url):
             continue
+        sites.append(site)
+    sites_by_url = dict((site.url, site) for site in sites)
 
-        try:
-            crawl_site(tempdir, config, options, solr, site)
-        except Exception as ex:
-            log.error('Failed to crawl {}'.format(site.url))
-            log.error('{}: {}'.format(type(ex).__name__, str(ex.message)))
-            log.info('Continuing with next site...')
-            if HAS_SLACK:
-                slacklogger.logError(ex, site, options.slackchannel)
-            continue
-
-
-def crawl_site(tempdir, config, options, solr, site):
-    # Fetch and parse the sitemap index (or build a virtual one)
-    sitemap_index = SitemapIndexFetcher(site).fetch()
-
-    log.info(u"Crawling {} [{} sitemap(s)]...".format(
-        site.url, len(sitemap_index.sitemaps)))
+    report_conversions(config)
+    report_extraction_plan(config)
 
-    # Get all docs indexed in Solr for a particular site
-    indexed_docs = get_indexed_docs(config, solr, site)
-
-    # Purge docs that have been removed from sitemap(s) from Solr index
-    purge_removed_docs_from_index(config, sitemap_index, indexed_docs)
+    state = None
+    site_parallelism = getattr(options, 'site_parallelism', None) or 1
+    if site_parallelism > 1 and len(sites) > 1:
+        results = crawl_sites_in_processes(
+            tempdir, options, sites, site_parallelism)
+    else:
+        # Connections to Solr and Tika (and the crawl state) are shared by
+        # all sites
+        solr = create_solr_connector(config)
+        converter = create_converter(config)
+        state = create_crawl_state(config)
+        results = (crawl_site_safely(tempdir, config, options, solr, site,
+                                     converter, state)
+                   for site in sites
+                   if not shutdown_requested.is_set())
+
+    failures = 0
+    for site_url, error in results:
+        if error is None:
+            continue
 
-    # Create a requests session to allow for connection pooling
-    fetcher_session = requests.Session()
+        failures += 1
+        site = sites_by_url[site_url]
+        log.error('Failed to crawl {}'.format(site.url))
+        log.error('{}: {}'.format(error.exc_type_name, error.message))
+        log.info('Continuing with next site...')
+        if HAS_SLACK:
+            slacklogger.logError(error, site, options.slackchannel)
+
+    log.info(u"Crawled {} site(s), {} failed.".format(len(sites), failures))
+    if shutdown_requested.is_set():
+        log.warn(u"The crawl has been interrupted. Run the crawler with "
+                 u"--resume to continue where it stopped.")
+
+    if state is not None:
+        state.close()
+
+
+def crawl_site_safely(tempdir, config, options, solr, site, converter=None,
+                      state=None):
+    """Crawl a site and return a ``(site_url, error)`` tuple, where error
+    is a ``SiteCrawlFailed`` exception if crawling the site failed, ``None``
+    otherwise.
+    """
+    try:
+        crawl_site(tempdir, config, options, solr, site, converter, state)
+    except Exception as ex:
+        log.debug(u"Failed to crawl {}".format(site.url), exc_info=True)
+        return site.url, SiteCrawlFailed(type(ex).__name__, str(ex.message))
+    return site.url, None
+
+
+def crawl_site_in_process(args):
+    """Entry point for crawling a single site in a worker process.
+
+    The configuration is loaded again from the config file, and the process
+    uses its own temporary directory, Solr connector, crawl state and
+    requests session.
+    Errors are returned as plain values, since arbitrary exceptions can't
+    necessarily be pickled and sent back to the parent process.
+    """
+    parent_tempdir, options, site_url = args
+    tempdir = tempfile.mkdtemp(prefix='ftw.crawler_', dir=parent_tempdir)
+    state = None
+    try:
+        config = get_config(options)
+        site = config.get_site(site_url)
+        solr = create_solr_connector(config)
+        state = create_crawl_state(config)
+        site_url, error = crawl_site_safely(
+            tempdir, config, options, solr, site, state=state)
+    except Exception as ex:
+        error = SiteCrawlFailed(type(ex).__name__, str(ex.message))
+    finally:
+        if state is not None:
+            state.close()
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    if error is None:
+        return site_url, None, None
+    return site_url, error.exc_type_name, error.message
+
+
+def crawl_sites_in_processes(tempdir, options, sites, site_parallelism):
+    """Crawl sites in parallel, using up to ``site_parallelism`` worker
+    processes, and yield a ``(site_url, error)`` tuple for every site as soon
+    as it's done.
+
+    Sites are only handed to the pool as processes become free, so once a
+    shutdown is requested, no further sites are started and only the sites
+    in progress are waited for.
+    """
+    log.info(u"Crawling {} sites using {} processes...".format(
+        len(sites), site_parallelism))
+
+    # Every site gets a fresh process, so no state is shared between sites
+    pool = multiprocessing.Pool(processes=site_parallelism,
+                                maxtasksperchild=1)
+    done = Queue()
+    pending = list(sites)
+    running = 0
+    try:
+        while True:
+            while (pending and running < site_parallelism and
+                    not shutdown_requested.is_set()):
+                site = pending.pop(0)
+                pool.apply_async(crawl_site_in_process,
+                                 [(tempdir, options, site.url)],
+                                 callback=done.put)
+                running += 1
+
+            if not running:
+                break
+
+            site_url, exc_type_name, message = done.get()
+            running -= 1
+            if exc_type_name is None:
+                log.info(u"Done crawling {}".format(site_url))
+                yield site_url, None
+            else:
+                yield site_url, SiteCrawlFailed(exc_type_name, message)
+
+        if pending:
+            log.warn(u"Not crawling the remaining {} site(s).".format(
+                len(pending)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def get_workers(site, options):
+    """Number of concurrent workers to crawl a site with. The command line
+    option takes precedence over the site's configuration.
+    """
+    workers = getattr(options, 'workers', None)
+    if workers is None:
+        workers = site.workers
+    return max(1, workers)
+
+
+def get_stage_workers(site, options):
+    """Number of workers for each stage of the crawling pipeline.
+
+    Stages without an explicit setting (in the site config or via the
+    ``--stage-workers`` command line option, which takes precedence) use
+    the site's number of workers.
+    """
+    workers = get_workers(site, options)
+    stage_workers = dict((name, workers) for name in CRAWL_STAGES)
+
+    overrides = dict(site.stage_workers)
+    overrides.update(getattr(options, 'stage_workers', None) or [])
+    for name, count in overrides.items():
+        if name not in CRAWL_STAGES:
+            raise ConfigError(
+                "Unknown crawling stage {!r} for {}, must be one of "
+                "{}".format(name, site.url, ', '.join(CRAWL_STAGES)))
+        stage_workers[name] = max(1, count)
+    return stage_workers
+
+
+def get_max_retries(site, options):
+    """Maximum number of throttled requests to retry while crawling a site.
+    The command line option takes precedence over the site's configuration.
+    """
+    max_retries = getattr(options, 'max_retries', None)
+    if max_retries is None:
+        max_retries = site.max_retries
+    return max(0, max_retries)
+
+
+class CrawlItem(object):
+    """A URL passing through the stages of the crawling pipeline.
+    """
+
+    def __init__(self, sitemap, url_info, progress):
+        self.sitemap = sitemap
+        self.url_info = url_info
+        self.progress = progress
+        self.resource_info = None
+        self.field_values = None
+        self.attempts = 0
+
+    @property
+    def url(self):
+        return self.url_info['loc']
+
+
+class SiteCrawler(object):
+    """Fetches, extracts and indexes all URLs listed in a site's sitemaps.
+
+    Every URL passes through a pipeline of stages: fetching the resource,
+    converting it with Tika, extracting the field values and indexing them
+    in Solr. Each stage has its own number of workers, see
+    ``get_stage_workers()``.
+    """
+
+    def __init__(self, tempdir, config, options, solr, site, converter=None,
+                 state=None):
+        self.tempdir = tempdir
+        self.config = config
+        self.options = options
+        self.solr = solr
+        self.site = site
+        self.stage_workers = get_stage_workers(site, options)
+
+        # Create a requests session to allow for connection pooling
+        self.fetcher_session = create_session(
+            pool_size=self.stage_workers['fetch'])
+        if converter is None:
+            converter = create_converter(config)
+        self.converter = converter
+        self.conversions = get_required_conversions(config.fields)
+        self.extraction_plan = ExtractionPlan(config.fields)
+        self.indexer = BatchIndexer(
+            solr, batch_size=config.solr_batch_size,
+            commit_within=config.solr_commit_within)
+        self.indexed_docs = None
+        self.checkpoint = None
+        if state is None:
+            state = create_crawl_state(config)
+        self.state = state
+
+        self.max_retries = get_max_retries(site, options)
+        self.retries = 0
+        self.unchanged = 0
+        self._counters_lock = threading.Lock()
+        # Indexed items that are finished once they're committed
+        self._uncommitted_items = []
+
+    def crawl(self):
+        site = self.site
+        if shutdown_requested.is_set():
+            return
+
+        # Fetch and parse the sitemap index (or build a virtual one)
+        sitemap_index = SitemapIndexFetcher(site).fetch()
+
+        log.info(u"Crawling {} [{} sitemap(s)]...".format(
+            site.url, len(sitemap_index.sitemaps)))
+        log.debug(u"Workers per stage: {}".format(u', '.join(
+            u'{}={}'.format(name, self.stage_workers[name])
+            for name in CRAWL_STAGES)))
+
+        # Get all docs indexed in Solr for a particular site
+        self.indexed_docs = get_indexed_docs(
+            self.config, self.solr, site, self.state)
+
+        # Purge docs that have been removed from sitemap(s) from Solr index
+        purge_removed_docs_from_index(
+            self.config, sitemap_index, self.indexed_docs, self.solr,
+            self.state)
+
+        if self.config.checkpoint_dir is not None:
+            self.checkpoint = Checkpoint(self.config.checkpoint_dir, site.url)
+            self.checkpoint.open(resume=getattr(self.options, 'resume', False))
+
+        crawled = False
+        try:
+            self.crawl_sitemaps(sitemap_index.sitemaps)
+            crawled = True
+        finally:
+            # Send the last batch of documents to Solr and commit, even if
+            # crawling failed, so the documents extracted so far are kept
+            try:
+                self.commit()
+            except Exception:
+                if crawled:
+                    raise
+                # Don't hide the error that made crawling fail
+                log.exception(u"Failed to index the last documents of "
+                              u"{}".format(site.url))
+            finally:
+                if self.checkpoint is not None:
+                    self.checkpoint.close()
+
+        if self.indexer.failed:
+            log.error(u"Failed to index {} document(s) of {}".format(
+                self.indexer.failed, site.url))
+        if self.unchanged:
+            log.info(u"Skipped {} document(s) of {} with unchanged "
+                     u"content".format(self.unchanged, site.url))
+
+        if shutdown_requested.is_set():
+            log.warn(u"Stopped crawling {}.".format(site.url))
+        elif self.checkpoint is not None:
+            self.checkpoint.remove()
+
+        log.info(u"=" * 78)
+        log.info(u"")
+
+    def crawl_sitemaps(self, sitemaps):
+        checkpoint = self.checkpoint
+        for sitemap in sitemaps:
+            if shutdown_requested.is_set():
+                break
+            if checkpoint is not None and checkpoint.is_completed(sitemap.url):
+                log.info(u"Skipping {} (completed before)".format(sitemap.url))
+                continue
 
-    for sitemap in sitemap_index.sitemaps:
+            self.crawl_sitemap(sitemap)
+            if checkpoint is not None and not shutdown_requested.is_set():
+                # A sitemap is only complete once its documents are
+                # committed
+                if self.commit():
+                    checkpoint.complete(sitemap.url)
+
+    def commit(self):
+        """Commit the documents sent to Solr, and record the items they were
+        extracted from as finished. Return whether committing succeeded.
+        """
+        committed = self.indexer.commit()
+        with self._counters_lock:
+            items = self._uncommitted_items
+            self._uncommitted_items = []
+        if committed:
+            for item in items:
+                self.finish(item)
+        return committed
+
+    def finish(self, item):
+        """Record that the crawler is done with an item, so it's skipped
+        when resuming an interrupted crawl.
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.finish(item.sitemap.url, item.url)
+
+    def finish_indexed(self, item):
+        """Record that an indexed item is finished. Unless Solr commits the
+        documents on its own, that's deferred until its document has been
+        committed, so a resumed crawl doesn't skip documents that never got
+        committed.
+        """
+        if self.checkpoint is None or self.indexer.commit_within is not None:
+            self.finish(item)
+            return
+
+        # Only the URL is needed to finish the item, don't keep the
+        # document in memory
+        item.field_values = None
+        item.resource_info = None
+        with self._counters_lock:
+            self._uncommitted_items.append(item)
+
+    def create_pipeline(self):
+        stage_funcs = {
+            'fetch': self.fetch,
+            'convert': self.convert,
+            'extract': self.extract,
+            'index': self.index,
+        }
+        stages = [Stage(name, stage_funcs[name], self.stage_workers[name])
+                  for name in CRAWL_STAGES]
+        return Pipeline(stages, stop_event=shutdown_requested)
+
+    def crawl_sitemap(self, sitemap):
         total = len(sitemap.url_infos)
 
         log.info(u"-" * 78)
         log.info(u"Crawling {}...".format(sitemap.url))
 
-        for n, url_info in enumerate(sitemap.url_infos, start=1):
-            url = url_info['loc']
-            progress = '[{}/{}]'.format(n, total)
-
-            # If we're only indexing a specific URL, skip all others
-            if options.url and not url == options.url:
-                continue
-
-            log.debug(u"{}: {}".format(url, unicode(url_info)))
-
-            # Get time this document was last indexed
-            last_indexed = get_indexing_time(url, indexed_docs, config)
-
-            # Fetch and save resource
-            resource_info = ResourceInfo(site=sitemap.site,
-                                         url_info=url_info,
-                                         last_indexed=last_indexed)
-            fetcher = ResourceFetcher(
-                resource_info, fetcher_session, tempdir, options)
-            try:
-                resource_info = fetcher.fetch()
-            except NotModified:
-                log.info(u"{}   Skipped {} (not modified)".format(progress,
-                                                                  url))
-                continue
-            except AttemptedRedirect:
-                continue
-            except FetchingError, e:
-                log.error(unicode(e))
-                continue
-            except Exception as ex:
-                print ex
-
-            # Extract metadata and plain text
-            engine = ExtractionEngine(
-                config, resource_info, converter=TikaConverter(config.tika))
+        only_url = self.options.url
+        checkpoint = self.checkpoint
+
+        def items():
+            for n, url_info in enumerate(sitemap.url_infos, start=1):
+                # If we're only indexing a specific URL, skip all others
+                if only_url and not url_info['loc'] == only_url:
+                    continue
+                # Skip URLs finished before the crawl got interrupted
+                if checkpoint is not None and checkpoint.is_finished(
+                        sitemap.url, url_info['loc']):
+                    continue
+                progress = '[{}/{}]'.format(n, total)
+                yield CrawlItem(sitemap, url_info, progress)
+
+        self.create_pipeline().run(items())
+
+    def fetch(self, item):
+        url = item.url
+        log.debug(u"{}: {}".format(url, unicode(item.url_info)))
+
+        # Get time this document was last indexed, and its ETag and
+        # content hash back then
+        indexed_docs = self.indexed_docs
+        resource_info = ResourceInfo(
+            site=item.sitemap.site,
+            url_info=item.url_info,
+            last_indexed=indexed_docs.get_indexing_time(url),
+            etag=indexed_docs.get_etag(url),
+            last_content_hash=indexed_docs.get_content_hash(url))
+
+        # Fetch and save resource
+        fetcher = ResourceFetcher(
+            resource_info, self.fetcher_session, self.tempdir, self.options)
+        item.attempts += 1
+        try:
+            item.resource_info = fetcher.fetch()
+        except TooManyRequests, e:
+            delay = self.get_retry_delay(item, e)
+            if delay is None:
+                return
+            raise RetryLater(delay)
+        except NotModified:
+            log.info(u"{}   Skipped {} (not modified)".format(
+                item.progress, url))
+            self.finish(item)
+            return
+        except ContentUnchanged:
+            log.info(u"{}   Skipped {} (content unchanged)".format(
+                item.progress, url))
+            with self._counters_lock:
+                self.unchanged += 1
+            self.finish(item)
+            return
+        except AttemptedRedirect:
+            self.finish(item)
+            return
+        except ResourceTooLarge, e:
+            log.warn(u"{}   Skipped {} ({})".format(
+                item.progress, url, unicode(e)))
+            self.finish(item)
+            return
+        except FetchingError, e:
+            log.error(unicode(e))
+            self.finish(item)
+            return
+        finally:
+            self.record_fetch(resource_info)
+        return item
+
+    def record_fetch(self, resource_info):
+        if self.state is None or resource_info.status_code is None:
+            return
+        self.state.record_fetch(
+            resource_info.url_info['loc'], self.site.url,
+            resource_info.status_code)
+
+    def get_retry_delay(self, item, exc):
+        """Return the number of seconds after which to retry fetching an
+        item that got throttled, or ``None`` to give up on it.
+
+        The delay is the one the server asked for with Retry-After, or else
+        starts at the site's `sleeptime` and doubles for every attempt.
+        """
+        delay = exc.retry_after
+        if delay is None:
+            delay = self.site.sleeptime * 2 ** (item.attempts - 1)
+
+        if delay > MAX_RETRY_AFTER:
+            log.error(u"{}, giving up (asked to retry after {}s)".format(
+                exc, delay))
+            return None
+
+        with self._counters_lock:
+            if self.retries >= self.max_retries:
+                log.error(u"{}, giving up (already retried {} throttled "
+                          u"requests to {})".format(
+                              exc, self.retries, self.site.url))
+                return None
+            self.retries += 1
+
+        log.warn(u"{}   {}, retrying in {}s".format(
+            item.progress, exc, delay))
+        return delay
+
+    def convert(self, item):
+        # Extract the metadata and / or plain text the fields need. Anything
+        # else is only extracted if an extractor asks for it.
+        try:
+            convert(item.resource_info, self.converter, self.conversions)
+        except ConversionError, e:
+            self.skip_unconvertible(item, e)
+            return None
+        return item
+
+    def extract(self, item):
+        resource_info = item.resource_info
+        engine = ExtractionEngine(
+            self.config, resource_info, plan=self.extraction_plan)
+        try:
             field_values = engine.extract_field_values()
-            display_fields(field_values)
-            os.unlink(resource_info.filename)
-            if site.crawler_site_id:
-                field_values['crawler_site_id'] = site.crawler_site_id
-
-            # Index into Solr
-            log.debug(u"Indexing {} into solr.".format(url))
-            response = solr.index(field_values)
-            if response.status_code == 200:
-                log.info(u"{} * Indexed {}".format(progress, url))
-
-    log.info(u"=" * 78)
-    log.info(u"")
+        except ConversionError, e:
+            self.skip_unconvertible(item, e)
+            return None
+        display_fields(field_values)
+        resource_info.release()
+        os.unlink(resource_info.filename)
+        if self.site.crawler_site_id:
+            field_values['crawler_site_id'] = self.site.crawler_site_id
+
+        item.field_values = field_values
+        return item
+
+    def skip_unconvertible(self, item, exc):
+        """Skip a document the converter failed to convert, instead of
+        indexing it without its metadata or text.
+        """
+        log.error(u"{}   Skipped {} ({})".format(
+            item.progress, item.url, unicode(exc)))
+        item.resource_info.release()
+        os.unlink(item.resource_info.filename)
+        self.finish(item)
+
+    def index(self, item):
+        # Index into Solr (in batches)
+        log.debug(u"Indexing {} into solr.".format(item.url))
+
+        def indexed(error):
+            if error is None:
+                log.info(u"{} * Indexed {}".format(item.progress, item.url))
+                self.record_indexed(item)
+                self.finish_indexed(item)
+            else:
+                log.error(u"{}   Failed to index {}: {}".format(
+                    item.progress, item.url, error))
+
+        self.indexer.add(item.field_values, callback=indexed)
+
+    def record_indexed(self, item):
+        if self.state is None:
+            return
+        field_values = item.field_values
+        self.state.record_indexed(
+            item.url, self.site.url, field_values[self.config.unique_field],
+            field_values.get(self.config.last_modified_field),
+            headers=item.resource_info.headers,
+            content_hash=item.resource_info.content_hash)
+
+
+def crawl_site(tempdir, config, options, solr, site, converter=None,
+               state=None):
+    SiteCrawler(
+        tempdir, config, options, solr, site, converter, state).crawl()
 
 
 def main():
     options = parse_args()
     config = get_config(options)
 
+    # Finish the documents in progress and write the checkpoint on SIGTERM
+    signal.signal(signal.SIGTERM, request_shutdown)
+
     tempdir = tempfile.mkdtemp(prefix='ftw.crawler_')
     log.debug(u"Using temporary directory {}".format(tempdir))
     try:
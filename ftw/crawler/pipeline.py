@@ -0,0 +1,258 @@
+from ftw.crawler.workers import WorkerPool
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+# Stages of the pipeline used for crawling a site, in order
+CRAWL_STAGES = ('fetch', 'convert', 'extract', 'index')
+
+# Interval (in seconds) in which the queue depths of a running pipeline
+# are logged
+MONITOR_INTERVAL = 30
+
+
+class RetryLater(Exception):
+    """Raised by a stage's function to have the item it's processing handed
+    to the same stage again after `delay` seconds.
+    """
+
+    def __init__(self, delay):
+        super(RetryLater, self).__init__(delay)
+        self.delay = delay
+
+
+class Stage(object):
+    """A step in a ``Pipeline``.
+
+    ``func`` is called for every item the stage receives, using ``workers``
+    worker threads. Its return value is passed on to the next stage, unless
+    it's ``None``, in which case the item is dropped. If ``func`` raises
+    ``RetryLater``, the item is put aside and processed by the stage again
+    once the delay has passed, without occupying a worker in the meantime.
+
+    Every stage has its own bounded queue of at most ``queue_size`` items
+    (twice the number of workers by default). A stage whose queue is full
+    blocks the stage in front of it, so a slow stage throttles all stages
+    before it instead of letting work pile up.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+
+        self.next_stage = None
+        self.pipeline = None
+        self.pool = None
+
+    def start(self, threaded):
+        self.pool = WorkerPool(
+            self._process, size=self.workers, name=self.name,
+            queue_size=self.queue_size, threaded=threaded)
+        self.pool.start()
+
+    def put(self, item):
+        self.pool.put(item)
+
+    def join(self):
+        self.pool.join()
+
+    @property
+    def failed(self):
+        return self.pool is not None and self.pool.failed
+
+    @property
+    def queue_depth(self):
+        if self.pool is None:
+            return 0
+        return self.pool.qsize()
+
+    def _process(self, item):
+        try:
+            result = self.func(item)
+        except RetryLater as retry:
+            self.pipeline._retry_later(self, item, retry.delay)
+            return
+        except:
+            self.pipeline._item_done()
+            raise
+
+        if result is not None and self.next_stage is not None:
+            self.next_stage.put(result)
+        else:
+            self.pipeline._item_done()
+
+    def __repr__(self):
+        return '<Stage {!r} workers={}>'.format(self.name, self.workers)
+
+
+class Pipeline(object):
+    """Passes items through a sequence of ``Stage``s, every stage running
+    concurrently with its own number of workers.
+
+    If all stages have a single worker, items are processed synchronously
+    one after another, exactly like a plain loop would.
+
+    Items that are to be retried later (see ``RetryLater``) are kept on a
+    heap and handed back to their stage by the thread running the pipeline,
+    in between feeding new items and until all items have passed through.
+
+    The first exception raised in any of the stages stops the pipeline and is
+    re-raised by ``run()``.
+
+    Once ``stop_event`` (a ``threading.Event``) is set, no more items are
+    fed into the pipeline and items waiting to be retried are dropped, but
+    the items already in the stages are still processed.
+    """
+
+    def __init__(self, stages, monitor_interval=MONITOR_INTERVAL,
+                 stop_event=None):
+        self.stages = stages
+        self.monitor_interval = monitor_interval
+        self.stop_event = stop_event
+
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+        for stage in stages:
+            stage.pipeline = self
+
+        self._pending = 0
+        self._delayed = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+        self._stopped = threading.Event()
+        self._monitor = None
+
+    @property
+    def threaded(self):
+        return any(stage.workers > 1 for stage in self.stages)
+
+    @property
+    def failed(self):
+        return any(stage.failed for stage in self.stages)
+
+    @property
+    def stopping(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def queue_depths(self):
+        """Return a list of ``(stage name, queue depth)`` tuples. Items
+        waiting to be retried are listed as ``delayed``.
+        """
+        depths = [(stage.name, stage.queue_depth) for stage in self.stages]
+        depths.append(('delayed', len(self._delayed)))
+        return depths
+
+    def format_queue_depths(self):
+        return u', '.join(
+            u'{}={}'.format(name, depth)
+            for name, depth in self.queue_depths())
+
+    def run(self, items):
+        threaded = self.threaded
+        for stage in reversed(self.stages):
+            stage.start(threaded)
+
+        if threaded:
+            self._start_monitor()
+
+        try:
+            for item in items:
+                if self.failed or self.stopping:
+                    break
+                self._put_due_items()
+                self._put(self.stages[0], item)
+            self._wait_until_done()
+        finally:
+            self._join()
+
+    def _put(self, stage, item):
+        with self._condition:
+            self._pending += 1
+        stage.put(item)
+
+    def _item_done(self):
+        with self._condition:
+            self._pending -= 1
+            self._condition.notify_all()
+
+    def _retry_later(self, stage, item, delay):
+        with self._condition:
+            self._pending -= 1
+            heapq.heappush(
+                self._delayed,
+                (time.time() + delay, next(self._counter), stage, item))
+            self._condition.notify_all()
+
+    def _put_due_items(self):
+        """Hand items whose retry is due back to their stage, and return the
+        number of seconds until the next retry is due (or ``None``).
+        """
+        while True:
+            with self._condition:
+                if not self._delayed:
+                    return None
+                due, n, stage, item = self._delayed[0]
+                wait = due - time.time()
+                if wait > 0:
+                    return wait
+                heapq.heappop(self._delayed)
+            self._put(stage, item)
+
+    def _wait_until_done(self):
+        """Keep retrying delayed items until all items passed through the
+        pipeline (or it failed).
+        """
+        while not self.failed:
+            if self.stopping:
+                self._drop_delayed_items()
+            wait = self._put_due_items()
+            with self._condition:
+                if self._pending == 0 and not self._delayed:
+                    return
+                # Wake up regularly to notice failed stages
+                self._condition.wait(min(wait or 1, 1))
+
+    def _drop_delayed_items(self):
+        with self._condition:
+            if self._delayed:
+                log.info(u"Stopping, dropped {} item(s) waiting to be "
+                         u"retried.".format(len(self._delayed)))
+                del self._delayed[:]
+
+    def _join(self):
+        # Join stages front to back: once a stage is done, it won't put any
+        # more items into the next stage's queue.
+        exc_info = None
+        for stage in self.stages:
+            try:
+                stage.join()
+            except Exception:
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+        self._stopped.set()
+        if self._monitor is not None:
+            self._monitor.join()
+
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _start_monitor(self):
+        def monitor():
+            while not self._stopped.wait(self.monitor_interval):
+                log.info(u"Queue depths: {}".format(
+                    self.format_queue_depths()))
+
+        self._monitor = threading.Thread(
+            target=monitor, name='pipeline-monitor')
+        self._monitor.daemon = True
+        self._monitor.start()
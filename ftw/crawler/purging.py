@@ -1,3 +1,4 @@
+from ftw.crawler.indexed_docs import IndexedDocs
 from ftw.crawler.solr import SolrConnector
 import logging
 
@@ -5,12 +6,17 @@ import logging
 log = logging.getLogger(__name__)
 
 
-def purge_removed_docs_from_index(config, sitemap_index, indexed_docs):
-    solr = SolrConnector(config.solr)
+def purge_removed_docs_from_index(config, sitemap_index, indexed_docs,
+                                  solr=None, state=None):
+    if solr is None:
+        solr = SolrConnector(config.solr)
     unique_field = config.unique_field
     url_field = config.url_field
     site = sitemap_index.site
 
+    if not isinstance(indexed_docs, IndexedDocs):
+        indexed_docs = IndexedDocs(config, indexed_docs)
+
     log.info(u'Purging removed docs from index for {}...'.format(site.url))
     docs_to_purge = []
 
@@ -19,7 +25,7 @@ def purge_removed_docs_from_index(config, sitemap_index, indexed_docs):
         uid = doc[unique_field]
 
         url_in_site = url.startswith(site.url)
-        url_in_any_sitemap = any(url in sm for sm in sitemap_index.sitemaps)
+        url_in_any_sitemap = url in sitemap_index
 
         if url_in_site and not url_in_any_sitemap:
             docs_to_purge.append((uid, url))
@@ -27,4 +33,6 @@ def purge_removed_docs_from_index(config, sitemap_index, indexed_docs):
     for uid, url in docs_to_purge:
         log.info(u'Purging document {} ({}) from Solr'.format(uid, url))
         solr.delete(uid)
+        if state is not None:
+            state.remove(url)
     log.info(u'Done purging.')
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+# Status codes that indicate the host wants us to slow down
+BACKOFF_STATUS_CODES = (429, 503)
+
+# Lowest rate (in requests per second) we'll ever back off to
+MIN_RATE = 0.1
+
+# Rate (in requests per second) to back off to first if the rate is
+# unlimited and no other rate is given
+DEFAULT_BACKOFF_RATE = 10.0
+
+# Number of consecutive successful responses after which the rate is
+# increased again, and the factor by which it is increased
+RECOVERY_THRESHOLD = 20
+RECOVERY_FACTOR = 1.5
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket that hands out tokens at `rate` tokens per
+    second, allowing bursts of up to `capacity` tokens.
+
+    A `rate` of ``None`` means unlimited.
+    """
+
+    def __init__(self, rate=None, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the number of seconds to wait until it may
+        be used.
+
+        Tokens may be reserved in advance, so concurrent callers are spaced
+        out evenly instead of all of them retrying at the same time.
+        """
+        with self._lock:
+            if self.rate is None:
+                return 0
+
+            now = time.time()
+            elapsed = now - self._last
+            self._last = now
+            self._tokens = min(
+                self.capacity, self._tokens + elapsed * self.rate)
+
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def consume(self):
+        """Take a token, sleeping until it's available.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HostRateLimiter(object):
+    """Limits the requests to a single host, shared by all workers.
+
+    Requests are spaced out using a `TokenBucket` with `rate` requests per
+    second (unlimited if ``None``), and at most `max_concurrency` requests
+    are in flight at any time (unlimited if ``None``).
+
+    The rate adapts to the host's responses: a 429 or 503 response halves the
+    rate (starting at `backoff_rate` if the rate was unlimited), down to
+    `MIN_RATE`. After `RECOVERY_THRESHOLD` successful responses in a row, the
+    rate is increased again, up to the configured rate.
+    """
+
+    def __init__(self, host=None, rate=None, max_concurrency=None,
+                 backoff_rate=DEFAULT_BACKOFF_RATE):
+        self.host = host
+        self.max_rate = rate
+        self.max_concurrency = max_concurrency
+        self.backoff_rate = backoff_rate
+
+        self.bucket = TokenBucket(rate)
+        self._successes = 0
+        self._lock = threading.Lock()
+
+        if max_concurrency is not None:
+            self._slots = threading.BoundedSemaphore(max_concurrency)
+        else:
+            self._slots = None
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def acquire(self):
+        """Wait until a request to the host may be sent.
+        """
+        if self._slots is not None:
+            self._slots.acquire()
+        self.bucket.consume()
+
+    def release(self, status_code=None):
+        """Signal that a request has completed with the given status code
+        (``None`` if it failed without a response).
+        """
+        if self._slots is not None:
+            self._slots.release()
+
+        if status_code in BACKOFF_STATUS_CODES:
+            self.backoff()
+        elif status_code is not None:
+            self._record_success()
+
+    def backoff(self):
+        with self._lock:
+            self._successes = 0
+            if self.rate is None:
+                rate = self.backoff_rate
+            else:
+                rate = max(MIN_RATE, self.rate / 2.0)
+            self.bucket.rate = rate
+
+        log.info(u"Slowing down requests to {} to {:.2f} requests/s".format(
+            self.host, rate))
+
+    def _record_success(self):
+        with self._lock:
+            if self.rate is None or self.rate == self.max_rate:
+                return
+
+            self._successes += 1
+            if self._successes < RECOVERY_THRESHOLD:
+                return
+
+            self._successes = 0
+            rate = self.rate * RECOVERY_FACTOR
+            if self.max_rate is not None:
+                rate = min(rate, self.max_rate)
+            elif rate >= self.backoff_rate:
+                # Fully recovered, no configured limit to return to
+                rate = None
+            self.bucket.rate = rate
+
+        if rate is None:
+            log.info(u"Requests to {} are no longer limited".format(
+                self.host))
+        else:
+            log.info(u"Speeding up requests to {} to {:.2f} requests/s".format(
+                self.host, rate))
@@ -1,13 +1,127 @@
+from ftw.crawler.utils import get_charset
+from ftw.crawler.utils import safe_unicode
+from ftw.crawler.xml_utils import detect_encoding
+from ftw.crawler.xml_utils import parse_markup
+
+
+# Parts of a resource that are extracted by a converter (e.g. Tika)
+METADATA = 'metadata'
+TEXT = 'text'
+CONVERSIONS = frozenset([METADATA, TEXT])
+
+
 class ResourceInfo(object):
+    """Information about a fetched resource.
+
+    If a `converter` is given, the resource's `metadata` and `text` are
+    extracted lazily when they're first accessed, and only the part that is
+    accessed. Parts listed in `conversions` are expected to be needed anyway,
+    so they're all extracted at once, which lets a converter that supports it
+    extract them from a single upload.
+
+    The `encoding` and the parsed `tree` of markup documents are determined
+    once, when they're first accessed, and shared by everything working
+    with the document. Call `release()` once the document is done with.
+
+    `extracted` holds the values extractors have extracted from the
+    resource so far (see `Extractor.extract()`).
+    """
 
     def __init__(self, filename=None, content_type=None, site=None,
                  url_info=None, last_indexed=None, headers=None,
-                 metadata=None, text=None):
+                 metadata=None, text=None, converter=None,
+                 conversions=CONVERSIONS, content_hash=None, etag=None,
+                 status_code=None, last_content_hash=None):
         self.filename = filename
         self.content_type = content_type
         self.site = site
         self.url_info = url_info
         self.last_indexed = last_indexed
         self.headers = headers
-        self.metadata = metadata
-        self.text = text
+        self.etag = etag
+        self.last_content_hash = last_content_hash
+        self.status_code = status_code
+        self.content_hash = content_hash
+        self.converter = converter
+        self.conversions = conversions
+        self._metadata = metadata
+        self._text = text
+        self._encoding = None
+        self._tree = None
+        self.extracted = {}
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self.convert([METADATA])
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+
+    @property
+    def text(self):
+        if self._text is None:
+            self.convert([TEXT])
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+
+    @property
+    def encoding(self):
+        """The encoding of a markup document, preferably as declared by
+        the BOM, the HTTP headers or the document itself.
+        """
+        if self._encoding is None:
+            charset = None
+            if self.headers is not None:
+                # TODO: We rely on requests.structures.CaseInsensitiveDict
+                charset = get_charset(self.headers.get('content-type'))
+            self._encoding = detect_encoding(self.filename, charset)
+        return self._encoding
+
+    @property
+    def tree(self):
+        """The document parsed into a namespace free lxml tree.
+        """
+        if self._tree is None:
+            self._tree = parse_markup(self.filename, self.encoding)
+        return self._tree
+
+    def release(self):
+        """Drop the parsed tree, so its memory can be reclaimed.
+        """
+        self._tree = None
+
+    def convert(self, parts=None):
+        """Extract the given parts (`METADATA` and / or `TEXT`, all parts
+        listed in `conversions` by default) with the converter, unless they
+        have been extracted already.
+        """
+        if self.converter is None:
+            return
+
+        conversions = frozenset(self.conversions)
+        if parts is None:
+            parts = conversions
+        missing = set(part for part in parts
+                      if getattr(self, '_' + part) is None)
+        if not missing:
+            return
+
+        # If any part we expect to need is missing, get all of them
+        if missing & conversions:
+            missing |= set(part for part in conversions
+                           if getattr(self, '_' + part) is None)
+
+        if missing == CONVERSIONS:
+            metadata, text = self.converter.extract(self)
+            self._metadata = metadata
+            self._text = safe_unicode(text)
+        elif METADATA in missing:
+            self._metadata = self.converter.extract_metadata(self)
+        else:
+            self._text = safe_unicode(self.converter.extract_text(self))
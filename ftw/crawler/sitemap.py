@@ -1,7 +1,7 @@
 from ftw.crawler.exceptions import NoSitemapFound
 from ftw.crawler.utils import gunzip
 from ftw.crawler.utils import is_gzipped
-from ftw.crawler.xml_utils import remove_namespaces
+from ftw.crawler.xml_utils import strip_namespaces
 from lxml import etree
 from urlparse import urljoin
 import io
@@ -99,8 +99,7 @@ class SitemapIndex(object):
 
     def _parse_sitemap_idx_xml(self, sitemap_idx_xml):
         tree = etree.parse(io.BytesIO(sitemap_idx_xml))
-        tree = remove_namespaces(tree)
-        return tree
+        return strip_namespaces(tree)
 
     def _get_sitemap_infos(self):
         sitemap_nodes = self.tree.xpath('/sitemapindex/sitemap')
@@ -184,6 +183,7 @@ class Sitemap(object):
         self.url = url
         self.tree = self._parse_sitemap_xml(sitemap_xml)
         self._url_infos = None
+        self._urls = None
 
     def is_sitemap(self):
         return len(self.tree.xpath('//urlset')) > 0
@@ -197,16 +197,24 @@ class Sitemap(object):
             self._url_infos = list(self._get_url_infos())
         return self._url_infos
 
+    @property
+    def urls(self):
+        """Memoized property that returns the set of all (lowercased) URLs
+        listed in this sitemap.
+        """
+        if self._urls is None:
+            self._urls = frozenset(
+                ui['loc'].lower() for ui in self.url_infos)
+        return self._urls
+
     def __contains__(self, url):
         """Tests whether an URL is listed in this sitemap (case-insensitive).
         """
-        url_infos = self.url_infos
-        return url.lower() in (ui['loc'].lower() for ui in url_infos)
+        return url.lower() in self.urls
 
     def _parse_sitemap_xml(self, sitemap_xml):
         tree = etree.parse(io.BytesIO(sitemap_xml))
-        tree = remove_namespaces(tree)
-        return tree
+        return strip_namespaces(tree)
 
     def _get_url_infos(self):
         url_nodes = self.tree.xpath('/urlset/url')
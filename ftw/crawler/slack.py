@@ -30,6 +30,7 @@ class SlackLogger(object):
         return channel
 
     def generateAttdata(self, ex, site):
+        exc_type_name = getattr(ex, 'exc_type_name', type(ex).__name__)
         return json.dumps(
             [
                 {
@@ -41,7 +42,7 @@ class SlackLogger(object):
                         },
                         {
                             "title": "Exception Type",
-                            "value": type(ex).__name__
+                            "value": exc_type_name
                         },
                         {
                             "title": "Error Message",
@@ -1,7 +1,10 @@
 from ftw.crawler.exceptions import SolrError
+from ftw.crawler.utils import create_session
 from ftw.crawler.utils import ExtendedJSONEncoder
 import logging
 import requests
+import threading
+import time
 
 
 log = logging.getLogger(__name__)
@@ -12,6 +15,19 @@ log = logging.getLogger(__name__)
 SPECIAL_TOKENS = ['+', '-', '&&', '||', '!', '(', ')', '{', '}', '[', ']',
                   '^', '"', '~', '*', '?', ':', '\\', '/']
 
+# Number of documents fetched per request when iterating over search results
+DEFAULT_PAGE_SIZE = 1000
+
+# Number of documents sent to Solr in a single update request by the
+# BatchIndexer, and the longest time (in seconds) a document is buffered
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_WAIT = 10
+
+# Number of connections to Solr kept open for reuse, and the number of
+# seconds to wait for Solr to respond
+SOLR_POOL_SIZE = 10
+SOLR_TIMEOUT = 60
+
 
 def solr_escape(value):
     """Escape a value for use in a Solr/Lucene query
@@ -25,40 +41,54 @@ def solr_escape(value):
 
 
 class SolrConnector(object):
+    """Talks to Solr through a pooled session that keeps connections alive
+    and can be shared by concurrent workers.
+    """
 
     update_handler = 'update'
     search_handler = 'select'
 
-    def __init__(self, solr_base):
+    def __init__(self, solr_base, page_size=DEFAULT_PAGE_SIZE,
+                 pool_size=SOLR_POOL_SIZE, timeout=SOLR_TIMEOUT):
         self.solr_base = solr_base.rstrip('/')
+        self.page_size = page_size
+        self.timeout = timeout
+        self.session = create_session(pool_size=pool_size)
 
         self.update_url = '{}/{}?{}'.format(
             self.solr_base, SolrConnector.update_handler, 'commit=true')
 
+        self.batch_update_url = '{}/{}'.format(
+            self.solr_base, SolrConnector.update_handler)
+
         self.search_url = '{}/{}'.format(
             self.solr_base, SolrConnector.search_handler)
 
-    def _update_request(self, data):
+    def _update_request(self, data, url=None):
+        if url is None:
+            url = self.update_url
         headers = {'Content-Type': 'application/json'}
         document = ExtendedJSONEncoder().encode(data)
-        response = requests.post(
-            self.update_url, data=document, headers=headers)
+        response = self.session.post(
+            url, data=document, headers=headers, timeout=self.timeout)
 
         if not response.status_code == 200:
             log.error(u"Error from Solr: Status: {}. Response:\n{}".format(
                 response.status_code, response.text))
         return response
 
-    def _search_request(self, query, fl=None):
+    def _search_request(self, query, fl=None, **kwargs):
         headers = {'Content-Type': 'application/json'}
 
         params = {'q': query, 'wt': 'json'}
+        params.update(kwargs)
 
         if fl is not None:
             params.update({'fl': ','.join(fl)})
 
-        response = requests.get(
-            self.search_url, params=params, headers=headers)
+        response = self.session.get(
+            self.search_url, params=params, headers=headers,
+            timeout=self.timeout)
 
         if not response.status_code == 200:
             log.error(u"Error from Solr: Status: {}. Response:\n{}".format(
@@ -71,6 +101,22 @@ class SolrConnector(object):
         response = self._update_request([document])
         return response
 
+    def index_many(self, documents, commit_within=None):
+        """Send several documents to Solr in a single update request, without
+        committing them. If given, Solr commits them within `commit_within`
+        milliseconds.
+        """
+        url = self.batch_update_url
+        if commit_within is not None:
+            url = '{}?commitWithin={}'.format(url, commit_within)
+        response = self._update_request(documents, url=url)
+        return response
+
+    def commit(self):
+        response = self._update_request(
+            {'commit': {}}, url=self.batch_update_url)
+        return response
+
     def delete(self, unique_id):
         del_command = {'delete': {'id': unique_id}}
         response = self._update_request(del_command)
@@ -81,3 +127,180 @@ class SolrConnector(object):
         search_results = response.json()['response']
         docs = search_results['docs']
         return docs
+
+    def search_iter(self, query, sort, fl=None, page_size=None):
+        """Yield all documents matching the query, fetching them in pages of
+        `page_size` documents (the connector's page size by default) using
+        Solr's cursorMark.
+
+        Deep paging with a cursor requires a `sort` that includes the
+        schema's unique key field (e.g. ``'UID asc'``).
+        """
+        if page_size is None:
+            page_size = self.page_size
+
+        cursor = '*'
+        while True:
+            response = self._search_request(
+                query, fl, sort=sort, rows=page_size, cursorMark=cursor)
+            results = response.json()
+            for doc in results['response']['docs']:
+                yield doc
+
+            next_cursor = results['nextCursorMark']
+            if next_cursor == cursor:
+                return
+            cursor = next_cursor
+
+
+class BatchIndexer(object):
+    """Buffers documents and sends them to Solr in batches, instead of
+    indexing and committing every document on its own.
+
+    A batch is sent as soon as `batch_size` documents are buffered, or once
+    a document has been buffered for more than `max_wait` seconds. With
+    `commit_within` (in milliseconds), Solr commits the documents on its own
+    within that time. Otherwise they are committed by `commit()`, or when the
+    indexer is closed.
+
+    If Solr rejects a batch, its documents are sent again one by one, so a
+    single bad document doesn't keep the others from being indexed. The
+    `callback` passed to `add()` is called with ``None`` once the document is
+    indexed, or with an error message if Solr rejected it or couldn't be
+    reached.
+    """
+
+    def __init__(self, solr, batch_size=DEFAULT_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT, commit_within=None):
+        self.solr = solr
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.commit_within = commit_within
+
+        self.indexed = 0
+        self.failed = 0
+        self._uncommitted = 0
+
+        self._batch = []
+        self._batch_started = None
+        self._timer = None
+        self._lock = threading.Lock()
+        # Held while sending a batch. Always acquired before `_lock`.
+        self._send_lock = threading.Lock()
+
+    def add(self, document, callback=None):
+        with self._lock:
+            if not self._batch:
+                self._batch_started = time.time()
+                self._start_timer()
+            self._batch.append((document, callback))
+
+            if (len(self._batch) >= self.batch_size or
+                    time.time() - self._batch_started >= self.max_wait):
+                batch = self._take_batch()
+            else:
+                batch = None
+
+        if batch:
+            with self._send_lock:
+                self._send(batch)
+
+    def flush(self):
+        """Send all buffered documents to Solr. Waits for a batch the timer
+        is sending already.
+        """
+        with self._send_lock:
+            with self._lock:
+                batch = self._take_batch()
+            if batch:
+                self._send(batch)
+
+    def commit(self):
+        """Send all buffered documents and commit them, unless Solr commits
+        them on its own (`commit_within`). Return whether the documents sent
+        so far are committed (or will be by Solr).
+        """
+        self.flush()
+        if self.commit_within is not None or not self._uncommitted:
+            return True
+
+        self._uncommitted = 0
+        response = self.solr.commit()
+        return response.status_code == 200
+
+    def close(self):
+        """Send all buffered documents and commit them, unless Solr commits
+        them on its own (`commit_within`).
+        """
+        self.commit()
+
+    def _take_batch(self):
+        batch = self._batch
+        self._batch = []
+        self._batch_started = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _start_timer(self):
+        # Sends the batch after `max_wait` seconds, even if no further
+        # documents are added
+        if self.max_wait is None:
+            return
+        self._timer = threading.Timer(self.max_wait, self._flush_if_due)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_if_due(self):
+        # The batch is taken while holding the send lock, so flush() and
+        # close() wait until it has been sent
+        with self._send_lock:
+            with self._lock:
+                if (self._batch and
+                        time.time() - self._batch_started >= self.max_wait):
+                    batch = self._take_batch()
+                else:
+                    batch = None
+            if batch:
+                self._send(batch)
+
+    def _send(self, batch):
+        documents = [document for document, callback in batch]
+        log.debug(u"Sending {} document(s) to Solr.".format(len(documents)))
+        try:
+            response = self.solr.index_many(
+                documents, commit_within=self.commit_within)
+        except requests.RequestException, e:
+            # Sending the documents one by one wouldn't help
+            error = u"Failed to send documents to Solr: {}".format(e)
+            log.error(error)
+            for document, callback in batch:
+                self._done(callback, error)
+            return
+
+        if response.status_code == 200:
+            for document, callback in batch:
+                self._done(callback)
+            return
+
+        if len(batch) == 1:
+            document, callback = batch[0]
+            self._done(callback, u"Got status {} from Solr: {}".format(
+                response.status_code, response.text))
+            return
+
+        log.warn(u"Solr rejected a batch of {} documents, sending them "
+                 u"one by one.".format(len(batch)))
+        for entry in batch:
+            self._send([entry])
+
+    def _done(self, callback, error=None):
+        with self._lock:
+            if error is None:
+                self.indexed += 1
+                self._uncommitted += 1
+            else:
+                self.failed += 1
+        if callback is not None:
+            callback(error)
@@ -0,0 +1,176 @@
+from datetime import datetime
+from ftw.crawler.utils import mkdir_p
+from ftw.crawler.utils import to_iso_datetime
+import logging
+import os
+import sqlite3
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+# Number of seconds to wait for another process to release the database
+DB_TIMEOUT = 60
+
+# Keys under which the ETag and content hash are stored in the documents
+# returned by `CrawlState.get_indexed_docs()`
+ETAG_KEY = 'etag'
+CONTENT_HASH_KEY = 'content_hash'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    site TEXT NOT NULL,
+    uid TEXT,
+    fetched TEXT,
+    status INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    indexed INTEGER NOT NULL DEFAULT 0,
+    indexing_time TEXT
+);
+CREATE INDEX IF NOT EXISTS urls_site ON urls (site);
+"""
+
+
+class CrawlState(object):
+    """Keeps track of every crawled URL in a local SQLite database, so the
+    next run knows what has been fetched and indexed without asking Solr.
+
+    For each URL, the site it belongs to, the time it was last fetched, the
+    HTTP status and whether (and under which unique key and modification
+    time) it is indexed are recorded. The ETag and Last-Modified response
+    headers and the hash of the content are the ones of the indexed
+    version, so a resource whose indexing failed isn't taken for unchanged.
+
+    The database may be used by several threads (and processes) at once.
+    Every change is committed right away, so the write lock is only held
+    briefly and other processes sharing the database aren't blocked.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        directory = os.path.dirname(os.path.abspath(path))
+        mkdir_p(directory)
+
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(
+            path, timeout=DB_TIMEOUT, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(SCHEMA)
+
+    def get(self, url):
+        """Return what is known about a URL as a dict, or ``None``.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT * FROM urls WHERE url = ?', (url, )).fetchone()
+        if row is None:
+            return None
+        return dict(zip(row.keys(), row))
+
+    def has_site(self, site_url):
+        """Return whether any URLs of the site have been recorded.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM urls WHERE site = ? LIMIT 1',
+                (site_url, )).fetchone()
+        return row is not None
+
+    def record_fetch(self, url, site_url, status):
+        """Record that a URL has been requested and the server responded
+        with the given HTTP `status`.
+        """
+        fetched = to_iso_datetime(datetime.utcnow())
+
+        with self._lock, self._connection:
+            self._ensure_url(url, site_url)
+            self._connection.execute(
+                'UPDATE urls SET site = ?, fetched = ?, status = ? '
+                'WHERE url = ?',
+                (site_url, fetched, status, url))
+
+    def record_indexed(self, url, site_url, uid, indexing_time=None,
+                       headers=None, content_hash=None):
+        """Record that a URL has been indexed in Solr with the unique key
+        `uid`, the modification time (datetime) it's indexed with, and the
+        response `headers` and `content_hash` of the indexed version.
+        """
+        if isinstance(indexing_time, datetime):
+            indexing_time = to_iso_datetime(indexing_time)
+        if headers is None:
+            headers = {}
+        # TODO: We rely on requests.structures.CaseInsensitiveDict here
+        etag = headers.get('etag')
+        last_modified = headers.get('last-modified')
+
+        with self._lock, self._connection:
+            self._ensure_url(url, site_url)
+            self._connection.execute(
+                'UPDATE urls SET site = ?, uid = ?, indexed = 1, '
+                'indexing_time = ?, etag = ?, last_modified = ?, '
+                'content_hash = ? WHERE url = ?',
+                (site_url, uid, indexing_time, etag, last_modified,
+                 content_hash, url))
+
+    def remove(self, url):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM urls WHERE url = ?', (url, ))
+
+    def import_indexed_docs(self, site_url, indexed_docs):
+        """Record the documents of an `IndexedDocs` as indexed, unless the
+        URLs have been recorded already. Used to build the crawl state from
+        Solr the first time a site is crawled with it.
+        """
+        rows = []
+        for doc in indexed_docs:
+            url = doc[indexed_docs.url_field]
+            rows.append((
+                url, site_url, doc[indexed_docs.unique_field],
+                indexed_docs.get_etag(url),
+                indexed_docs.get_content_hash(url),
+                doc.get(indexed_docs.last_modified_field)))
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO urls '
+                '(url, site, uid, etag, content_hash, indexed, '
+                'indexing_time) VALUES (?, ?, ?, ?, ?, 1, ?)', rows)
+
+    def get_indexed_docs(self, config, site_url):
+        """Return the documents of a site that are recorded as indexed, in
+        the shape Solr returns them for `IndexedDocs`. The ETag and content
+        hash are stored under `ETAG_KEY` and `CONTENT_HASH_KEY`.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT url, uid, etag, content_hash, indexing_time FROM urls '
+                'WHERE site = ? AND indexed = 1 ORDER BY uid',
+                (site_url, )).fetchall()
+
+        docs = []
+        for url, uid, etag, content_hash, indexing_time in rows:
+            doc = {config.unique_field: uid, config.url_field: url}
+            if indexing_time is not None:
+                doc[config.last_modified_field] = indexing_time
+            if etag is not None:
+                doc[ETAG_KEY] = etag
+            if content_hash is not None:
+                doc[CONTENT_HASH_KEY] = content_hash
+            docs.append(doc)
+        return docs
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _ensure_url(self, url, site_url):
+        self._connection.execute(
+            'INSERT OR IGNORE INTO urls (url, site) VALUES (?, ?)',
+            (url, site_url))
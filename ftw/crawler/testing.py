@@ -119,8 +119,12 @@ class SolrTestCase(CrawlerTestCase):
             headers={'content-type': 'application/json; charset=UTF-8'})
         return response
 
-    def create_solr_results(self, docs):
+    def create_solr_results(self, docs, next_cursor_mark=None):
         docs = json.dumps(docs)
         content = SOLR_RESULTS_TEMPLATE % (len(docs), docs)
+        if next_cursor_mark is not None:
+            results = json.loads(content)
+            results['nextCursorMark'] = next_cursor_mark
+            content = json.dumps(results)
         response = self.create_solr_response(content=content)
         return response
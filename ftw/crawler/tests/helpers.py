@@ -33,6 +33,14 @@ class MockResponse(object):
     def text(self):
         return self.content.decode('utf-8')
 
+    def iter_content(self, chunk_size=1):
+        content = self.content or ''
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
     def json(self):
         return json.loads(self.content)
 
@@ -51,3 +59,7 @@ class MockConverter(object):
 
     def extract_text(self, resource_info):
         return self.text
+
+    def extract(self, resource_info):
+        return (self.extract_metadata(resource_info),
+                self.extract_text(resource_info))
@@ -0,0 +1,93 @@
+from ftw.crawler.cache import ConversionCache
+from ftw.crawler.cache import get_content_hash
+from ftw.crawler.resource import ResourceInfo
+from ftw.crawler.testing import CrawlerTestCase
+import os
+import shutil
+import tempfile
+import time
+
+
+class TestConversionCache(CrawlerTestCase):
+
+    def setUp(self):
+        CrawlerTestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp(prefix='ftw.crawler.tests_')
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+
+    def tearDown(self):
+        CrawlerTestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def _create_resource_info(self, content, name='doc',
+                              content_type='application/pdf'):
+        filename = os.path.join(self.tempdir, name)
+        with open(filename, 'w') as f:
+            f.write(content)
+        return ResourceInfo(filename=filename, content_type=content_type)
+
+    def test_returns_none_if_not_cached(self):
+        cache = ConversionCache(self.cache_dir)
+        resource_info = self._create_resource_info('foo')
+        self.assertIsNone(cache.get(resource_info, 'text'))
+        self.assertEquals(1, cache.misses)
+
+    def test_returns_cached_value(self):
+        cache = ConversionCache(self.cache_dir)
+        resource_info = self._create_resource_info('foo')
+        cache.set(resource_info, 'text', u'foo bar')
+
+        self.assertEquals(u'foo bar', cache.get(resource_info, 'text'))
+        self.assertEquals(1, cache.hits)
+
+    def test_is_keyed_by_content(self):
+        cache = ConversionCache(self.cache_dir)
+        cache.set(self._create_resource_info('foo', name='a'), 'text', u'a')
+
+        same = self._create_resource_info('foo', name='b')
+        self.assertEquals(u'a', cache.get(same, 'text'))
+
+        other = self._create_resource_info('bar', name='c')
+        self.assertIsNone(cache.get(other, 'text'))
+
+    def test_is_keyed_by_content_type_and_part(self):
+        cache = ConversionCache(self.cache_dir)
+        cache.set(self._create_resource_info('foo'), 'text', u'foo')
+
+        self.assertIsNone(cache.get(
+            self._create_resource_info('foo', content_type='text/html'),
+            'text'))
+        self.assertIsNone(cache.get(
+            self._create_resource_info('foo'), 'metadata'))
+
+    def test_persists_between_instances(self):
+        resource_info = self._create_resource_info('foo')
+        ConversionCache(self.cache_dir).set(
+            resource_info, 'metadata', {'title': u'Foo'})
+
+        self.assertEquals({'title': u'Foo'}, ConversionCache(
+            self.cache_dir).get(resource_info, 'metadata'))
+
+    def test_evicts_least_recently_used_entries(self):
+        cache = ConversionCache(self.cache_dir, max_size=250)
+        first = self._create_resource_info('first', name='first')
+        second = self._create_resource_info('second', name='second')
+        third = self._create_resource_info('third', name='third')
+
+        cache.set(first, 'text', u'x' * 100)
+        cache.set(second, 'text', u'y' * 100)
+        # Use the first entry, so the second one is the least recently used
+        past = time.time() - 10
+        os.utime(cache._path(cache.key(second, 'text')), (past, past))
+        cache.get(first, 'text')
+
+        cache.set(third, 'text', u'z' * 100)
+        self.assertIsNone(cache.get(second, 'text'))
+        self.assertEquals(u'x' * 100, cache.get(first, 'text'))
+        self.assertEquals(u'z' * 100, cache.get(third, 'text'))
+
+    def test_computes_content_hash_only_once(self):
+        resource_info = self._create_resource_info('foo')
+        content_hash = get_content_hash(resource_info)
+        os.unlink(resource_info.filename)
+        self.assertEquals(content_hash, get_content_hash(resource_info))
@@ -0,0 +1,97 @@
+from ftw.crawler.checkpoint import Checkpoint
+from ftw.crawler.testing import CrawlerTestCase
+import os
+import shutil
+import tempfile
+
+
+SITE = u'http://example.org/'
+SITEMAP = u'http://example.org/sitemap.xml'
+
+
+class TestCheckpoint(CrawlerTestCase):
+
+    def setUp(self):
+        CrawlerTestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp(prefix='ftw.crawler.tests_')
+        self.directory = os.path.join(self.tempdir, 'checkpoints')
+
+    def tearDown(self):
+        CrawlerTestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def _interrupted_crawl(self):
+        checkpoint = Checkpoint(self.directory, SITE)
+        checkpoint.open()
+        checkpoint.finish(SITEMAP, u'http://example.org/one')
+        checkpoint.complete(u'http://example.org/other-sitemap.xml')
+        checkpoint.close()
+
+    def test_resumes_progress_of_interrupted_crawl(self):
+        self._interrupted_crawl()
+
+        checkpoint = Checkpoint(self.directory, SITE)
+        checkpoint.open(resume=True)
+        self.assertTrue(
+            checkpoint.is_finished(SITEMAP, u'http://example.org/one'))
+        self.assertFalse(
+            checkpoint.is_finished(SITEMAP, u'http://example.org/two'))
+        self.assertTrue(
+            checkpoint.is_completed(u'http://example.org/other-sitemap.xml'))
+        self.assertFalse(checkpoint.is_completed(SITEMAP))
+
+    def test_discards_progress_if_not_resuming(self):
+        self._interrupted_crawl()
+
+        checkpoint = Checkpoint(self.directory, SITE)
+        checkpoint.open()
+        checkpoint.close()
+
+        checkpoint = Checkpoint(self.directory, SITE)
+        checkpoint.open(resume=True)
+        self.assertFalse(
+            checkpoint.is_finished(SITEMAP, u'http://example.org/one'))
+
+    def test_keeps_progress_across_several_interruptions(self):
+        self._interrupted_crawl()
+
+        checkpoint = Checkpoint(self.directory, SITE)
+        checkpoint.open(resume=True)
+        checkpoint.finish(SITEMAP, u'http://example.org/two')
+        checkpoint.close()
+
+        checkpoint = Checkpoint(self.directory, SITE)
+        checkpoint.open(resume=True)
+        self.assertTrue(
+            checkpoint.is_finished(SITEMAP, u'http://example.org/one'))
+        self.assertTrue(
+            checkpoint.is_finished(SITEMAP, u'http://example.org/two'))
+
+    def test_ignores_line_cut_off_when_killed(self):
+        self._interrupted_crawl()
+        with open(Checkpoint(self.directory, SITE).path, 'a') as f:
+            f.write('{"sitemap": "http://exa')
+
+        checkpoint = Checkpoint(self.directory, SITE)
+        checkpoint.open(resume=True)
+        checkpoint.finish(SITEMAP, u'http://example.org/two')
+        checkpoint.close()
+
+        checkpoint = Checkpoint(self.directory, SITE)
+        checkpoint.open(resume=True)
+        self.assertTrue(
+            checkpoint.is_finished(SITEMAP, u'http://example.org/one'))
+        self.assertTrue(
+            checkpoint.is_finished(SITEMAP, u'http://example.org/two'))
+
+    def test_remove_deletes_checkpoint(self):
+        checkpoint = Checkpoint(self.directory, SITE)
+        checkpoint.open()
+        checkpoint.finish(SITEMAP, u'http://example.org/one')
+        checkpoint.remove()
+        self.assertFalse(os.path.exists(checkpoint.path))
+
+    def test_uses_separate_file_per_site(self):
+        self.assertNotEqual(
+            Checkpoint(self.directory, SITE).path,
+            Checkpoint(self.directory, u'http://example.com/').path)
@@ -91,6 +91,18 @@ class TestSite(CrawlerTestCase):
         site = Site(url, attributes=attributes)
         self.assertEquals({'name': 'My Site'}, site.attributes)
 
+    def test_site_defaults_to_a_single_worker(self):
+        site = Site('http://example.org')
+        self.assertEquals(1, site.workers)
+
+    def test_site_stores_workers(self):
+        site = Site('http://example.org', workers=4)
+        self.assertEquals(4, site.workers)
+
+    def test_site_stores_stage_workers(self):
+        site = Site('http://example.org', stage_workers={'convert': 2})
+        self.assertEquals({'convert': 2}, site.stage_workers)
+
 
 class TestField(CrawlerTestCase):
 
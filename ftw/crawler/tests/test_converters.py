@@ -0,0 +1,129 @@
+from ftw.crawler.converters import ContentTypeConverter
+from ftw.crawler.converters import markup_converters
+from ftw.crawler.converters import MarkupConverter
+from ftw.crawler.resource import ResourceInfo
+from ftw.crawler.testing import CrawlerTestCase
+from ftw.crawler.tests.helpers import MockConverter
+from mock import MagicMock
+from mock import patch
+from pkg_resources import resource_filename
+import shutil
+import tempfile
+
+
+HTML = """\
+<html>
+  <head>
+    <title>The  title</title>
+    <meta name="description" content="The description" />
+    <meta name="keywords" content="foo, bar" />
+    <meta name="author" content="John Doe" />
+    <style>p { color: red; }</style>
+  </head>
+  <body>
+    <h1>Heading</h1>
+    <p>First <b>paragraph</b></p>
+    <script>alert('Boom');</script>
+    <ul><li>One</li><li>Two</li></ul>
+  </body>
+</html>
+"""
+
+
+class TestMarkupConverter(CrawlerTestCase):
+
+    def setUp(self):
+        CrawlerTestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp(prefix='ftw.crawler.tests_')
+
+    def tearDown(self):
+        CrawlerTestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def _create_resource_info(self, content):
+        filename = '{}/doc.html'.format(self.tempdir)
+        with open(filename, 'w') as f:
+            f.write(content)
+        return ResourceInfo(filename=filename, content_type='text/html')
+
+    def test_extracts_metadata_from_title_and_meta_tags(self):
+        resource_info = self._create_resource_info(HTML)
+        metadata, text = MarkupConverter().extract(resource_info)
+
+        self.assertEquals(u'The  title', metadata['title'])
+        self.assertEquals(u'The description', metadata['description'])
+        self.assertEquals(u'foo, bar', metadata['keywords'])
+        self.assertEquals(u'John Doe', metadata['creator'])
+
+    def test_extracts_plain_text(self):
+        resource_info = self._create_resource_info(HTML)
+        metadata, text = MarkupConverter().extract(resource_info)
+
+        self.assertEquals(u'Heading\nFirst paragraph\nOne\nTwo', text)
+        self.assertIsInstance(text, unicode)
+
+    def test_decodes_documents(self):
+        filename = resource_filename(
+            'ftw.crawler.tests.assets', 'html5_doc.html')
+        resource_info = ResourceInfo(filename=filename,
+                                     content_type='text/html')
+        metadata, text = MarkupConverter().extract(resource_info)
+
+        self.assertEquals(u'HTML 5 Example', metadata['title'])
+        self.assertEquals(u'Der B\xe4rengraben\nFoo\nBar', text)
+
+    def test_extracts_metadata_or_text_only(self):
+        resource_info = self._create_resource_info(HTML)
+        converter = MarkupConverter()
+
+        with patch.object(converter, '_extract_text') as extract_text:
+            metadata = converter.extract_metadata(resource_info)
+        self.assertEquals(u'The description', metadata['description'])
+        self.assertFalse(extract_text.called)
+
+        with patch.object(converter, '_extract_metadata') as extract_meta:
+            text = converter.extract_text(resource_info)
+        self.assertEquals(u'Heading\nFirst paragraph\nOne\nTwo', text)
+        self.assertFalse(extract_meta.called)
+
+    def test_handles_documents_without_root(self):
+        resource_info = MagicMock()
+        resource_info.tree.getroot.return_value = None
+        converter = MarkupConverter()
+
+        self.assertEquals({}, converter.extract_metadata(resource_info))
+        self.assertEquals(u'', converter.extract_text(resource_info))
+
+
+class TestContentTypeConverter(CrawlerTestCase):
+
+    def test_chooses_converter_by_content_type(self):
+        html_converter = MockConverter(text=u'html')
+        converter = ContentTypeConverter(
+            MockConverter(text=u'default'), {'text/html': html_converter})
+
+        metadata, text = converter.extract(
+            ResourceInfo(content_type='text/html'))
+        self.assertEquals(u'html', text)
+
+        metadata, text = converter.extract(
+            ResourceInfo(content_type='application/pdf'))
+        self.assertEquals(u'default', text)
+
+    def test_matches_content_types_case_insensitively(self):
+        converter = ContentTypeConverter(
+            MockConverter(text=u'default'),
+            {'text/HTML': MockConverter(text=u'html')})
+
+        metadata, text = converter.extract(
+            ResourceInfo(content_type='Text/Html'))
+        self.assertEquals(u'html', text)
+
+        metadata, text = converter.extract(ResourceInfo())
+        self.assertEquals(u'default', text)
+
+    def test_markup_converters_cover_all_markup_types(self):
+        converters = markup_converters()
+        self.assertIn('text/html', converters)
+        self.assertIn('application/xhtml+xml', converters)
+        self.assertIsInstance(converters['text/html'], MarkupConverter)
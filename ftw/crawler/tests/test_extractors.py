@@ -5,22 +5,28 @@ from ftw.crawler.configuration import Config
 from ftw.crawler.configuration import Field
 from ftw.crawler.configuration import get_config
 from ftw.crawler.configuration import Site
+from ftw.crawler.exceptions import ConfigError
 from ftw.crawler.exceptions import ExtractionError
 from ftw.crawler.exceptions import NoSuchField
 from ftw.crawler.exceptions import NoValueExtracted
 from ftw.crawler.extractors import ConstantExtractor
+from ftw.crawler.extractors import ContentHashExtractor
 from ftw.crawler.extractors import CreatorExtractor
 from ftw.crawler.extractors import DescriptionExtractor
+from ftw.crawler.extractors import ETagExtractor
 from ftw.crawler.extractors import ExtractionEngine
+from ftw.crawler.extractors import ExtractionPlan
 from ftw.crawler.extractors import Extractor
 from ftw.crawler.extractors import FieldMappingExtractor
 from ftw.crawler.extractors import FilenameExtractor
+from ftw.crawler.extractors import get_required_conversions
 from ftw.crawler.extractors import HeaderMappingExtractor
 from ftw.crawler.extractors import HTTPHeaderExtractor
 from ftw.crawler.extractors import IndexingTimeExtractor
 from ftw.crawler.extractors import KeywordsExtractor
 from ftw.crawler.extractors import LastModifiedExtractor
 from ftw.crawler.extractors import MetadataExtractor
+from ftw.crawler.extractors import MultiXPathExtractor
 from ftw.crawler.extractors import PlainTextExtractor
 from ftw.crawler.extractors import SiteAttributeExtractor
 from ftw.crawler.extractors import SlugExtractor
@@ -32,14 +38,19 @@ from ftw.crawler.extractors import UIDExtractor
 from ftw.crawler.extractors import URLExtractor
 from ftw.crawler.extractors import URLInfoExtractor
 from ftw.crawler.extractors import XPathExtractor
+from ftw.crawler.resource import METADATA
 from ftw.crawler.resource import ResourceInfo
+from ftw.crawler.resource import TEXT
 from ftw.crawler.testing import CrawlerTestCase
 from ftw.crawler.testing import DatetimeTestCase
 from ftw.crawler.tests.helpers import MockConverter
 from ftw.crawler.utils import safe_unicode
 from ftw.crawler.utils import to_utc
 from mock import MagicMock
+from mock import patch
 from pkg_resources import resource_filename
+from unittest2 import skipUnless
+import ftw.crawler.extractors
 
 
 BASIC_CONFIG = resource_filename('ftw.crawler.tests.assets', 'basic_config.py')
@@ -99,7 +110,7 @@ class TestExtractionEngine(CrawlerTestCase):
             resource_info = ResourceInfo()
 
         if converter is None:
-            converter = MagicMock()
+            converter = MockConverter()
 
         engine = ExtractionEngine(
             config, resource_info=resource_info, converter=converter)
@@ -150,21 +161,37 @@ class TestExtractionEngine(CrawlerTestCase):
                           engine.extract_field_values())
 
     def test_set_metadata_from_converter_on_resource_info(self):
-        converter = MagicMock()
-        converter.extract_metadata = MagicMock(return_value={'foo': 'bar'})
+        converter = MockConverter(metadata={'foo': 'bar'})
         resource_info = ResourceInfo()
 
         self._create_engine(resource_info=resource_info, converter=converter)
         self.assertEquals({'foo': 'bar'}, resource_info.metadata)
 
     def test_sets_text_from_converter_on_resource_info(self):
-        converter = MagicMock()
-        converter.extract_text = MagicMock(return_value=u'foo bar')
+        converter = MockConverter(text=u'foo bar')
         resource_info = ResourceInfo()
 
         self._create_engine(resource_info=resource_info, converter=converter)
         self.assertEquals(u'foo bar', resource_info.text)
 
+    def test_keeps_converted_metadata_and_text_without_converter(self):
+        resource_info = ResourceInfo(metadata={'foo': 'bar'}, text=u'foo')
+        ExtractionEngine(self.config, resource_info=resource_info)
+
+        self.assertEquals({'foo': 'bar'}, resource_info.metadata)
+        self.assertEquals(u'foo', resource_info.text)
+
+    def test_doesnt_convert_if_no_field_needs_it(self):
+        converter = MockConverter()
+        converter.extract = MagicMock()
+        field = Field('EXAMPLE', extractor=ExampleURLInfoExtractor())
+        resource_info = ResourceInfo(url_info={'loc': 'http://example.org'})
+        engine = self._create_engine(
+            fields=[field], resource_info=resource_info, converter=converter)
+
+        engine.extract_field_values()
+        self.assertFalse(converter.extract.called)
+
     def test_raises_type_error_for_unknown_extractor_type(self):
         field = Field('foo', extractor=Extractor())
         engine = self._create_engine(fields=[field])
@@ -191,8 +218,7 @@ class TestExtractionEngine(CrawlerTestCase):
         self.assertEquals({'int_field': [42]}, engine.extract_field_values())
 
     def test_provides_default_for_required_fields(self):
-        converter = MagicMock()
-        converter.extract_metadata = MagicMock(return_value={})
+        converter = MockConverter(metadata={})
 
         field = Field('required_field',
                       extractor=ExampleMetadataExtractor(),
@@ -204,8 +230,7 @@ class TestExtractionEngine(CrawlerTestCase):
             {'required_field': u''}, engine.extract_field_values())
 
     def test_provides_default_for_required_datetime_fields(self):
-        converter = MagicMock()
-        converter.extract_metadata = MagicMock(return_value={})
+        converter = MockConverter(metadata={})
 
         field = Field('required_datetime',
                       extractor=ExampleMetadataExtractor(),
@@ -218,8 +243,7 @@ class TestExtractionEngine(CrawlerTestCase):
             engine.extract_field_values())
 
     def test_skips_field_if_no_value_extracted_and_field_not_required(self):
-        converter = MagicMock()
-        converter.extract_metadata = MagicMock(return_value={})
+        converter = MockConverter(metadata={})
 
         field = Field('optional_field',
                       extractor=ExampleMetadataExtractor(),
@@ -229,6 +253,30 @@ class TestExtractionEngine(CrawlerTestCase):
         self.assertEquals({}, engine.extract_field_values())
 
 
+class TestGetRequiredConversions(CrawlerTestCase):
+
+    def test_metadata_extractors_need_metadata(self):
+        fields = [Field('foo', extractor=ExampleMetadataExtractor()),
+                  Field('bar', extractor=ExampleURLInfoExtractor())]
+        self.assertEquals(frozenset([METADATA]),
+                          get_required_conversions(fields))
+
+    def test_text_extractors_need_text(self):
+        fields = [Field('foo', extractor=ExampleTextExtractor())]
+        self.assertEquals(frozenset([TEXT]),
+                          get_required_conversions(fields))
+
+    def test_extractors_may_need_both(self):
+        fields = [Field('foo', extractor=SnippetTextExtractor())]
+        self.assertEquals(frozenset([METADATA, TEXT]),
+                          get_required_conversions(fields))
+
+    def test_other_extractors_need_nothing(self):
+        fields = [Field('foo', extractor=UIDExtractor()),
+                  Field('bar', extractor=ConstantExtractor('bar'))]
+        self.assertEquals(frozenset(), get_required_conversions(fields))
+
+
 class TestExtractorBaseClass(CrawlerTestCase):
 
     def test_extract_value_raises_not_implemented(self):
@@ -237,6 +285,113 @@ class TestExtractorBaseClass(CrawlerTestCase):
         with self.assertRaises(NotImplementedError):
             extractor.extract_value(resource_info)
 
+    def test_extract_memoizes_value_per_resource(self):
+        extractor = ExampleURLInfoExtractor()
+        resource_info = ResourceInfo(url_info={'loc': 'http://example.org'})
+
+        self.assertEquals(u'http://example.org',
+                          extractor.extract(resource_info))
+        resource_info.url_info['loc'] = 'http://example.org/other'
+        self.assertEquals(u'http://example.org',
+                          extractor.extract(resource_info))
+
+        other_resource_info = ResourceInfo(
+            url_info={'loc': 'http://example.org/other'})
+        self.assertEquals(u'http://example.org/other',
+                          extractor.extract(other_resource_info))
+
+    def test_extract_memoizes_no_value_extracted(self):
+        extractor = ExampleMetadataExtractor()
+        resource_info = ResourceInfo(metadata={})
+
+        with self.assertRaises(NoValueExtracted):
+            extractor.extract(resource_info)
+        resource_info.metadata['example'] = u'value'
+        with self.assertRaises(NoValueExtracted):
+            extractor.extract(resource_info)
+
+    def test_extractors_without_arguments_share_memo_key(self):
+        self.assertEquals(TitleExtractor().memo_key,
+                          TitleExtractor().memo_key)
+
+    def test_extractors_with_arguments_have_own_memo_key(self):
+        self.assertNotEquals(ConstantExtractor('foo').memo_key,
+                             ConstantExtractor('foo').memo_key)
+
+    def test_xpath_extractors_memo_key_is_expression(self):
+        self.assertEquals(XPathExtractor('//h1').memo_key,
+                          XPathExtractor('//h1').memo_key)
+        self.assertNotEquals(XPathExtractor('//h1').memo_key,
+                             XPathExtractor('//h2').memo_key)
+
+
+class TestExtractionPlan(CrawlerTestCase):
+
+    def _create_config(self, fields):
+        return Config(sites=[Site('http://example.org')], tika=None,
+                      solr=None, unique_field=None, url_field=None,
+                      last_modified_field=None, fields=fields)
+
+    def test_extracts_mapped_fields_first(self):
+        config = self._create_config([
+            Field('category', extractor=FieldMappingExtractor(
+                'subcategory', {'travel': 'TRAVEL'})),
+            Field('subcategory', extractor=ConstantExtractor('travel'))])
+        plan = ExtractionPlan(config.fields)
+
+        self.assertEquals({'category': set(['subcategory']),
+                           'subcategory': set()},
+                          plan.dependencies)
+        self.assertEquals(['subcategory', 'category'],
+                          [field.name for field in plan.fields])
+
+    def test_records_indirect_dependencies(self):
+        config = self._create_config([
+            Field('snippet', extractor=SnippetTextExtractor()),
+            Field('title', extractor=TitleExtractor()),
+            Field('text', extractor=PlainTextExtractor()),
+            Field('h1', extractor=XPathExtractor("//div[@id='content']/h1")),
+            Field('uid', extractor=UIDExtractor())])
+        plan = ExtractionPlan(config.fields)
+
+        self.assertEquals(set(['title', 'text', 'h1']),
+                          plan.dependencies['snippet'])
+        self.assertEquals(set(['h1']), plan.dependencies['title'])
+        self.assertEquals(['h1', 'text', 'title', 'snippet', 'uid'],
+                          [field.name for field in plan.fields])
+
+    def test_raises_if_fields_depend_on_each_other(self):
+        config = self._create_config([
+            Field('foo', extractor=FieldMappingExtractor('bar', {})),
+            Field('bar', extractor=FieldMappingExtractor('foo', {}))])
+
+        with self.assertRaises(ConfigError):
+            ExtractionPlan(config.fields)
+
+    def test_raises_if_mapped_field_not_found(self):
+        config = self._create_config([
+            Field('foo', extractor=FieldMappingExtractor('missing', {}))])
+
+        with self.assertRaises(NoSuchField):
+            ExtractionPlan(config.fields)
+
+    @patch.object(TitleExtractor, 'extract_value', autospec=True,
+                  return_value=u'Title')
+    def test_engine_extracts_shared_values_once(self, extract_title):
+        config = self._create_config([
+            Field('snippet', extractor=SnippetTextExtractor()),
+            Field('title', extractor=TitleExtractor()),
+            Field('category', extractor=FieldMappingExtractor(
+                'title', {u'Title': u'TITLE'}))])
+        resource_info = ResourceInfo(text=u'Title Lorem Ipsum')
+        engine = ExtractionEngine(config, resource_info)
+
+        self.assertEquals(
+            {'snippet': u' Lorem Ipsum', 'title': u'Title',
+             'category': u'TITLE'},
+            engine.extract_field_values())
+        self.assertEquals(1, extract_title.call_count)
+
 
 class TestPlainTextExtractor(CrawlerTestCase):
 
@@ -292,6 +447,18 @@ class TestTitleExtractor(CrawlerTestCase):
         self.assertEquals(u'my-title', extracted_value)
         self.assertIsInstance(extracted_value, unicode)
 
+    def test_extracts_title_from_content_without_compiling_xpath(self):
+        extractor = TitleExtractor()
+        resource_info = ResourceInfo(
+            metadata={}, headers={}, url_info={'loc': 'http://example.org/'},
+            filename=resource_filename('ftw.crawler.tests.assets',
+                                       'xhtml_doc.html'),
+            content_type='text/html')
+        with patch('ftw.crawler.extractors.compile_xpath') as compile_:
+            extracted_value = extractor.extract_value(resource_info)
+        self.assertEquals(u'Der B\xe4rengraben', extracted_value)
+        self.assertFalse(compile_.called)
+
 
 class TestXpathExtractor(CrawlerTestCase):
 
@@ -337,6 +504,101 @@ class TestXpathExtractor(CrawlerTestCase):
         with self.assertRaises(NoValueExtracted):
             extractor.extract_value(resource_info)
 
+    def test_compiles_expression_once(self):
+        extractor = XPathExtractor("//p")
+        with patch('ftw.crawler.extractors.compile_xpath',
+                   wraps=ftw.crawler.extractors.compile_xpath) as compile_:
+            extractor.prepare()
+            extractor.extract_value(self._create_resource('xhtml_doc.html'))
+            extractor.extract_value(self._create_resource('html5_doc.html'))
+        self.assertEquals(1, compile_.call_count)
+
+    def test_binding_field_validates_expression(self):
+        field = Field('foo', extractor=XPathExtractor("//p["))
+        with self.assertRaises(ConfigError):
+            Config(sites=[Site('http://example.org')], tika=None, solr=None,
+                   unique_field=None, url_field=None,
+                   last_modified_field=None, fields=[field])
+
+
+class TestMultiXPathExtractor(CrawlerTestCase):
+
+    def _create_resource(self, asset_name):
+        doc_fn = resource_filename('ftw.crawler.tests.assets', asset_name)
+        return ResourceInfo(url_info={'loc': 'http//example.org'},
+                            headers={}, filename=doc_fn,
+                            content_type='text/html')
+
+    def test_extracts_all_expressions(self):
+        extractor = MultiXPathExtractor(xpaths={
+            'title': "//div[@id='content']/h1",
+            'paragraph': "//p",
+            'missing': "//doesntexist"})
+        resource_info = self._create_resource('xhtml_doc.html')
+
+        self.assertEquals({'title': u'Der B\xe4rengraben',
+                           'paragraph': u'Foo'},
+                          extractor.extract_value(resource_info))
+
+    def test_selected_value_extractors(self):
+        extractor = MultiXPathExtractor(xpaths={
+            'title': "//div[@id='content']/h1",
+            'missing': "//doesntexist"})
+        resource_info = self._create_resource('html5_doc.html')
+
+        self.assertEquals(
+            u'Der B\xe4rengraben',
+            extractor.select('title').extract_value(resource_info))
+        with self.assertRaises(NoValueExtracted):
+            extractor.select('missing').extract_value(resource_info)
+
+    def test_extracts_once_per_document_for_all_fields(self):
+        extractor = MultiXPathExtractor(xpaths={
+            'title': "//div[@id='content']/h1", 'paragraph': "//p"})
+        config = Config(
+            sites=[Site('http://example.org')], tika=None, solr=None,
+            unique_field=None, url_field=None, last_modified_field=None,
+            fields=[Field('title', extractor=extractor.select('title')),
+                    Field('paragraph',
+                          extractor=extractor.select('paragraph'))])
+        resource_info = self._create_resource('xhtml_doc.html')
+        engine = ExtractionEngine(config, resource_info)
+
+        with patch('ftw.crawler.extractors.get_node_text',
+                   wraps=ftw.crawler.extractors.get_node_text) as get_text:
+            self.assertEquals(
+                {'title': u'Der B\xe4rengraben', 'paragraph': u'Foo'},
+                engine.extract_field_values())
+        # Each expression is evaluated once
+        self.assertEquals(2, get_text.call_count)
+
+    def test_raises_for_unknown_selector_name(self):
+        extractor = MultiXPathExtractor(xpaths={'title': "//h1"})
+        with self.assertRaises(ConfigError):
+            extractor.select('missing')
+
+    def test_prepare_validates_expressions(self):
+        extractor = MultiXPathExtractor(xpaths={'title': "//h1["})
+        with self.assertRaises(ConfigError):
+            extractor.select('title').prepare()
+
+    def test_css_selectors_need_cssselect(self):
+        extractor = MultiXPathExtractor(css={'title': 'h1'})
+        with patch('ftw.crawler.extractors.HAS_CSSSELECT', False):
+            with self.assertRaises(ConfigError):
+                extractor.prepare()
+
+    @skipUnless(ftw.crawler.extractors.HAS_CSSSELECT, 'needs cssselect')
+    def test_extracts_css_selectors(self):
+        extractor = MultiXPathExtractor(
+            xpaths={'title': "//div[@id='content']/h1"},
+            css={'paragraph': 'div#content > p'})
+        resource_info = self._create_resource('xhtml_doc.html')
+
+        self.assertEquals({'title': u'Der B\xe4rengraben',
+                           'paragraph': u'Foo'},
+                          extractor.extract_value(resource_info))
+
 
 class TestDescriptionExtractor(CrawlerTestCase):
 
@@ -482,6 +744,53 @@ class TestFilenameExtractor(CrawlerTestCase):
             extractor.extract_value(resource_info)
 
 
+class TestContentHashExtractor(CrawlerTestCase):
+
+    def test_extracts_content_hash(self):
+        extractor = ContentHashExtractor()
+        resource_info = ResourceInfo(content_hash='1234')
+        extracted_value = extractor.extract_value(resource_info)
+
+        self.assertEquals(u'1234', extracted_value)
+        self.assertIsInstance(extracted_value, unicode)
+
+    def test_raises_if_no_content_hash(self):
+        extractor = ContentHashExtractor()
+        with self.assertRaises(NoValueExtracted):
+            extractor.extract_value(ResourceInfo())
+
+    def test_is_accepted_by_extraction_engine(self):
+        config = Config(
+            sites=[Site('http://example.org')], tika=None, solr=None,
+            unique_field=None, url_field=None, last_modified_field=None,
+            fields=[Field('content_hash', extractor=ContentHashExtractor()),
+                    Field('etag', extractor=ETagExtractor())])
+        resource_info = ResourceInfo(content_hash='1234',
+                                     headers={'etag': '"abc"'})
+        engine = ExtractionEngine(config, resource_info)
+
+        self.assertEquals({'content_hash': u'1234', 'etag': u'"abc"'},
+                          engine.extract_field_values())
+
+
+class TestETagExtractor(CrawlerTestCase):
+
+    def test_extracts_etag_header(self):
+        extractor = ETagExtractor()
+        resource_info = ResourceInfo(headers={'etag': '"abc123"'})
+        extracted_value = extractor.extract_value(resource_info)
+
+        self.assertEquals(u'"abc123"', extracted_value)
+        self.assertIsInstance(extracted_value, unicode)
+
+    def test_raises_if_no_etag_header(self):
+        extractor = ETagExtractor()
+        resource_info = ResourceInfo(headers={})
+
+        with self.assertRaises(NoValueExtracted):
+            extractor.extract_value(resource_info)
+
+
 class TestKeywordsExtractor(CrawlerTestCase):
 
     def test_extracts_comma_separated_keywords(self):
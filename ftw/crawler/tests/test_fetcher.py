@@ -1,17 +1,20 @@
+from argparse import Namespace
 from datetime import datetime
 from ftw.crawler.configuration import Site
 from ftw.crawler.exceptions import AttemptedRedirect
+from ftw.crawler.exceptions import ContentUnchanged
 from ftw.crawler.exceptions import FetchingError
 from ftw.crawler.exceptions import NotModified
+from ftw.crawler.exceptions import ResourceTooLarge
+from ftw.crawler.exceptions import TooManyRequests
 from ftw.crawler.resource import ResourceInfo
 from ftw.crawler.testing import FetcherTestCase
 from ftw.crawler.tests.helpers import MockResponse
-from ftw.crawler.utils import to_http_datetime
 from ftw.crawler.utils import to_iso_datetime
 from ftw.crawler.utils import to_utc
 from mock import patch
-from testfixtures import LogCapture
-import logging
+import hashlib
+import os
 import shutil
 import tempfile
 
@@ -61,30 +64,52 @@ class TestResourceFetcher(FetcherTestCase):
             fetcher.fetch()
 
     @patch('requests.sessions.Session.get')
-    def test_sleeps_and_retries_when_too_many_requests(self, request):
-        responses = [
-            MockResponse(status_code=429),
-            MockResponse(status_code=429),
-            MockResponse(content='', headers={'Content-Type': 'text/html'}),
-        ]
-        request.side_effect = lambda url, **kw: responses.pop(0)
+    def test_raises_if_too_many_requests(self, request):
+        request.return_value = MockResponse(status_code=429)
 
         resource_info = ResourceInfo(url_info={'loc': 'http://example.org/'},
                                      site=Site('http://example.org/'))
         fetcher = self._create_fetcher(resource_info)
-        logging.disable(logging.INFO)
-        with LogCapture() as log:
-            resource_info = fetcher.fetch()
+        with self.assertRaises(TooManyRequests) as cm:
+            fetcher.fetch()
+        self.assertIsNone(cm.exception.retry_after)
+        self.assertEquals(1, request.call_count)
+
+    @patch('requests.sessions.Session.get')
+    def test_too_many_requests_carries_retry_after(self, request):
+        request.return_value = MockResponse(
+            status_code=429, headers={'Retry-After': '120'})
+
+        resource_info = ResourceInfo(url_info={'loc': 'http://example.org/'},
+                                     site=Site('http://example.org/'))
+        fetcher = self._create_fetcher(resource_info)
+        with self.assertRaises(TooManyRequests) as cm:
+            fetcher.fetch()
+        self.assertEquals(120, cm.exception.retry_after)
+
+    @patch('requests.sessions.Session.get')
+    def test_raises_too_many_requests_if_unavailable_with_retry_after(
+            self, request):
+        request.return_value = MockResponse(
+            status_code=503, headers={'Retry-After': '30'})
+
+        resource_info = ResourceInfo(url_info={'loc': 'http://example.org/'},
+                                     site=Site('http://example.org/'))
+        fetcher = self._create_fetcher(resource_info)
+        with self.assertRaises(TooManyRequests) as cm:
+            fetcher.fetch()
+        self.assertEquals(30, cm.exception.retry_after)
 
-        log.check(('ftw.crawler.fetcher',
-                   'WARNING',
-                   u'429 Too Many Requests, sleeping for 0.1s'),
-                  ('ftw.crawler.fetcher',
-                   'WARNING',
-                   u'429 Too Many Requests, sleeping for 0.2s'))
+    @patch('requests.sessions.Session.get')
+    def test_unavailable_without_retry_after_is_fetching_error(self, request):
+        request.return_value = MockResponse(status_code=503)
 
-        self.assertEquals({'Content-Type': 'text/html'},
-                          resource_info.headers)
+        resource_info = ResourceInfo(url_info={'loc': 'http://example.org/'},
+                                     site=Site('http://example.org/'))
+        fetcher = self._create_fetcher(resource_info)
+        with self.assertRaises(FetchingError) as cm:
+            fetcher.fetch()
+        self.assertNotIsInstance(cm.exception, TooManyRequests)
 
     @patch('requests.sessions.Session.get')
     def test_raises_if_redirect(self, request):
@@ -95,6 +120,119 @@ class TestResourceFetcher(FetcherTestCase):
         with self.assertRaises(AttemptedRedirect):
             fetcher.fetch()
 
+    @patch('requests.sessions.Session.get')
+    def test_streams_resource_to_file_in_chunks(self, request):
+        response = MockResponse(content='x' * 100000)
+        request.return_value = response
+        resource_info = ResourceInfo(url_info={'loc': 'http://example.org/'})
+
+        fetcher = self._create_fetcher(resource_info, tempdir=self.tempdir)
+        resource_info = fetcher.fetch()
+
+        self.assertTrue(request.call_args[1]['stream'])
+        with open(resource_info.filename) as resource_file:
+            self.assertEquals('x' * 100000, resource_file.read())
+
+    @patch('requests.sessions.Session.get')
+    def test_hashes_content_while_downloading(self, request):
+        request.return_value = MockResponse(content='x' * 100000)
+        resource_info = ResourceInfo(url_info={'loc': 'http://example.org/'})
+
+        fetcher = self._create_fetcher(resource_info, tempdir=self.tempdir)
+        resource_info = fetcher.fetch()
+
+        self.assertEquals(hashlib.sha256('x' * 100000).hexdigest(),
+                          resource_info.content_hash)
+
+    @patch('requests.sessions.Session.get')
+    def test_raises_if_content_unchanged(self, request):
+        request.return_value = MockResponse(content='MARKER')
+        resource_info = ResourceInfo(
+            url_info={'loc': 'http://example.org/'},
+            last_content_hash=hashlib.sha256('MARKER').hexdigest())
+
+        fetcher = self._create_fetcher(resource_info, tempdir=self.tempdir)
+        with self.assertRaises(ContentUnchanged):
+            fetcher.fetch()
+        self.assertEquals([], os.listdir(self.tempdir))
+
+    @patch('requests.sessions.Session.get')
+    def test_fetches_unchanged_content_if_forced(self, request):
+        request.return_value = MockResponse(content='MARKER')
+        resource_info = ResourceInfo(
+            url_info={'loc': 'http://example.org/'},
+            last_content_hash=hashlib.sha256('MARKER').hexdigest())
+
+        fetcher = self._create_fetcher(
+            resource_info, tempdir=self.tempdir,
+            options=Namespace(force=True))
+        resource_info = fetcher.fetch()
+        with open(resource_info.filename) as resource_file:
+            self.assertEquals('MARKER', resource_file.read())
+
+    @patch('requests.sessions.Session.get')
+    def test_aborts_if_content_length_exceeds_max_body_size(self, request):
+        response = MockResponse(content='x' * 11,
+                                headers={'Content-Length': '11'})
+        response.iter_content = lambda chunk_size: self.fail('Body was read')
+        request.return_value = response
+
+        resource_info = ResourceInfo(
+            url_info={'loc': 'http://example.org/'},
+            site=Site('http://example.org/', max_body_size=10))
+        fetcher = self._create_fetcher(resource_info, tempdir=self.tempdir)
+        with self.assertRaises(ResourceTooLarge):
+            fetcher.fetch()
+
+    @patch('requests.sessions.Session.get')
+    def test_aborts_download_exceeding_max_body_size(self, request):
+        request.return_value = MockResponse(content='x' * 11)
+
+        resource_info = ResourceInfo(
+            url_info={'loc': 'http://example.org/'},
+            site=Site('http://example.org/', max_body_size=10))
+        fetcher = self._create_fetcher(resource_info, tempdir=self.tempdir)
+        with self.assertRaises(ResourceTooLarge):
+            fetcher.fetch()
+
+        # The partially downloaded file is removed
+        self.assertEquals([], os.listdir(self.tempdir))
+
+    @patch('requests.sessions.Session.get')
+    def test_fetches_resource_within_max_body_size(self, request):
+        request.return_value = MockResponse(
+            content='x' * 10, headers={'Content-Length': '10'})
+
+        resource_info = ResourceInfo(
+            url_info={'loc': 'http://example.org/'},
+            site=Site('http://example.org/', max_body_size=10))
+        fetcher = self._create_fetcher(resource_info, tempdir=self.tempdir)
+        resource_info = fetcher.fetch()
+
+        with open(resource_info.filename) as resource_file:
+            self.assertEquals('x' * 10, resource_file.read())
+
+    @patch('requests.sessions.Session.get')
+    def test_holds_concurrency_slot_until_body_is_downloaded(self, request):
+        site = Site('http://example.org/', max_concurrency=1)
+        limiter = site.get_rate_limiter('http://example.org/')
+        response = MockResponse(content='MARKER')
+        iter_content = response.iter_content
+
+        def check_slot_held(chunk_size):
+            self.assertFalse(limiter._slots.acquire(False))
+            return iter_content(chunk_size)
+
+        response.iter_content = check_slot_held
+        request.return_value = response
+
+        resource_info = ResourceInfo(
+            url_info={'loc': 'http://example.org/'}, site=site)
+        fetcher = self._create_fetcher(resource_info, tempdir=self.tempdir)
+        fetcher.fetch()
+
+        self.assertTrue(limiter._slots.acquire(False))
+
     @patch('requests.sessions.Session.get')
     def test_doesnt_choke_on_charset_in_content_type(self, request):
         request.return_value = MockResponse(
@@ -150,49 +288,76 @@ class TestFetcherIsModifiedLogic(FetcherTestCase):
             "Older server modification date should lead to resource being "
             "considered UNMODIFIED")
 
-    @patch('requests.sessions.Session.head')
-    def test_is_modified_tests_against_http_last_modified(self, request):
+    def test_is_modified_without_lastmod_is_left_to_the_server(self):
         resource_info = self._create_resource_info()
         fetcher = self._create_fetcher(resource_info)
         resource_info.last_indexed = to_utc(datetime(2014, 1, 1, 15, 30))
 
-        server_modified = to_utc(datetime(2014, 1, 1, 15, 30))
-        request.return_value = MockResponse(
-            headers={'last-modified': to_http_datetime(server_modified)})
-
-        self.assertFalse(
+        self.assertTrue(
             fetcher.is_modified(),
-            "Equal modification dates should lead to resource being "
-            "considered UNMODIFIED")
+            "is_modified() should default to True if last_indexed date "
+            "is present, but no lastmod is in the sitemap")
 
-        server_modified = to_utc(datetime(2014, 1, 1, 15, 31))
-        request.return_value = MockResponse(
-            headers={'last-modified': to_http_datetime(server_modified)})
+    def test_conditional_headers_use_last_indexed_time_and_etag(self):
+        resource_info = self._create_resource_info()
+        resource_info.last_indexed = to_utc(datetime(2014, 1, 1, 15, 30))
+        resource_info.etag = '"abc123"'
+        fetcher = self._create_fetcher(resource_info)
 
-        self.assertTrue(
-            fetcher.is_modified(),
-            "Newer server modification date should lead to resource being "
-            "considered MODIFIED")
+        self.assertEquals(
+            {'If-Modified-Since': 'Wed, 01 Jan 2014 15:30:00 GMT',
+             'If-None-Match': '"abc123"'},
+            fetcher.get_conditional_headers())
 
-        server_modified = to_utc(datetime(2014, 1, 1, 15, 29))
-        request.return_value = MockResponse(
-            headers={'last-modified': to_http_datetime(server_modified)})
+    def test_no_conditional_headers_for_unindexed_resource(self):
+        fetcher = self._create_fetcher(self._create_resource_info())
+        self.assertEquals({}, fetcher.get_conditional_headers())
 
-        self.assertFalse(
-            fetcher.is_modified(),
-            "Older server modification date should lead to resource being "
-            "considered UNMODIFIED")
+    def test_no_if_modified_since_if_lastmod_is_newer(self):
+        resource_info = self._create_resource_info()
+        resource_info.last_indexed = to_utc(datetime(2014, 1, 1, 15, 30))
+        resource_info.url_info['lastmod'] = to_iso_datetime(
+            to_utc(datetime(2014, 1, 1, 15, 31)))
+        resource_info.etag = '"abc123"'
+        fetcher = self._create_fetcher(resource_info)
+
+        self.assertEquals({'If-None-Match': '"abc123"'},
+                          fetcher.get_conditional_headers())
 
     @patch('requests.sessions.Session.head')
-    def test_is_modified_defaults_to_true(self, request):
+    @patch('requests.sessions.Session.get')
+    def test_fetch_sends_conditional_get(self, request, head):
+        request.return_value = MockResponse(content='')
         resource_info = self._create_resource_info()
+        resource_info.last_indexed = to_utc(datetime(2014, 1, 1, 15, 30))
         fetcher = self._create_fetcher(resource_info)
+        fetcher.fetch()
+
+        self.assertEquals(0, head.call_count)
+        self.assertEquals(
+            {'If-Modified-Since': 'Wed, 01 Jan 2014 15:30:00 GMT'},
+            request.call_args[1]['headers'])
+
+    @patch('requests.sessions.Session.get')
+    def test_forced_fetch_isnt_conditional(self, request):
+        request.return_value = MockResponse(content='')
+        resource_info = self._create_resource_info()
         resource_info.last_indexed = to_utc(datetime(2014, 1, 1, 15, 30))
+        fetcher = self._create_fetcher(
+            resource_info, options=Namespace(force=True))
+        fetcher.fetch()
 
-        self.assertTrue(
-            fetcher.is_modified(),
-            "is_modified() should default to True if last_indexed date "
-            "is present, but no server modification date could be determined")
+        self.assertEquals({}, request.call_args[1]['headers'])
+
+    @patch('requests.sessions.Session.get')
+    def test_raises_not_modified_on_304(self, request):
+        request.return_value = MockResponse(status_code=304)
+        resource_info = self._create_resource_info()
+        resource_info.last_indexed = to_utc(datetime(2014, 1, 1, 15, 30))
+        fetcher = self._create_fetcher(resource_info)
+
+        with self.assertRaises(NotModified):
+            fetcher.fetch()
 
     @patch('ftw.crawler.fetcher.ResourceFetcher.is_modified')
     @patch('requests.sessions.Session.get')
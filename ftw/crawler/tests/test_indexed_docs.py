@@ -0,0 +1,83 @@
+from argparse import Namespace
+from datetime import datetime
+from ftw.crawler.configuration import get_config
+from ftw.crawler.indexed_docs import IndexedDocs
+from ftw.crawler.testing import CrawlerTestCase
+from mock import patch
+from pkg_resources import resource_filename
+import pytz
+
+
+BASIC_CONFIG = resource_filename('ftw.crawler.tests.assets', 'basic_config.py')
+
+
+class TestIndexedDocs(CrawlerTestCase):
+
+    def setUp(self):
+        CrawlerTestCase.setUp(self)
+        args = Namespace(tika=None, solr=None,
+                         slacktoken=None, slackchannel=None)
+        args.config = BASIC_CONFIG
+        self.config = get_config(args)
+        self.docs = [
+            {'UID': '1', 'path_string': 'http://example.org/one',
+             'modified': '2015-01-02T10:00:00Z'},
+            {'UID': '2', 'path_string': 'http://example.org/two',
+             'modified': '2015-03-04T12:30:00Z'},
+        ]
+
+    def test_iterates_over_docs(self):
+        indexed_docs = IndexedDocs(self.config, self.docs)
+        self.assertEquals(self.docs, list(indexed_docs))
+        self.assertEquals(2, len(indexed_docs))
+
+    def test_looks_up_docs_by_url(self):
+        indexed_docs = IndexedDocs(self.config, self.docs)
+        self.assertIn('http://example.org/two', indexed_docs)
+        self.assertNotIn('http://example.org/three', indexed_docs)
+        self.assertEquals(
+            '2', indexed_docs.get('http://example.org/two')['UID'])
+        self.assertIsNone(indexed_docs.get('http://example.org/three'))
+
+    def test_returns_indexing_time(self):
+        indexed_docs = IndexedDocs(self.config, self.docs)
+        self.assertEquals(
+            datetime(2015, 3, 4, 12, 30, tzinfo=pytz.utc),
+            indexed_docs.get_indexing_time('http://example.org/two'))
+
+    def test_indexing_time_is_none_for_unindexed_url(self):
+        indexed_docs = IndexedDocs(self.config, self.docs)
+        self.assertIsNone(
+            indexed_docs.get_indexing_time('http://example.org/three'))
+
+    def test_parses_dates_lazily_and_only_once(self):
+        with patch('ftw.crawler.indexed_docs.from_iso_datetime') as parse:
+            indexed_docs = IndexedDocs(self.config, self.docs)
+            self.assertEquals(0, parse.call_count)
+
+            indexed_docs.get_indexing_time('http://example.org/one')
+            indexed_docs.get_indexing_time('http://example.org/one')
+            self.assertEquals(1, parse.call_count)
+
+    def test_returns_etag_if_etag_field_configured(self):
+        self.config.etag_field = 'etag'
+        self.docs[0]['etag'] = '"abc123"'
+        indexed_docs = IndexedDocs(self.config, self.docs)
+        self.assertEquals(
+            '"abc123"', indexed_docs.get_etag('http://example.org/one'))
+        self.assertIsNone(indexed_docs.get_etag('http://example.org/two'))
+        self.assertIsNone(indexed_docs.get_etag('http://example.org/three'))
+
+    def test_etag_is_none_without_etag_field(self):
+        self.docs[0]['etag'] = '"abc123"'
+        indexed_docs = IndexedDocs(self.config, self.docs)
+        self.assertIsNone(indexed_docs.get_etag('http://example.org/one'))
+
+    def test_returns_content_hash_if_content_hash_field_configured(self):
+        self.config.content_hash_field = 'content_hash'
+        self.docs[0]['content_hash'] = '1234'
+        indexed_docs = IndexedDocs(self.config, self.docs)
+        self.assertEquals(
+            '1234', indexed_docs.get_content_hash('http://example.org/one'))
+        self.assertIsNone(
+            indexed_docs.get_content_hash('http://example.org/two'))
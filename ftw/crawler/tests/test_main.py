@@ -0,0 +1,430 @@
+from argparse import Namespace
+from ftw.crawler.checkpoint import Checkpoint
+from ftw.crawler.configuration import Config
+from ftw.crawler.configuration import Field
+from ftw.crawler.configuration import Site
+from ftw.crawler.exceptions import ConfigError
+from ftw.crawler.exceptions import TooManyRequests
+from ftw.crawler.extractors import UIDExtractor
+from ftw.crawler.extractors import URLExtractor
+from ftw.crawler.main import crawl_site_in_process
+from ftw.crawler.main import crawl_sites_in_processes
+from ftw.crawler.main import CrawlItem
+from ftw.crawler.main import get_max_retries
+from ftw.crawler.main import get_stage_workers
+from ftw.crawler.main import MAX_RETRY_AFTER
+from ftw.crawler.main import shutdown_requested
+from ftw.crawler.main import SiteCrawler
+from ftw.crawler.sitemap import Sitemap
+from ftw.crawler.sitemap import VirtualSitemapIndex
+from ftw.crawler.testing import CrawlerTestCase
+from ftw.crawler.tests.helpers import get_asset
+from ftw.crawler.tests.helpers import MockConverter
+from ftw.crawler.tests.helpers import MockResponse
+from mock import MagicMock
+from mock import patch
+import json
+import os
+import shutil
+import tempfile
+
+
+SITE_URL = 'http://example.org/'
+SITEMAP_URL = 'http://example.org/sitemap.xml'
+
+
+class SiteCrawlerTestCase(CrawlerTestCase):
+
+    def setUp(self):
+        CrawlerTestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp(prefix='ftw.crawler.tests_')
+
+        self.site = Site(SITE_URL, sleeptime=0)
+        self.config = Config(
+            sites=[self.site], tika='http://localhost:9998',
+            solr='http://localhost:8983/solr',
+            unique_field='UID', url_field='path_string',
+            last_modified_field='modified',
+            fields=[Field('UID', extractor=UIDExtractor()),
+                    Field('path_string', extractor=URLExtractor())])
+
+        self.solr = MagicMock()
+        self.solr.index_many.return_value = MockResponse(status_code=200)
+        self.solr.commit.return_value = MockResponse(status_code=200)
+        self.solr.search_iter.return_value = iter([])
+
+    def tearDown(self):
+        CrawlerTestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def create_options(self, **kwargs):
+        options = Namespace(url=None, force=False, workers=None,
+                            stage_workers=None, max_retries=None,
+                            resume=False)
+        for key, value in kwargs.items():
+            setattr(options, key, value)
+        return options
+
+    def create_crawler(self, **options):
+        return SiteCrawler(self.tempdir, self.config,
+                           self.create_options(**options), self.solr,
+                           self.site, converter=MockConverter())
+
+    def crawl(self, crawler, responses):
+        """Crawl the URLs of the sitemap asset (http://example.org/foo and
+        http://example.org/bar), with the fetcher's session returning the
+        given responses in turn.
+        """
+        crawler.fetcher_session = MagicMock()
+        crawler.fetcher_session.get.side_effect = responses
+
+        sitemap = Sitemap(self.site, get_asset('sitemap.xml'),
+                          url=SITEMAP_URL)
+        with patch('ftw.crawler.main.SitemapIndexFetcher') as fetcher:
+            fetcher.return_value.fetch.return_value = VirtualSitemapIndex(
+                self.site, [sitemap])
+            crawler.crawl()
+
+    def fetched_urls(self, crawler):
+        return [call[0][0] for call in
+                crawler.fetcher_session.get.call_args_list]
+
+    def indexed_urls(self):
+        return [document['path_string']
+                for call in self.solr.index_many.call_args_list
+                for document in call[0][0]]
+
+
+class TestSiteCrawlerIndexing(SiteCrawlerTestCase):
+
+    def test_fetches_and_indexes_all_urls_of_sitemap(self):
+        crawler = self.create_crawler()
+        self.crawl(crawler, [MockResponse(content='foo'),
+                             MockResponse(content='bar')])
+
+        self.assertEquals(['http://example.org/foo', 'http://example.org/bar'],
+                          self.fetched_urls(crawler))
+        self.assertEquals(['http://example.org/foo', 'http://example.org/bar'],
+                          self.indexed_urls())
+        self.assertTrue(self.solr.commit.called)
+
+    @patch('ftw.crawler.main.SitemapIndexFetcher')
+    def test_indexes_buffered_documents_if_crawling_fails(self, fetcher):
+        fetcher.return_value.fetch.return_value = MagicMock(sitemaps=[])
+        crawler = self.create_crawler()
+
+        def crawl_sitemaps(sitemaps):
+            crawler.indexer.add({'UID': '1'})
+            raise ValueError('Boom')
+
+        crawler.crawl_sitemaps = crawl_sitemaps
+        with self.assertRaises(ValueError):
+            crawler.crawl()
+
+        documents = self.solr.index_many.call_args[0][0]
+        self.assertEquals([{'UID': '1'}], documents)
+        self.assertTrue(self.solr.commit.called)
+
+
+class TestSiteCrawlerThrottling(SiteCrawlerTestCase):
+
+    def create_item(self, attempts=1):
+        item = CrawlItem(None, {'loc': 'http://example.org/foo'}, '[1/1]')
+        item.attempts = attempts
+        return item
+
+    def test_retry_delay_doubles_for_every_attempt(self):
+        self.site.sleeptime = 2
+        crawler = self.create_crawler()
+        exc = TooManyRequests('429 Too Many Requests')
+
+        self.assertEquals(2, crawler.get_retry_delay(self.create_item(1), exc))
+        self.assertEquals(8, crawler.get_retry_delay(self.create_item(3), exc))
+
+    def test_retry_delay_uses_retry_after(self):
+        crawler = self.create_crawler()
+        exc = TooManyRequests('429 Too Many Requests', retry_after=30)
+        self.assertEquals(30, crawler.get_retry_delay(self.create_item(), exc))
+
+    def test_gives_up_if_retry_after_is_too_long(self):
+        crawler = self.create_crawler()
+        exc = TooManyRequests('429 Too Many Requests',
+                              retry_after=MAX_RETRY_AFTER + 1)
+        self.assertIsNone(crawler.get_retry_delay(self.create_item(), exc))
+        # Giving up doesn't use up the retry budget
+        self.assertEquals(0, crawler.retries)
+
+    def test_gives_up_once_retry_budget_is_used_up(self):
+        crawler = self.create_crawler(max_retries=1)
+        exc = TooManyRequests('429 Too Many Requests')
+
+        self.assertEquals(0, crawler.get_retry_delay(self.create_item(), exc))
+        self.assertIsNone(crawler.get_retry_delay(self.create_item(), exc))
+
+    def test_retries_throttled_url(self):
+        crawler = self.create_crawler()
+        self.crawl(crawler, [MockResponse(status_code=429),
+                             MockResponse(content='foo'),
+                             MockResponse(content='bar')])
+
+        self.assertEquals(3, len(self.fetched_urls(crawler)))
+        self.assertItemsEqual(
+            ['http://example.org/foo', 'http://example.org/bar'],
+            self.indexed_urls())
+
+    def test_skips_throttled_urls_once_retry_budget_is_used_up(self):
+        crawler = self.create_crawler(max_retries=1)
+        self.crawl(crawler, [MockResponse(status_code=429)] * 3)
+
+        # Two first attempts, and a single retry
+        self.assertEquals(3, len(self.fetched_urls(crawler)))
+        self.assertEquals(1, crawler.retries)
+        self.assertEquals([], self.indexed_urls())
+
+    def test_skips_url_if_retry_after_is_too_long(self):
+        crawler = self.create_crawler()
+        too_long = {'Retry-After': str(MAX_RETRY_AFTER + 1)}
+        self.crawl(crawler, [MockResponse(status_code=429, headers=too_long),
+                             MockResponse(content='bar')])
+
+        self.assertEquals(2, len(self.fetched_urls(crawler)))
+        self.assertEquals(0, crawler.retries)
+        self.assertEquals(['http://example.org/bar'], self.indexed_urls())
+
+
+class TestSiteCrawlerCheckpoint(SiteCrawlerTestCase):
+
+    def setUp(self):
+        SiteCrawlerTestCase.setUp(self)
+        self.config.checkpoint_dir = os.path.join(self.tempdir, 'checkpoints')
+
+        # A previous crawl got interrupted after finishing the first URL
+        checkpoint = Checkpoint(self.config.checkpoint_dir, SITE_URL)
+        checkpoint.open()
+        checkpoint.finish(SITEMAP_URL, 'http://example.org/foo')
+        checkpoint.close()
+        self.checkpoint_path = checkpoint.path
+
+    def test_resumed_crawl_skips_finished_urls(self):
+        crawler = self.create_crawler(resume=True)
+        self.crawl(crawler, [MockResponse(content='bar')])
+
+        self.assertEquals(['http://example.org/bar'],
+                          self.fetched_urls(crawler))
+        self.assertEquals(['http://example.org/bar'], self.indexed_urls())
+
+    def test_crawl_without_resume_starts_over(self):
+        crawler = self.create_crawler()
+        self.crawl(crawler, [MockResponse(content='foo'),
+                             MockResponse(content='bar')])
+
+        self.assertEquals(['http://example.org/foo', 'http://example.org/bar'],
+                          self.fetched_urls(crawler))
+
+    def test_removes_checkpoint_once_site_is_crawled(self):
+        crawler = self.create_crawler(resume=True)
+        self.crawl(crawler, [MockResponse(content='bar')])
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def read_checkpoint(self):
+        with open(self.checkpoint_path) as checkpoint_file:
+            return [json.loads(line) for line in checkpoint_file]
+
+    @patch.object(Checkpoint, 'remove')
+    def test_finishes_indexed_urls_once_committed(self, remove):
+        entries_when_committing = []
+
+        def commit():
+            entries_when_committing.extend(self.read_checkpoint())
+            return MockResponse(status_code=200)
+        self.solr.commit.side_effect = commit
+
+        crawler = self.create_crawler()
+        self.crawl(crawler, [MockResponse(content='foo'),
+                             MockResponse(content='bar')])
+
+        self.assertEquals([], entries_when_committing)
+        self.assertItemsEqual(
+            [{'sitemap': SITEMAP_URL, 'url': 'http://example.org/foo'},
+             {'sitemap': SITEMAP_URL, 'url': 'http://example.org/bar'},
+             {'sitemap': SITEMAP_URL, 'completed': True}],
+            self.read_checkpoint())
+
+    @patch.object(Checkpoint, 'remove')
+    def test_doesnt_finish_indexed_urls_if_commit_fails(self, remove):
+        self.solr.commit.return_value = MockResponse(status_code=500)
+
+        crawler = self.create_crawler()
+        self.crawl(crawler, [MockResponse(content='foo'),
+                             MockResponse(content='bar')])
+
+        self.assertEquals([], self.read_checkpoint())
+
+    @patch.object(Checkpoint, 'remove')
+    def test_finishes_indexed_urls_right_away_with_commit_within(
+            self, remove):
+        self.config.solr_commit_within = 1000
+
+        crawler = self.create_crawler()
+        self.crawl(crawler, [MockResponse(content='foo'),
+                             MockResponse(content='bar')])
+
+        self.assertFalse(self.solr.commit.called)
+        self.assertEquals(3, len(self.read_checkpoint()))
+
+
+class TestStageWorkers(SiteCrawlerTestCase):
+
+    def test_stages_use_the_sites_workers_by_default(self):
+        self.site.workers = 3
+        crawler = self.create_crawler()
+        self.assertEquals(
+            {'fetch': 3, 'convert': 3, 'extract': 3, 'index': 3},
+            crawler.stage_workers)
+
+    def test_command_line_overrides_site_config(self):
+        self.site.stage_workers = {'fetch': 4, 'convert': 2}
+        crawler = self.create_crawler(stage_workers=[('fetch', 8)])
+        self.assertEquals(
+            {'fetch': 8, 'convert': 2, 'extract': 1, 'index': 1},
+            crawler.stage_workers)
+
+    def test_pipeline_stages_use_stage_workers(self):
+        crawler = self.create_crawler(stage_workers=[('convert', 5)])
+        stages = crawler.create_pipeline().stages
+        self.assertEquals(
+            [('fetch', 1), ('convert', 5), ('extract', 1), ('index', 1)],
+            [(stage.name, stage.workers) for stage in stages])
+
+    def test_crawls_with_stage_workers(self):
+        crawler = self.create_crawler(
+            stage_workers=[('fetch', 2), ('extract', 2)])
+        self.crawl(crawler, [MockResponse(content='foo'),
+                             MockResponse(content='bar')])
+        self.assertItemsEqual(
+            ['http://example.org/foo', 'http://example.org/bar'],
+            self.indexed_urls())
+
+    def test_raises_for_unknown_stage(self):
+        options = self.create_options(stage_workers=[('parse', 2)])
+        with self.assertRaises(ConfigError):
+            get_stage_workers(self.site, options)
+
+    def test_max_retries_from_command_line_overrides_site_config(self):
+        self.site.max_retries = 10
+        self.assertEquals(
+            10, get_max_retries(self.site, self.create_options()))
+        self.assertEquals(
+            3, get_max_retries(self.site, self.create_options(max_retries=3)))
+
+
+class InProcessPool(object):
+    """Stands in for a `multiprocessing.Pool`, running the jobs in the
+    current process.
+    """
+
+    def __init__(self, processes=None, maxtasksperchild=None):
+        pass
+
+    def apply_async(self, func, args, callback=None):
+        result = func(*args)
+        if callback is not None:
+            callback(result)
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class TestCrawlSitesInProcesses(SiteCrawlerTestCase):
+
+    def setUp(self):
+        SiteCrawlerTestCase.setUp(self)
+        self.failing_site = Site('http://failing.org/', sleeptime=0)
+        self.config.sites.append(self.failing_site)
+
+    def crawl_site(self, tempdir, config, options, solr, site, *args):
+        if site is self.failing_site:
+            raise ValueError('Boom')
+
+    @patch('ftw.crawler.main.create_solr_connector')
+    @patch('ftw.crawler.main.get_config')
+    def test_returns_error_of_failing_site(self, get_config, create_solr):
+        get_config.return_value = self.config
+        with patch('ftw.crawler.main.crawl_site', self.crawl_site):
+            self.assertEquals(
+                (SITE_URL, None, None),
+                crawl_site_in_process(
+                    (self.tempdir, self.create_options(), SITE_URL)))
+            self.assertEquals(
+                ('http://failing.org/', 'ValueError', 'Boom'),
+                crawl_site_in_process(
+                    (self.tempdir, self.create_options(),
+                     'http://failing.org/')))
+
+        # The process' temporary directories are removed again
+        self.assertEquals([], os.listdir(self.tempdir))
+
+    @patch('ftw.crawler.main.create_crawl_state')
+    @patch('ftw.crawler.main.create_solr_connector')
+    @patch('ftw.crawler.main.get_config')
+    def test_closes_crawl_state(self, get_config, create_solr,
+                                create_state):
+        get_config.return_value = self.config
+        state = create_state.return_value
+        crawl_site = MagicMock(side_effect=ValueError('Boom'))
+        with patch('ftw.crawler.main.crawl_site', crawl_site):
+            crawl_site_in_process(
+                (self.tempdir, self.create_options(), SITE_URL))
+
+        self.assertIs(state, crawl_site.call_args[0][6])
+        state.close.assert_called_once_with()
+
+    @patch('ftw.crawler.main.get_config')
+    def test_returns_error_if_config_cant_be_loaded(self, get_config):
+        get_config.side_effect = ValueError('Tika and Solr URLs must be set')
+        self.assertEquals(
+            (SITE_URL, 'ValueError', 'Tika and Solr URLs must be set'),
+            crawl_site_in_process(
+                (self.tempdir, self.create_options(), SITE_URL)))
+
+    @patch('ftw.crawler.main.multiprocessing.Pool', InProcessPool)
+    @patch('ftw.crawler.main.create_solr_connector')
+    @patch('ftw.crawler.main.get_config')
+    def test_yields_failure_per_site(self, get_config, create_solr):
+        get_config.return_value = self.config
+        with patch('ftw.crawler.main.crawl_site', self.crawl_site):
+            results = dict(crawl_sites_in_processes(
+                self.tempdir, self.create_options(), self.config.sites, 2))
+
+        self.assertIsNone(results[SITE_URL])
+        error = results['http://failing.org/']
+        self.assertEquals('ValueError', error.exc_type_name)
+        self.assertEquals('Boom', error.message)
+
+    @patch('ftw.crawler.main.multiprocessing.Pool', InProcessPool)
+    @patch('ftw.crawler.main.create_solr_connector')
+    @patch('ftw.crawler.main.get_config')
+    def test_stops_starting_sites_on_shutdown(self, get_config, create_solr):
+        get_config.return_value = self.config
+        crawled = []
+
+        def crawl_site(tempdir, config, options, solr, site, *args):
+            crawled.append(site.url)
+            shutdown_requested.set()
+
+        with patch('ftw.crawler.main.crawl_site', crawl_site):
+            try:
+                results = list(crawl_sites_in_processes(
+                    self.tempdir, self.create_options(), self.config.sites,
+                    1))
+            finally:
+                shutdown_requested.clear()
+
+        self.assertEquals([SITE_URL], crawled)
+        self.assertEquals([(SITE_URL, None)], results)
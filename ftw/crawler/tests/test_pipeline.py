@@ -0,0 +1,175 @@
+from ftw.crawler.pipeline import Pipeline
+from ftw.crawler.pipeline import RetryLater
+from ftw.crawler.pipeline import Stage
+from ftw.crawler.testing import CrawlerTestCase
+import threading
+import time
+
+
+class TestPipeline(CrawlerTestCase):
+
+    def test_passes_items_through_all_stages_in_order(self):
+        results = []
+        pipeline = Pipeline([
+            Stage('double', lambda x: x * 2),
+            Stage('increment', lambda x: x + 1),
+            Stage('collect', results.append),
+        ])
+        pipeline.run(range(5))
+        self.assertEquals([1, 3, 5, 7, 9], results)
+
+    def test_drops_items_if_stage_returns_none(self):
+        results = []
+        pipeline = Pipeline([
+            Stage('filter', lambda x: x if x % 2 else None),
+            Stage('collect', results.append),
+        ])
+        pipeline.run(range(6))
+        self.assertEquals([1, 3, 5], results)
+
+    def test_processes_all_items_with_concurrent_stages(self):
+        results = []
+        lock = threading.Lock()
+
+        def collect(item):
+            with lock:
+                results.append(item)
+
+        pipeline = Pipeline([
+            Stage('double', lambda x: x * 2, workers=4),
+            Stage('increment', lambda x: x + 1, workers=1),
+            Stage('collect', collect, workers=3),
+        ])
+        pipeline.run(range(100))
+        self.assertEquals(range(1, 200, 2), sorted(results))
+
+    def test_stages_run_in_their_own_threads(self):
+        thread_names = {}
+
+        def record(name):
+            def func(item):
+                thread_names.setdefault(name, set()).add(
+                    threading.current_thread().name)
+                return item
+            return func
+
+        pipeline = Pipeline([
+            Stage('first', record('first'), workers=2),
+            Stage('second', record('second'), workers=1),
+        ])
+        pipeline.run(range(10))
+        self.assertEquals(set(['second-0']), thread_names['second'])
+        self.assertTrue(
+            thread_names['first'].issubset(set(['first-0', 'first-1'])))
+
+    def test_slow_stage_throttles_previous_stages(self):
+        max_in_flight = [0]
+        in_flight = [0]
+        lock = threading.Lock()
+
+        def produce(item):
+            with lock:
+                in_flight[0] += 1
+                max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            return item
+
+        def consume(item):
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+
+        pipeline = Pipeline([
+            Stage('produce', produce, workers=2),
+            Stage('consume', consume, workers=1, queue_size=2),
+        ])
+        pipeline.run(range(20))
+        # At most: queue size + consuming worker + blocked producers
+        self.assertLessEqual(max_in_flight[0], 2 + 1 + 2)
+
+    def test_reraises_exception_from_any_stage(self):
+        def fail(item):
+            if item == 5:
+                raise ValueError('Boom')
+            return item
+
+        pipeline = Pipeline([
+            Stage('first', lambda x: x, workers=2),
+            Stage('fail', fail, workers=2),
+            Stage('last', lambda x: x, workers=2),
+        ])
+        with self.assertRaises(ValueError):
+            pipeline.run(range(20))
+
+    def test_reports_queue_depths(self):
+        pipeline = Pipeline([
+            Stage('first', lambda x: x),
+            Stage('second', lambda x: x),
+        ])
+        self.assertEquals([('first', 0), ('second', 0), ('delayed', 0)],
+                          pipeline.queue_depths())
+        self.assertEquals(u'first=0, second=0, delayed=0',
+                          pipeline.format_queue_depths())
+
+    def test_retries_items_later(self):
+        attempts = {}
+        results = []
+
+        def flaky(item):
+            attempts[item] = attempts.get(item, 0) + 1
+            if item == 2 and attempts[item] < 3:
+                raise RetryLater(0.01)
+            return item
+
+        pipeline = Pipeline([
+            Stage('flaky', flaky),
+            Stage('collect', results.append),
+        ])
+        pipeline.run(range(5))
+        self.assertEquals([0, 1, 3, 4, 2], results)
+        self.assertEquals(3, attempts[2])
+
+    def test_retried_items_dont_block_workers(self):
+        results = []
+        lock = threading.Lock()
+
+        def throttled(item):
+            if item == 0 and not results:
+                raise RetryLater(0.05)
+            with lock:
+                results.append(item)
+
+        pipeline = Pipeline([Stage('throttled', throttled, workers=2)])
+        pipeline.run(range(10))
+        self.assertEquals(range(1, 10) + [0], results)
+
+    def test_stops_feeding_items_when_stop_event_is_set(self):
+        stop_event = threading.Event()
+        results = []
+
+        def process(item):
+            if item == 2:
+                stop_event.set()
+            results.append(item)
+
+        pipeline = Pipeline([Stage('process', process)],
+                            stop_event=stop_event)
+        pipeline.run(range(10))
+        self.assertEquals([0, 1, 2], results)
+
+    def test_drops_delayed_items_when_stopping(self):
+        stop_event = threading.Event()
+        results = []
+
+        def throttled(item):
+            if item == 0:
+                raise RetryLater(60)
+            if item == 1:
+                stop_event.set()
+            results.append(item)
+
+        pipeline = Pipeline([Stage('throttled', throttled)],
+                            stop_event=stop_event)
+        start = time.time()
+        pipeline.run(range(5))
+        self.assertEquals([1], results)
+        self.assertLess(time.time() - start, 5)
@@ -5,6 +5,7 @@ from ftw.crawler.purging import purge_removed_docs_from_index
 from ftw.crawler.sitemap import VirtualSitemapIndex
 from ftw.crawler.testing import SitemapTestCase
 from ftw.crawler.testing import SolrTestCase
+from mock import MagicMock
 from mock import patch
 from pkg_resources import resource_filename
 
@@ -41,6 +42,25 @@ class TestPurging(SolrTestCase, SitemapTestCase):
         delete.assert_called_with(u'2')
         self.assertEqual(1, delete.call_count)
 
+    @patch('ftw.crawler.solr.SolrConnector.delete')
+    def test_removes_purged_doc_from_crawl_state(self, delete):
+        indexed_docs = [
+            {'UID': '1', 'url': 'http://www.pctipp.ch/download'},
+            {'UID': '2', 'url': 'http://www.pctipp.ch/about'},
+        ]
+        pctipp = self.config.get_site('http://www.pctipp.ch/')
+
+        sitemap = self.create_sitemap(
+            urls=['http://www.pctipp.ch/download'],
+            site=pctipp)
+
+        sitemap_index = VirtualSitemapIndex(pctipp, sitemaps=[sitemap])
+        state = MagicMock()
+        purge_removed_docs_from_index(self.config, sitemap_index, indexed_docs,
+                                      state=state)
+
+        state.remove.assert_called_once_with(u'http://www.pctipp.ch/about')
+
     @patch('ftw.crawler.solr.SolrConnector.delete')
     def test_doesnt_touch_any_docs_not_starting_with_site_urls(self, delete):
         indexed_docs = [
@@ -0,0 +1,139 @@
+from ftw.crawler.configuration import Site
+from ftw.crawler.ratelimit import DEFAULT_BACKOFF_RATE
+from ftw.crawler.ratelimit import HostRateLimiter
+from ftw.crawler.ratelimit import MIN_RATE
+from ftw.crawler.ratelimit import RECOVERY_THRESHOLD
+from ftw.crawler.ratelimit import TokenBucket
+from ftw.crawler.testing import CrawlerTestCase
+from mock import patch
+import threading
+
+
+class TestTokenBucket(CrawlerTestCase):
+
+    def test_unlimited_bucket_never_waits(self):
+        bucket = TokenBucket(rate=None)
+        self.assertEquals([0, 0, 0], [bucket.reserve() for n in range(3)])
+
+    @patch('time.time')
+    def test_spaces_out_reservations_according_to_rate(self, time):
+        time.return_value = 1000.0
+        bucket = TokenBucket(rate=2)
+        self.assertEquals([0, 0.5, 1.0], [bucket.reserve() for n in range(3)])
+
+    @patch('time.time')
+    def test_refills_tokens_over_time(self, time):
+        time.return_value = 1000.0
+        bucket = TokenBucket(rate=2)
+        self.assertEquals(0, bucket.reserve())
+
+        time.return_value = 1000.5
+        self.assertEquals(0, bucket.reserve())
+
+    @patch('time.time')
+    def test_allows_bursts_up_to_capacity(self, time):
+        time.return_value = 1000.0
+        bucket = TokenBucket(rate=1, capacity=2)
+        self.assertEquals([0, 0, 1.0], [bucket.reserve() for n in range(3)])
+
+
+class TestHostRateLimiter(CrawlerTestCase):
+
+    def test_is_unlimited_by_default(self):
+        limiter = HostRateLimiter('example.org')
+        self.assertIsNone(limiter.rate)
+
+    def test_backs_off_to_backoff_rate_when_unlimited(self):
+        limiter = HostRateLimiter('example.org', backoff_rate=10.0)
+        limiter.release(429)
+        self.assertEquals(10.0, limiter.rate)
+
+    def test_halves_rate_on_429_and_503(self):
+        limiter = HostRateLimiter('example.org', rate=8.0)
+        limiter.release(429)
+        self.assertEquals(4.0, limiter.rate)
+        limiter.release(503)
+        self.assertEquals(2.0, limiter.rate)
+
+    def test_doesnt_back_off_below_min_rate(self):
+        limiter = HostRateLimiter('example.org', rate=MIN_RATE)
+        limiter.release(429)
+        self.assertEquals(MIN_RATE, limiter.rate)
+
+    def test_speeds_up_after_run_of_successful_responses(self):
+        limiter = HostRateLimiter('example.org', rate=8.0)
+        limiter.backoff()
+        limiter.backoff()
+        self.assertEquals(2.0, limiter.rate)
+
+        for n in range(RECOVERY_THRESHOLD - 1):
+            limiter.release(200)
+        self.assertEquals(2.0, limiter.rate)
+
+        limiter.release(200)
+        self.assertEquals(3.0, limiter.rate)
+
+    def test_doesnt_speed_up_beyond_configured_rate(self):
+        limiter = HostRateLimiter('example.org', rate=8.0)
+        limiter.backoff()
+        for n in range(RECOVERY_THRESHOLD * 5):
+            limiter.release(200)
+        self.assertEquals(8.0, limiter.rate)
+
+    def test_returns_to_unlimited_after_recovering(self):
+        limiter = HostRateLimiter('example.org', backoff_rate=10.0)
+        limiter.backoff()
+        limiter.backoff()
+        for n in range(RECOVERY_THRESHOLD * 5):
+            limiter.release(200)
+        self.assertIsNone(limiter.rate)
+
+    def test_backoff_resets_run_of_successful_responses(self):
+        limiter = HostRateLimiter('example.org', rate=8.0)
+        limiter.backoff()
+        for n in range(RECOVERY_THRESHOLD - 1):
+            limiter.release(200)
+        limiter.release(429)
+        limiter.release(200)
+        self.assertEquals(2.0, limiter.rate)
+
+    def test_limits_concurrent_requests(self):
+        limiter = HostRateLimiter('example.org', max_concurrency=2)
+        limiter.acquire()
+        limiter.acquire()
+
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+
+        limiter.release(200)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+
+class TestSiteRateLimiters(CrawlerTestCase):
+
+    def test_shares_rate_limiter_per_host(self):
+        site = Site('http://example.org/')
+        limiter = site.get_rate_limiter('http://example.org/foo')
+        self.assertIs(limiter, site.get_rate_limiter('http://EXAMPLE.org/bar'))
+        self.assertIsNot(limiter, site.get_rate_limiter('http://other.org/'))
+
+    def test_rate_limiter_uses_site_settings(self):
+        site = Site('http://example.org/', sleeptime=0.5,
+                    requests_per_second=4, max_concurrency=2)
+        limiter = site.get_rate_limiter('http://example.org/')
+        self.assertEquals(4, limiter.rate)
+        self.assertEquals(2, limiter.max_concurrency)
+        self.assertEquals(2.0, limiter.backoff_rate)
+
+    def test_rate_limiter_without_sleeptime(self):
+        site = Site('http://example.org/', sleeptime=0)
+        limiter = site.get_rate_limiter('http://example.org/')
+        self.assertEquals(DEFAULT_BACKOFF_RATE, limiter.backoff_rate)
@@ -0,0 +1,124 @@
+from ftw.crawler.extractors import SnippetTextExtractor
+from ftw.crawler.extractors import TitleExtractor
+from ftw.crawler.extractors import XPathExtractor
+from ftw.crawler.resource import METADATA
+from ftw.crawler.resource import ResourceInfo
+from ftw.crawler.resource import TEXT
+from ftw.crawler.testing import CrawlerTestCase
+from ftw.crawler.tests.helpers import MockConverter
+from ftw.crawler.xml_utils import detect_encoding
+from ftw.crawler.xml_utils import parse_markup
+from mock import MagicMock
+from mock import patch
+from pkg_resources import resource_filename
+
+
+class TestResourceInfo(CrawlerTestCase):
+
+    def _create_converter(self):
+        converter = MockConverter(metadata={'title': u'Foo'}, text='foo bar')
+        return MagicMock(wraps=converter)
+
+    def test_doesnt_convert_until_accessed(self):
+        converter = self._create_converter()
+        ResourceInfo(converter=converter)
+        self.assertEquals([], converter.method_calls)
+
+    def test_converts_only_accessed_part(self):
+        converter = self._create_converter()
+        resource_info = ResourceInfo(converter=converter, conversions=[])
+
+        self.assertEquals({'title': u'Foo'}, resource_info.metadata)
+        self.assertEquals(1, converter.extract_metadata.call_count)
+        self.assertEquals(0, converter.extract_text.call_count)
+
+    def test_converts_parts_only_once(self):
+        converter = self._create_converter()
+        resource_info = ResourceInfo(converter=converter, conversions=[])
+
+        resource_info.text
+        resource_info.text
+        self.assertEquals(1, converter.extract_text.call_count)
+
+    def test_decodes_converted_text(self):
+        resource_info = ResourceInfo(converter=self._create_converter())
+        self.assertEquals(u'foo bar', resource_info.text)
+        self.assertIsInstance(resource_info.text, unicode)
+
+    def test_extracts_all_needed_parts_at_once(self):
+        converter = self._create_converter()
+        resource_info = ResourceInfo(
+            converter=converter, conversions=frozenset([METADATA, TEXT]))
+
+        resource_info.metadata
+        resource_info.text
+        self.assertEquals(1, converter.extract.call_count)
+
+    def test_convert_extracts_needed_parts(self):
+        converter = self._create_converter()
+        resource_info = ResourceInfo(
+            converter=converter, conversions=frozenset([TEXT]))
+
+        resource_info.convert()
+        self.assertEquals(1, converter.extract_text.call_count)
+        self.assertEquals(0, converter.extract_metadata.call_count)
+
+    def test_doesnt_convert_given_parts(self):
+        converter = self._create_converter()
+        resource_info = ResourceInfo(
+            converter=converter, metadata={}, text=u'')
+
+        resource_info.convert()
+        self.assertEquals({}, resource_info.metadata)
+        self.assertEquals([], converter.method_calls)
+
+
+class TestResourceInfoMarkup(CrawlerTestCase):
+
+    def _create_resource_info(self):
+        return ResourceInfo(
+            filename=resource_filename(
+                'ftw.crawler.tests.assets', 'html5_doc.html'),
+            content_type='text/html',
+            url_info={'loc': 'http://example.org/'},
+            headers={},
+            metadata={},
+            text=u'Der B\xe4rengraben Foo')
+
+    def test_parses_tree_lazily(self):
+        resource_info = self._create_resource_info()
+        self.assertIsNone(resource_info._tree)
+        h1 = resource_info.tree.xpath("//div[@id='content']/h1")[0]
+        self.assertEquals(u'Der B\xe4rengraben', h1.text_content())
+
+    def test_parses_document_once_for_all_extractors(self):
+        resource_info = self._create_resource_info()
+
+        with patch('ftw.crawler.resource.detect_encoding',
+                   wraps=detect_encoding) as detect, \
+                patch('ftw.crawler.resource.parse_markup',
+                      wraps=parse_markup) as parse:
+            XPathExtractor("//div[@id='content']/h1").extract_value(
+                resource_info)
+            TitleExtractor().extract_value(resource_info)
+            SnippetTextExtractor().extract_value(resource_info)
+
+        self.assertEquals(1, detect.call_count)
+        self.assertEquals(1, parse.call_count)
+
+    def test_encoding_from_http_charset(self):
+        resource_info = self._create_resource_info()
+        resource_info.headers = {'content-type': 'text/html; charset=latin1'}
+        self.assertEquals('latin1', resource_info.encoding)
+
+    def test_encoding_from_meta_charset(self):
+        resource_info = self._create_resource_info()
+        with patch('ftw.crawler.xml_utils.sniff_encoding') as sniff:
+            self.assertEquals('utf-8', resource_info.encoding)
+        self.assertFalse(sniff.called)
+
+    def test_release_drops_tree(self):
+        resource_info = self._create_resource_info()
+        resource_info.tree
+        resource_info.release()
+        self.assertIsNone(resource_info._tree)
@@ -1,6 +1,7 @@
 from ftw.crawler.testing import CrawlerTestCase
 from ftw.crawler.slack import SlackLogger
 from ftw.crawler.configuration import Site
+from ftw.crawler.exceptions import SiteCrawlFailed
 import json
 
 
@@ -36,3 +37,15 @@ class TestSlack(CrawlerTestCase):
 
         self.assertEquals("error message",
                           data['fields'][2]['value'])
+
+    def test_slack_reports_original_type_of_failed_site_crawl(self):
+        ex = SiteCrawlFailed('SolrError', 'error message')
+        site = Site('http://some-url.com/')
+
+        data = json.loads(self.slacklogger.generateAttdata(ex, site))[0]
+
+        self.assertEquals("SolrError",
+                          data['fields'][1]['value'])
+
+        self.assertEquals("error message",
+                          data['fields'][2]['value'])
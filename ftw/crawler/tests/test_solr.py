@@ -1,4 +1,5 @@
 from ftw.crawler.exceptions import SolrError
+from ftw.crawler.solr import BatchIndexer
 from ftw.crawler.solr import solr_escape
 from ftw.crawler.solr import SolrConnector
 from ftw.crawler.testing import CrawlerTestCase
@@ -6,6 +7,9 @@ from ftw.crawler.testing import SolrTestCase
 from ftw.crawler.tests.helpers import MockResponse
 from mock import patch
 import json
+import requests
+import threading
+import time
 
 
 class TestSolrConnector(SolrTestCase):
@@ -22,7 +26,7 @@ class TestSolrConnector(SolrTestCase):
             content='{"responseHeader":{"status":400,"QTime":0},'
                     '"error":''{"msg":"Something went wrong","code":400}}')
 
-    @patch('requests.post')
+    @patch('requests.sessions.Session.post')
     def test_index_returns_response(self, request):
         request.return_value = self.response_ok
 
@@ -30,7 +34,7 @@ class TestSolrConnector(SolrTestCase):
         response = solr.index({'field': 'value'})
         self.assertIsInstance(response, MockResponse)
 
-    @patch('requests.post')
+    @patch('requests.sessions.Session.post')
     def test_delete_returns_response(self, request):
         request.return_value = self.response_ok
 
@@ -38,7 +42,7 @@ class TestSolrConnector(SolrTestCase):
         response = solr.delete('12345')
         self.assertIsInstance(response, MockResponse)
 
-    @patch('requests.get')
+    @patch('requests.sessions.Session.get')
     def test_search_returns_documents(self, request):
         request.return_value = self.response_search_results
         solr = SolrConnector('http://localhost:8983/solr')
@@ -46,7 +50,7 @@ class TestSolrConnector(SolrTestCase):
         docs = solr.search('Title:Foo*')
         self.assertEquals([{'Title': 'Foobar'}, {'Title': 'Foo bar'}], docs)
 
-    @patch('requests.post')
+    @patch('requests.sessions.Session.post')
     def test_index_sends_proper_request_to_solr(self, request):
         request.return_value = self.response_ok
         solr = SolrConnector('http://localhost:8983/solr')
@@ -57,9 +61,10 @@ class TestSolrConnector(SolrTestCase):
 
         solr.index(data)
         request.assert_called_with(
-            expected_url, headers=expected_headers, data=json.dumps([data]))
+            expected_url, headers=expected_headers, data=json.dumps([data]),
+            timeout=60)
 
-    @patch('requests.post')
+    @patch('requests.sessions.Session.post')
     def test_delete_sends_proper_request_to_solr(self, request):
         request.return_value = self.response_ok
         solr = SolrConnector('http://localhost:8983/solr')
@@ -71,9 +76,10 @@ class TestSolrConnector(SolrTestCase):
 
         solr.delete(uid)
         request.assert_called_with(
-            expected_url, headers=expected_headers, data=json.dumps(cmd))
+            expected_url, headers=expected_headers, data=json.dumps(cmd),
+            timeout=60)
 
-    @patch('requests.get')
+    @patch('requests.sessions.Session.get')
     def test_search_sends_proper_request_to_solr(self, request):
         request.return_value = self.response_search_results
         solr = SolrConnector('http://localhost:8983/solr')
@@ -86,10 +92,11 @@ class TestSolrConnector(SolrTestCase):
         solr.search(query)
 
         request.assert_called_with(
-            expected_url, headers=expected_headers, params=params)
+            expected_url, headers=expected_headers, params=params,
+            timeout=60)
 
     @patch('ftw.crawler.solr.log')
-    @patch('requests.post')
+    @patch('requests.sessions.Session.post')
     def test_index_logs_non_200_responses_from_solr(self, request, log):
         request.return_value = self.response_400_bad_request
 
@@ -98,7 +105,7 @@ class TestSolrConnector(SolrTestCase):
         self.assertTrue(log.error.called)
 
     @patch('ftw.crawler.solr.log')
-    @patch('requests.post')
+    @patch('requests.sessions.Session.post')
     def test_delete_logs_non_200_responses_from_solr(self, request, log):
         request.return_value = self.response_400_bad_request
 
@@ -107,7 +114,7 @@ class TestSolrConnector(SolrTestCase):
         self.assertTrue(log.error.called)
 
     @patch('ftw.crawler.solr.log')
-    @patch('requests.get')
+    @patch('requests.sessions.Session.get')
     def test_search_raises_on_non_200_responses_from_solr(self, request, log):
         request.return_value = self.response_400_bad_request
         solr = SolrConnector('http://localhost:8983/solr')
@@ -116,7 +123,7 @@ class TestSolrConnector(SolrTestCase):
             solr.search('Title:Foo')
             self.assertTrue(log.error.called)
 
-    @patch('requests.get')
+    @patch('requests.sessions.Session.get')
     def test_search_honors_fl_argument(self, request):
         request.return_value = self.response_search_results
         solr = SolrConnector('http://localhost:8983/solr')
@@ -125,6 +132,284 @@ class TestSolrConnector(SolrTestCase):
         args, kwargs = request.call_args
         self.assertIn(('fl', 'Title,UID'), kwargs['params'].items())
 
+    @patch('requests.sessions.Session.get')
+    def test_search_iter_pages_through_all_documents(self, request):
+        request.side_effect = [
+            self.create_solr_results(
+                [{'UID': '1'}, {'UID': '2'}], next_cursor_mark='AoE1'),
+            self.create_solr_results(
+                [{'UID': '3'}], next_cursor_mark='AoE2'),
+            self.create_solr_results([], next_cursor_mark='AoE2'),
+        ]
+        solr = SolrConnector('http://localhost:8983/solr')
+
+        docs = list(solr.search_iter('Title:Foo', sort='UID asc'))
+        self.assertEquals([{'UID': '1'}, {'UID': '2'}, {'UID': '3'}], docs)
+
+        cursors = [kwargs['params']['cursorMark']
+                   for args, kwargs in request.call_args_list]
+        self.assertEquals(['*', 'AoE1', 'AoE2'], cursors)
+
+    @patch('requests.sessions.Session.get')
+    def test_search_iter_sends_sort_and_page_size(self, request):
+        request.return_value = self.create_solr_results(
+            [], next_cursor_mark='*')
+        solr = SolrConnector('http://localhost:8983/solr', page_size=50)
+
+        list(solr.search_iter('Title:Foo', sort='UID asc', fl=('UID',)))
+        args, kwargs = request.call_args
+        self.assertEquals({'q': 'Title:Foo', 'wt': 'json', 'fl': 'UID',
+                           'sort': 'UID asc', 'rows': 50, 'cursorMark': '*'},
+                          kwargs['params'])
+
+    @patch('requests.sessions.Session.get')
+    def test_search_iter_is_lazy(self, request):
+        request.return_value = self.create_solr_results(
+            [{'UID': '1'}], next_cursor_mark='AoE1')
+        solr = SolrConnector('http://localhost:8983/solr')
+
+        docs = solr.search_iter('Title:Foo', sort='UID asc')
+        self.assertEquals(0, request.call_count)
+        next(docs)
+        self.assertEquals(1, request.call_count)
+
+    @patch('requests.sessions.Session.post')
+    def test_index_many_sends_documents_without_commit(self, request):
+        request.return_value = self.response_ok
+        solr = SolrConnector('http://localhost:8983/solr')
+
+        docs = [{'UID': '1'}, {'UID': '2'}]
+        solr.index_many(docs)
+        request.assert_called_with(
+            'http://localhost:8983/solr/update',
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps(docs), timeout=60)
+
+    @patch('requests.sessions.Session.post')
+    def test_index_many_honors_commit_within(self, request):
+        request.return_value = self.response_ok
+        solr = SolrConnector('http://localhost:8983/solr')
+
+        solr.index_many([{'UID': '1'}], commit_within=5000)
+        args, kwargs = request.call_args
+        self.assertEquals(
+            'http://localhost:8983/solr/update?commitWithin=5000', args[0])
+
+    @patch('requests.sessions.Session.post')
+    def test_commit_sends_commit_command(self, request):
+        request.return_value = self.response_ok
+        solr = SolrConnector('http://localhost:8983/solr')
+
+        solr.commit()
+        request.assert_called_with(
+            'http://localhost:8983/solr/update',
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps({'commit': {}}), timeout=60)
+
+
+    @patch('requests.sessions.Session.get')
+    def test_honors_timeout(self, request):
+        request.return_value = self.response_search_results
+        solr = SolrConnector('http://localhost:8983/solr', timeout=5)
+
+        solr.search('Title:Foo')
+        args, kwargs = request.call_args
+        self.assertEquals(5, kwargs['timeout'])
+
+    def test_uses_pooled_session_of_configured_size(self):
+        solr = SolrConnector('http://localhost:8983/solr', pool_size=20)
+        adapter = solr.session.get_adapter('http://localhost:8983/solr')
+        self.assertEquals(20, adapter._pool_maxsize)
+
+class TestBatchIndexer(SolrTestCase):
+
+    def setUp(self):
+        SolrTestCase.setUp(self)
+        self.solr = SolrConnector('http://localhost:8983/solr')
+        self.response_ok = self.create_solr_response()
+        self.response_400_bad_request = self.create_solr_response(status=400)
+
+    def sent_batches(self, request):
+        return [json.loads(kwargs['data'])
+                for args, kwargs in request.call_args_list
+                if kwargs['data'] != json.dumps({'commit': {}})]
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_sends_documents_in_batches(self, request, log):
+        request.return_value = self.response_ok
+        indexer = BatchIndexer(self.solr, batch_size=2)
+
+        for uid in '123':
+            indexer.add({'UID': uid})
+        self.assertEquals([[{'UID': '1'}, {'UID': '2'}]],
+                          self.sent_batches(request))
+
+        indexer.close()
+        self.assertEquals([[{'UID': '1'}, {'UID': '2'}], [{'UID': '3'}]],
+                          self.sent_batches(request))
+        self.assertEquals(3, indexer.indexed)
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_commits_once_when_closed(self, request, log):
+        request.return_value = self.response_ok
+        indexer = BatchIndexer(self.solr, batch_size=2)
+
+        for uid in '1234':
+            indexer.add({'UID': uid})
+        indexer.close()
+
+        args, kwargs = request.call_args
+        self.assertEquals(json.dumps({'commit': {}}), kwargs['data'])
+        self.assertEquals(3, request.call_count)
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_commit_only_commits_new_documents(self, request, log):
+        request.return_value = self.response_ok
+        indexer = BatchIndexer(self.solr, batch_size=2)
+
+        indexer.add({'UID': '1'})
+        self.assertTrue(indexer.commit())
+        self.assertEquals(2, request.call_count)
+        args, kwargs = request.call_args
+        self.assertEquals(json.dumps({'commit': {}}), kwargs['data'])
+
+        # Nothing has been sent since
+        self.assertTrue(indexer.commit())
+        self.assertEquals(2, request.call_count)
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_commit_reports_failure(self, request, log):
+        request.side_effect = [self.response_ok,
+                               self.create_solr_response(status=500)]
+        indexer = BatchIndexer(self.solr, batch_size=2)
+
+        indexer.add({'UID': '1'})
+        self.assertFalse(indexer.commit())
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_doesnt_commit_if_using_commit_within(self, request, log):
+        request.return_value = self.response_ok
+        indexer = BatchIndexer(self.solr, batch_size=2, commit_within=1000)
+
+        indexer.add({'UID': '1'})
+        indexer.close()
+
+        self.assertEquals(1, request.call_count)
+        args, kwargs = request.call_args
+        self.assertEquals(
+            'http://localhost:8983/solr/update?commitWithin=1000', args[0])
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_sends_batch_when_document_waited_too_long(self, request, log):
+        request.return_value = self.response_ok
+        indexer = BatchIndexer(self.solr, batch_size=10, max_wait=0)
+
+        indexer.add({'UID': '1'})
+        self.assertEquals([[{'UID': '1'}]], self.sent_batches(request))
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_sends_batch_after_max_wait_without_further_documents(
+            self, request, log):
+        request.return_value = self.response_ok
+        indexer = BatchIndexer(self.solr, batch_size=10, max_wait=0.2)
+
+        indexer.add({'UID': '1'})
+        self.assertEquals([], self.sent_batches(request))
+
+        # Wait until the document has been sent and counted
+        deadline = time.time() + 5
+        while indexer.indexed == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEquals([[{'UID': '1'}]], self.sent_batches(request))
+        self.assertEquals(1, indexer.indexed)
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_close_waits_for_batch_sent_after_max_wait(self, request, log):
+        sending = threading.Event()
+
+        def post(url, data, headers, timeout):
+            if data != json.dumps({'commit': {}}):
+                sending.set()
+                time.sleep(0.2)
+            return self.response_ok
+        request.side_effect = post
+
+        indexer = BatchIndexer(self.solr, batch_size=10, max_wait=0.05)
+        indexer.add({'UID': '1'})
+        self.assertTrue(sending.wait(5))
+        indexer.close()
+
+        # The document has been sent before committing
+        self.assertEquals(1, indexer.indexed)
+        args, kwargs = request.call_args
+        self.assertEquals(json.dumps({'commit': {}}), kwargs['data'])
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_reports_failures_per_document(self, request, log):
+        def post(url, data, headers, timeout):
+            if '"UID": "bad"' in data:
+                return self.response_400_bad_request
+            return self.response_ok
+        request.side_effect = post
+
+        results = {}
+
+        def callback(uid):
+            return lambda error: results.__setitem__(uid, error)
+
+        indexer = BatchIndexer(self.solr, batch_size=3)
+        for uid in ('1', 'bad', '2'):
+            indexer.add({'UID': uid}, callback=callback(uid))
+
+        self.assertIsNone(results['1'])
+        self.assertIsNone(results['2'])
+        self.assertIn('Got status 400', results['bad'])
+        self.assertEquals(2, indexer.indexed)
+        self.assertEquals(1, indexer.failed)
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_reports_connection_errors_per_document(self, request, log):
+        request.side_effect = requests.ConnectionError('Connection refused')
+        results = {}
+
+        def callback(uid):
+            return lambda error: results.__setitem__(uid, error)
+
+        indexer = BatchIndexer(self.solr, batch_size=2)
+        for uid in '12':
+            indexer.add({'UID': uid}, callback=callback(uid))
+
+        self.assertIn('Connection refused', results['1'])
+        self.assertIn('Connection refused', results['2'])
+        self.assertEquals(0, indexer.indexed)
+        self.assertEquals(2, indexer.failed)
+
+    @patch('ftw.crawler.solr.log')
+    @patch('requests.sessions.Session.post')
+    def test_reports_connection_errors_after_max_wait(self, request, log):
+        request.side_effect = requests.Timeout('Read timed out')
+        results = {}
+        indexer = BatchIndexer(self.solr, batch_size=10, max_wait=0.2)
+        indexer.add({'UID': '1'},
+                    callback=lambda error: results.__setitem__('1', error))
+
+        # Wait until the failure has been reported
+        deadline = time.time() + 5
+        while '1' not in results and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIn('Read timed out', results['1'])
+        self.assertEquals(1, indexer.failed)
+
 
 class TestSolrEscape(CrawlerTestCase):
 
@@ -0,0 +1,158 @@
+from argparse import Namespace
+from datetime import datetime
+from ftw.crawler.configuration import get_config
+from ftw.crawler.indexed_docs import IndexedDocs
+from ftw.crawler.state import CONTENT_HASH_KEY
+from ftw.crawler.state import CrawlState
+from ftw.crawler.state import ETAG_KEY
+from ftw.crawler.testing import CrawlerTestCase
+from ftw.crawler.utils import to_utc
+from pkg_resources import resource_filename
+import os
+import shutil
+import tempfile
+
+
+BASIC_CONFIG = resource_filename('ftw.crawler.tests.assets', 'basic_config.py')
+
+SITE = 'http://example.org/'
+
+
+class TestCrawlState(CrawlerTestCase):
+
+    def setUp(self):
+        CrawlerTestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp(prefix='ftw.crawler.tests_')
+        self.path = os.path.join(self.tempdir, 'var', 'state.db')
+
+        args = Namespace(tika=None, solr=None,
+                         slacktoken=None, slackchannel=None)
+        args.config = BASIC_CONFIG
+        self.config = get_config(args)
+
+    def tearDown(self):
+        CrawlerTestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def test_returns_none_for_unknown_url(self):
+        state = CrawlState(self.path)
+        self.assertIsNone(state.get('http://example.org/one'))
+        self.assertFalse(state.has_site(SITE))
+
+    def test_records_fetch(self):
+        state = CrawlState(self.path)
+        state.record_fetch('http://example.org/one', SITE, 200)
+
+        url_state = state.get('http://example.org/one')
+        self.assertEquals(SITE, url_state['site'])
+        self.assertEquals(200, url_state['status'])
+        self.assertIsNotNone(url_state['fetched'])
+        self.assertEquals(0, url_state['indexed'])
+        self.assertTrue(state.has_site(SITE))
+
+    def test_records_indexed(self):
+        state = CrawlState(self.path)
+        state.record_fetch('http://example.org/one', SITE, 200)
+        state.record_indexed(
+            'http://example.org/one', SITE, 'uid-1',
+            to_utc(datetime(2014, 1, 1, 15, 30)),
+            headers={'etag': '"abc"',
+                     'last-modified': 'Wed, 01 Jan 2014 15:30:00 GMT'},
+            content_hash='1234')
+
+        url_state = state.get('http://example.org/one')
+        self.assertEquals(1, url_state['indexed'])
+        self.assertEquals('uid-1', url_state['uid'])
+        self.assertEquals('2014-01-01T15:30:00.000000Z',
+                          url_state['indexing_time'])
+        self.assertEquals('"abc"', url_state['etag'])
+        self.assertEquals('Wed, 01 Jan 2014 15:30:00 GMT',
+                          url_state['last_modified'])
+        self.assertEquals('1234', url_state['content_hash'])
+
+    def test_fetch_keeps_validators_of_indexed_version(self):
+        state = CrawlState(self.path)
+        state.record_indexed('http://example.org/one', SITE, 'uid-1',
+                             headers={'etag': '"abc"'}, content_hash='1234')
+        state.record_fetch('http://example.org/one', SITE, 304)
+
+        url_state = state.get('http://example.org/one')
+        self.assertEquals(304, url_state['status'])
+        self.assertEquals('"abc"', url_state['etag'])
+        self.assertEquals('1234', url_state['content_hash'])
+
+    def test_removes_url(self):
+        state = CrawlState(self.path)
+        state.record_fetch('http://example.org/one', SITE, 200)
+        state.remove('http://example.org/one')
+        self.assertIsNone(state.get('http://example.org/one'))
+
+    def test_persists_changes(self):
+        state = CrawlState(self.path)
+        state.record_fetch('http://example.org/one', SITE, 200)
+        state.close()
+
+        state = CrawlState(self.path)
+        self.assertEquals(200, state.get('http://example.org/one')['status'])
+
+    def test_doesnt_block_other_connections(self):
+        state = CrawlState(self.path)
+        other_state = CrawlState(self.path)
+        other_state._connection.execute('PRAGMA busy_timeout = 0')
+
+        state.record_fetch('http://example.org/one', SITE, 200)
+        other_state.record_fetch('http://example.org/two', SITE, 200)
+        state.record_indexed('http://example.org/one', SITE, 'uid-1')
+
+        self.assertEquals(200, other_state.get('http://example.org/one')[
+            'status'])
+        self.assertEquals(200, state.get('http://example.org/two')['status'])
+
+    def test_returns_indexed_docs(self):
+        state = CrawlState(self.path)
+        state.record_indexed('http://example.org/one', SITE, '1',
+                             to_utc(datetime(2015, 1, 2, 10, 0)),
+                             headers={'etag': '"abc"'}, content_hash='1234')
+        # Fetched, but not indexed
+        state.record_fetch('http://example.org/two', SITE, 404)
+        # Other site
+        state.record_indexed('http://other.org/', 'http://other.org/', '3')
+
+        docs = state.get_indexed_docs(self.config, SITE)
+        self.assertEquals(
+            [{'UID': '1', 'path_string': 'http://example.org/one',
+              'modified': '2015-01-02T10:00:00.000000Z',
+              ETAG_KEY: '"abc"', CONTENT_HASH_KEY: '1234'}],
+            docs)
+
+        indexed_docs = IndexedDocs(self.config, docs, etag_field=ETAG_KEY,
+                                   content_hash_field=CONTENT_HASH_KEY)
+        self.assertEquals(
+            to_utc(datetime(2015, 1, 2, 10, 0)),
+            indexed_docs.get_indexing_time('http://example.org/one'))
+        self.assertEquals(
+            '"abc"', indexed_docs.get_etag('http://example.org/one'))
+        self.assertEquals(
+            '1234', indexed_docs.get_content_hash('http://example.org/one'))
+
+    def test_imports_indexed_docs(self):
+        state = CrawlState(self.path)
+        state.record_indexed('http://example.org/one', SITE, '1',
+                             to_utc(datetime(2015, 3, 4, 12, 30)))
+
+        indexed_docs = IndexedDocs(self.config, [
+            {'UID': '1', 'path_string': 'http://example.org/one',
+             'modified': '2015-01-02T10:00:00Z'},
+            {'UID': '2', 'path_string': 'http://example.org/two',
+             'modified': '2015-01-02T10:00:00Z'},
+        ])
+        state.import_indexed_docs(SITE, indexed_docs)
+
+        # Already recorded URLs are left alone
+        self.assertEquals('2015-03-04T12:30:00.000000Z',
+                          state.get('http://example.org/one')['indexing_time'])
+
+        url_state = state.get('http://example.org/two')
+        self.assertEquals(1, url_state['indexed'])
+        self.assertEquals('2', url_state['uid'])
+        self.assertEquals('2015-01-02T10:00:00Z', url_state['indexing_time'])
@@ -1,11 +1,22 @@
+from ftw.crawler.cache import ConversionCache
+from ftw.crawler.exceptions import ConversionError
 from ftw.crawler.resource import ResourceInfo
 from ftw.crawler.testing import CrawlerTestCase
 from ftw.crawler.tests.helpers import MockResponse
+from ftw.crawler.tika import get_tika_urls
 from ftw.crawler.tika import TikaConverter
+from ftw.crawler.tika import TikaServerPool
 from mock import mock_open
 from mock import patch
 import csv
 import io
+import json
+import os
+import requests
+import shutil
+import tempfile
+import threading
+import time
 
 
 # TODO: Figure out how to mock open() without using module globals
@@ -21,7 +32,7 @@ class TestTikaConverter(CrawlerTestCase):
             csv_writer.writerow((key, value))
         return csv_buffer.getvalue()
 
-    @patch('requests.put')
+    @patch('requests.sessions.Session.put')
     @patch('ftw.crawler.tika.open', open_mock, create=True)
     def test_extracts_metadata(self, request):
         resource_info = ResourceInfo(content_type='application/pdf')
@@ -41,9 +52,9 @@ class TestTikaConverter(CrawlerTestCase):
         request.assert_called_with(
             'http://localhost:9998/meta',
             headers={'Content-type': 'application/pdf'},
-            data=open_mock.return_value)
+            data=open_mock.return_value, timeout=300)
 
-    @patch('requests.put')
+    @patch('requests.sessions.Session.put')
     @patch('ftw.crawler.tika.open', open_mock, create=True)
     def test_extracts_text(self, request):
         resource_info = ResourceInfo(content_type='application/pdf')
@@ -58,4 +69,303 @@ class TestTikaConverter(CrawlerTestCase):
             'http://localhost:9998/tika',
             headers={'Content-type': 'application/pdf',
                      'Accept': 'text/plain'},
-            data=open_mock.return_value)
+            data=open_mock.return_value, timeout=300)
+
+    @patch('requests.sessions.Session.put')
+    @patch('ftw.crawler.tika.open', open_mock, create=True)
+    def test_extracts_metadata_and_text_in_a_single_pass(self, request):
+        resource_info = ResourceInfo(content_type='application/pdf')
+        request.return_value = MockResponse(content=json.dumps([
+            {'title': 'Some title',
+             'creator': ['John Doe', 'Jane Doe'],
+             'X-TIKA:parse_time_millis': '12',
+             'X-TIKA:content': 'foo bar'},
+            {'title': 'Attachment',
+             'X-TIKA:content': 'baz'},
+        ]))
+
+        tika = TikaConverter('http://localhost:9998', single_pass=True)
+        metadata, text = tika.extract(resource_info)
+
+        self.assertEquals({'title': u'Some title',
+                           'creator': u'John Doe Jane Doe'}, metadata)
+        self.assertEquals(u'foo bar\nbaz', text)
+        self.assertIsInstance(text, unicode)
+        self.assertEquals(1, request.call_count)
+        request.assert_called_with(
+            'http://localhost:9998/rmeta/text',
+            headers={'Content-type': 'application/pdf',
+                     'Accept': 'application/json'},
+            data=open_mock.return_value, timeout=300)
+
+    @patch('requests.sessions.Session.put')
+    @patch('ftw.crawler.tika.open', open_mock, create=True)
+    def test_extracts_with_separate_requests_by_default(self, request):
+        resource_info = ResourceInfo(content_type='application/pdf')
+        request.side_effect = [
+            MockResponse(content=self._to_csv({'title': 'Some title'})),
+            MockResponse(content='foo bar'),
+        ]
+
+        tika = TikaConverter('http://localhost:9998')
+        metadata, text = tika.extract(resource_info)
+
+        self.assertEquals({'title': u'Some title'}, metadata)
+        self.assertEquals(u'foo bar', text)
+        self.assertEquals(2, request.call_count)
+
+    @patch('requests.sessions.Session.put')
+    @patch('ftw.crawler.tika.open', open_mock, create=True)
+    def test_single_pass_raises_conversion_error_for_error_responses(
+            self, request):
+        resource_info = ResourceInfo(content_type='application/pdf',
+                                     url_info={'loc': 'http://example.org/'})
+        request.return_value = MockResponse(
+            content='<html>Unprocessable Entity</html>', status_code=422)
+
+        tika = TikaConverter('http://localhost:9998', single_pass=True)
+        with self.assertRaises(ConversionError):
+            tika.extract(resource_info)
+
+    @patch('requests.sessions.Session.put')
+    @patch('ftw.crawler.tika.open', open_mock, create=True)
+    def test_single_pass_raises_conversion_error_for_invalid_json(
+            self, request):
+        resource_info = ResourceInfo(content_type='application/pdf',
+                                     url_info={'loc': 'http://example.org/'})
+        request.return_value = MockResponse(content='<html></html>')
+
+        tika = TikaConverter('http://localhost:9998', single_pass=True)
+        with self.assertRaises(ConversionError):
+            tika.extract(resource_info)
+
+    @patch('requests.sessions.Session.put')
+    @patch('ftw.crawler.tika.open', open_mock, create=True)
+    def test_raises_conversion_error_for_error_responses(self, request):
+        resource_info = ResourceInfo(content_type='application/pdf',
+                                     url_info={'loc': 'http://example.org/'})
+        request.return_value = MockResponse(
+            content='<html>Unprocessable Entity</html>', status_code=422)
+
+        tika = TikaConverter('http://localhost:9998')
+        with self.assertRaises(ConversionError):
+            tika.extract_text(resource_info)
+        with self.assertRaises(ConversionError):
+            tika.extract_metadata(resource_info)
+
+
+class TestCachingTikaConverter(CrawlerTestCase):
+
+    def setUp(self):
+        CrawlerTestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp(prefix='ftw.crawler.tests_')
+        self.cache = ConversionCache(os.path.join(self.tempdir, 'cache'))
+
+        filename = os.path.join(self.tempdir, 'doc.pdf')
+        with open(filename, 'w') as f:
+            f.write('%PDF')
+        self.resource_info = ResourceInfo(
+            filename=filename, content_type='application/pdf')
+
+    def tearDown(self):
+        CrawlerTestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    @patch('requests.sessions.Session.put')
+    def test_converts_documents_with_same_content_only_once(self, request):
+        request.return_value = MockResponse(content='foo bar')
+        tika = TikaConverter('http://localhost:9998', cache=self.cache)
+
+        self.assertEquals(u'foo bar', tika.extract_text(self.resource_info))
+        same_content = ResourceInfo(filename=self.resource_info.filename,
+                                    content_type='application/pdf')
+        self.assertEquals(u'foo bar', tika.extract_text(same_content))
+        self.assertEquals(1, request.call_count)
+
+    @patch('requests.sessions.Session.put')
+    def test_caches_metadata_as_simple_metadata(self, request):
+        request.return_value = MockResponse(content='"dc:title","Foo"')
+        tika = TikaConverter('http://localhost:9998', cache=self.cache)
+
+        tika.extract_metadata(self.resource_info)
+        metadata = tika.extract_metadata(self.resource_info)
+        self.assertEquals(u'Foo', metadata['title'])
+        self.assertEquals(1, request.call_count)
+
+    @patch('requests.sessions.Session.put')
+    def test_caches_single_pass_results(self, request):
+        request.return_value = MockResponse(content=json.dumps(
+            [{'title': 'Foo', 'X-TIKA:content': 'foo bar'}]))
+        tika = TikaConverter('http://localhost:9998', single_pass=True,
+                             cache=self.cache)
+
+        tika.extract(self.resource_info)
+        metadata, text = tika.extract(self.resource_info)
+        self.assertEquals(u'Foo', metadata['title'])
+        self.assertEquals(u'foo bar', text)
+        self.assertEquals(1, request.call_count)
+
+
+    @patch('requests.sessions.Session.put')
+    def test_doesnt_cache_error_responses(self, request):
+        request.return_value = MockResponse(
+            content='<html>Internal Server Error</html>', status_code=500)
+        tika = TikaConverter('http://localhost:9998', cache=self.cache)
+
+        with self.assertRaises(ConversionError):
+            tika.extract_text(self.resource_info)
+
+        request.return_value = MockResponse(content='foo bar')
+        self.assertEquals(u'foo bar', tika.extract_text(self.resource_info))
+        self.assertEquals(2, request.call_count)
+
+
+class TestGetTikaURLs(CrawlerTestCase):
+
+    def test_accepts_single_url(self):
+        self.assertEquals(['http://tika:9998'],
+                          get_tika_urls('http://tika:9998/'))
+
+    def test_accepts_comma_separated_urls(self):
+        self.assertEquals(
+            ['http://tika1:9998', 'http://tika2:9998'],
+            get_tika_urls('http://tika1:9998, http://tika2:9998'))
+
+    def test_accepts_list_of_urls(self):
+        self.assertEquals(['http://tika1:9998', 'http://tika2:9998'],
+                          get_tika_urls(['http://tika1:9998/',
+                                         'http://tika2:9998']))
+
+
+class TestTikaServerPool(CrawlerTestCase):
+
+    def test_chooses_server_with_fewest_outstanding_requests(self):
+        pool = TikaServerPool(['http://a', 'http://b'])
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertNotEqual(first, second)
+
+        pool.release(first)
+        self.assertEquals(first, pool.acquire())
+
+    def test_spreads_sequential_requests_across_servers(self):
+        pool = TikaServerPool(['http://a', 'http://b'])
+        used = []
+        for n in range(4):
+            server = pool.acquire()
+            used.append(server.url)
+            pool.release(server)
+        self.assertEquals(['http://a', 'http://b', 'http://a', 'http://b'],
+                          used)
+
+    def test_limits_concurrent_requests_per_server(self):
+        pool = TikaServerPool(['http://a'], max_concurrency=1)
+        server = pool.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            pool.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+
+        pool.release(server)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+    @patch('ftw.crawler.tika.log')
+    def test_takes_failed_server_out_of_rotation(self, log):
+        pool = TikaServerPool(['http://a', 'http://b'], cooldown=60)
+        a = pool.servers[0]
+        pool.release(pool.acquire(), failed=True)
+
+        for n in range(3):
+            server = pool.acquire()
+            self.assertNotEqual(a, server)
+            pool.release(server)
+
+    @patch('ftw.crawler.tika.log')
+    def test_returns_failed_server_after_cooldown(self, log):
+        pool = TikaServerPool(['http://a', 'http://b'], cooldown=0.01)
+        pool.release(pool.acquire(), failed=True)
+        time.sleep(0.02)
+
+        self.assertEquals(set(pool.servers),
+                          set([pool.acquire(), pool.acquire()]))
+
+    @patch('ftw.crawler.tika.log')
+    def test_uses_failed_servers_if_all_failed(self, log):
+        pool = TikaServerPool(['http://a'], cooldown=60)
+        a = pool.servers[0]
+        pool.release(pool.acquire(), failed=True)
+
+        self.assertEquals(a, pool.acquire())
+
+
+class TestTikaConverterWithSeveralServers(CrawlerTestCase):
+
+    @patch('ftw.crawler.tika.log')
+    @patch('requests.sessions.Session.put')
+    @patch('ftw.crawler.tika.open', open_mock, create=True)
+    def test_retries_request_with_next_server(self, request, log):
+        def put(url, **kwargs):
+            if url.startswith('http://tika1'):
+                raise requests.ConnectionError('Boom')
+            return MockResponse(content='foo bar')
+        request.side_effect = put
+
+        tika = TikaConverter('http://tika1:9998,http://tika2:9998')
+        resource_info = ResourceInfo(content_type='application/pdf')
+
+        self.assertEquals(u'foo bar', tika.extract_text(resource_info))
+        self.assertEquals(u'foo bar', tika.extract_text(resource_info))
+        urls = [args[0] for args, kwargs in request.call_args_list]
+        self.assertEquals(['http://tika1:9998/tika',
+                           'http://tika2:9998/tika',
+                           'http://tika2:9998/tika'], urls)
+
+    @patch('ftw.crawler.tika.log')
+    @patch('requests.sessions.Session.put')
+    @patch('ftw.crawler.tika.open', open_mock, create=True)
+    def test_raises_if_all_servers_fail(self, request, log):
+        request.side_effect = requests.ConnectionError('Boom')
+
+        tika = TikaConverter('http://tika1:9998,http://tika2:9998')
+        resource_info = ResourceInfo(content_type='application/pdf')
+
+        with self.assertRaises(requests.ConnectionError):
+            tika.extract_text(resource_info)
+        self.assertEquals(2, request.call_count)
+
+    @patch('ftw.crawler.tika.log')
+    @patch('requests.sessions.Session.put')
+    @patch('ftw.crawler.tika.open', open_mock, create=True)
+    def test_retries_connect_timeout_with_next_server(self, request, log):
+        def put(url, **kwargs):
+            if url.startswith('http://tika1'):
+                raise requests.ConnectTimeout('Boom')
+            return MockResponse(content='foo bar')
+        request.side_effect = put
+
+        tika = TikaConverter('http://tika1:9998,http://tika2:9998')
+        resource_info = ResourceInfo(content_type='application/pdf')
+
+        self.assertEquals(u'foo bar', tika.extract_text(resource_info))
+        self.assertEquals(2, request.call_count)
+
+    @patch('ftw.crawler.tika.log')
+    @patch('requests.sessions.Session.put')
+    @patch('ftw.crawler.tika.open', open_mock, create=True)
+    def test_read_timeout_fails_document_not_server(self, request, log):
+        request.side_effect = requests.ReadTimeout('Boom')
+
+        tika = TikaConverter('http://tika1:9998,http://tika2:9998')
+        resource_info = ResourceInfo(content_type='application/pdf')
+
+        with self.assertRaises(ConversionError):
+            tika.extract_text(resource_info)
+        self.assertEquals(1, request.call_count)
+        self.assertEquals(
+            [0, 0], [server.failed_until for server in tika.servers.servers])
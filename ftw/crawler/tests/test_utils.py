@@ -3,8 +3,10 @@ from ftw.crawler.testing import CrawlerTestCase
 from ftw.crawler.utils import ExtendedJSONEncoder
 from ftw.crawler.utils import from_http_datetime
 from ftw.crawler.utils import from_iso_datetime
+from ftw.crawler.utils import get_charset
 from ftw.crawler.utils import get_content_type
 from ftw.crawler.utils import normalize_whitespace
+from ftw.crawler.utils import parse_retry_after
 from ftw.crawler.utils import to_http_datetime
 from ftw.crawler.utils import to_iso_datetime
 from ftw.crawler.utils import to_utc
@@ -23,6 +25,21 @@ class TestGetContentType(CrawlerTestCase):
         self.assertEquals('text/html', get_content_type(header_value))
 
 
+class TestGetCharset(CrawlerTestCase):
+
+    def test_returns_charset(self):
+        self.assertEquals('utf-8', get_charset('text/html; charset=UTF-8'))
+
+    def test_handles_quotes_and_other_params(self):
+        self.assertEquals('iso-8859-1', get_charset(
+            'text/html; foo=bar; Charset="ISO-8859-1"'))
+
+    def test_returns_none_without_charset(self):
+        self.assertIsNone(get_charset('text/html'))
+        self.assertIsNone(get_charset('text/html; charset='))
+        self.assertIsNone(get_charset(None))
+
+
 class TestToUTC(CrawlerTestCase):
 
     def test_doesnt_change_dt_already_in_utc(self):
@@ -98,6 +115,28 @@ class TestFromHTTPDateTime(CrawlerTestCase):
         self.assertEquals(dt_s, from_http('Wed, 31 Dec 2014 15:45:30 GMT'))
 
 
+class TestParseRetryAfter(CrawlerTestCase):
+
+    def test_parses_seconds(self):
+        self.assertEquals(120, parse_retry_after('120'))
+        self.assertEquals(0, parse_retry_after(' 0 '))
+
+    def test_parses_http_date(self):
+        now = datetime(2015, 10, 21, 7, 28, 0)
+        self.assertEquals(
+            90, parse_retry_after('Wed, 21 Oct 2015 07:29:30 GMT', now=now))
+
+    def test_date_in_the_past_means_no_wait(self):
+        now = datetime(2015, 10, 21, 7, 28, 0)
+        self.assertEquals(
+            0, parse_retry_after('Wed, 21 Oct 2015 07:00:00 GMT', now=now))
+
+    def test_returns_none_for_missing_or_invalid_value(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('-5'))
+        self.assertIsNone(parse_retry_after('soon'))
+
+
 class TestNormalizeWhitespace(CrawlerTestCase):
 
     def test_replaces_tabs_with_space(self):
@@ -0,0 +1,71 @@
+from ftw.crawler.testing import CrawlerTestCase
+from ftw.crawler.workers import WorkerPool
+import threading
+
+
+def process(pool, items):
+    pool.start()
+    try:
+        for item in items:
+            pool.put(item)
+    finally:
+        pool.join()
+
+
+class TestWorkerPool(CrawlerTestCase):
+
+    def test_processes_all_items_synchronously_with_single_worker(self):
+        processed = []
+        pool = WorkerPool(processed.append, size=1)
+        process(pool, range(5))
+        self.assertEquals([0, 1, 2, 3, 4], processed)
+
+    def test_processes_all_items_with_multiple_workers(self):
+        processed = []
+        pool = WorkerPool(processed.append, size=4)
+        process(pool, range(100))
+        self.assertEquals(range(100), sorted(processed))
+
+    def test_uses_multiple_threads(self):
+        thread_names = set()
+        barrier = threading.Event()
+
+        def work(item):
+            thread_names.add(threading.current_thread().name)
+            if len(thread_names) == 3:
+                barrier.set()
+            barrier.wait(5)
+
+        pool = WorkerPool(work, size=3, name='test')
+        process(pool, range(3))
+        self.assertEquals(set(['test-0', 'test-1', 'test-2']), thread_names)
+
+    def test_reraises_first_exception_in_calling_thread(self):
+        def work(item):
+            if item == 3:
+                raise ValueError('Boom')
+
+        pool = WorkerPool(work, size=2)
+        with self.assertRaises(ValueError):
+            process(pool, range(10))
+
+    def test_stops_processing_after_exception(self):
+        processed = []
+
+        def work(item):
+            if item == 1:
+                raise ValueError('Boom')
+            processed.append(item)
+
+        pool = WorkerPool(work, size=1, threaded=True)
+        with self.assertRaises(ValueError):
+            process(pool, range(10))
+        self.assertEquals([0], processed)
+
+    def test_single_worker_can_be_threaded(self):
+        thread_names = set()
+        pool = WorkerPool(
+            lambda item: thread_names.add(threading.current_thread().name),
+            size=1, name='test', threaded=True)
+        process(pool, range(3))
+        self.assertEquals(set(['test-0']), thread_names)
@@ -1,12 +1,30 @@
 from ftw.crawler.testing import XMLTestCase
 from ftw.crawler.tests.helpers import get_asset
+from ftw.crawler.xml_utils import detect_encoding
+from ftw.crawler.xml_utils import ENCODING_PREFIX_SIZE
+from ftw.crawler.xml_utils import get_remove_namespaces_transform
 from ftw.crawler.xml_utils import remove_namespaces
+from ftw.crawler.xml_utils import strip_namespaces
 from lxml import etree
+from mock import patch
+import codecs
 import io
+import os
+import shutil
+import tempfile
+import threading
 
 
 NAMESPACED_XML = get_asset('namespaced.xml')
 
+NAMESPACED_ATTRIBUTES_XML = """\
+<?xml version='1.0' encoding='utf-8'?>
+<root xmlns="http://www.example.org/" xmlns:foo="http://www.example.org/foo">
+    <!-- A comment -->
+    <foo:node foo:id="1" name="first">Text</foo:node>
+</root>
+"""
+
 
 class TestRemoveNamespaces(XMLTestCase):
 
@@ -24,3 +42,123 @@ class TestRemoveNamespaces(XMLTestCase):
         </root>
         """
         self.assertXMLEquals(output_xml, expected)
+
+    def test_compiles_transform_once_per_thread(self):
+        transform = get_remove_namespaces_transform()
+        self.assertIs(transform, get_remove_namespaces_transform())
+
+        transforms = []
+        thread = threading.Thread(target=lambda: transforms.append(
+            get_remove_namespaces_transform()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(transform, transforms[0])
+
+
+class TestStripNamespaces(XMLTestCase):
+
+    def test_strips_namespaces(self):
+        namespaced_tree = etree.parse(io.BytesIO(NAMESPACED_XML))
+        tree = strip_namespaces(namespaced_tree)
+        output_xml = etree.tostring(
+            tree, xml_declaration=True, encoding='utf-8')
+        expected = """\
+        <?xml version='1.0' encoding='utf-8'?>
+        <root>
+            <node>
+                <node>Text</node>
+            </node>
+        </root>
+        """
+        self.assertXMLEquals(output_xml, expected)
+
+    def test_strips_namespaces_in_place(self):
+        namespaced_tree = etree.parse(io.BytesIO(NAMESPACED_XML))
+        self.assertIs(namespaced_tree, strip_namespaces(namespaced_tree))
+
+    def test_gives_same_result_as_remove_namespaces(self):
+        for xml in (NAMESPACED_XML, NAMESPACED_ATTRIBUTES_XML,
+                    get_asset('sitemap.xml'), get_asset('sitemap_index.xml')):
+            # Canonical XML, since the order of attributes may differ
+            expected = etree.tostring(
+                remove_namespaces(etree.parse(io.BytesIO(xml))),
+                method='c14n')
+            actual = etree.tostring(
+                strip_namespaces(etree.parse(io.BytesIO(xml))),
+                method='c14n')
+            self.assertEquals(expected, actual)
+
+    def test_strips_namespaces_from_attributes(self):
+        tree = strip_namespaces(
+            etree.parse(io.BytesIO(NAMESPACED_ATTRIBUTES_XML)))
+        node = tree.xpath('/root/node')[0]
+        self.assertEquals({'id': '1', 'name': 'first'}, dict(node.attrib))
+
+
+class TestDetectEncoding(XMLTestCase):
+
+    def setUp(self):
+        XMLTestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp(prefix='ftw.crawler.tests_')
+
+    def tearDown(self):
+        XMLTestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def _create_file(self, data):
+        filename = os.path.join(self.tempdir, 'document.html')
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
+    def test_uses_http_charset(self):
+        filename = self._create_file('<html><p>B\xe4ren</p></html>')
+        self.assertEquals('iso-8859-1',
+                          detect_encoding(filename, 'ISO-8859-1'))
+
+    def test_bom_takes_precedence(self):
+        filename = self._create_file(codecs.BOM_UTF8 + '<html></html>')
+        self.assertEquals('utf-8', detect_encoding(filename, 'iso-8859-1'))
+
+        filename = self._create_file(u'<html></html>'.encode('utf-16'))
+        self.assertEquals('utf-16', detect_encoding(filename))
+
+    def test_uses_meta_charset(self):
+        filename = self._create_file(
+            '<html><head><meta charset="windows-1252"></head></html>')
+        self.assertEquals('windows-1252', detect_encoding(filename))
+
+    def test_uses_meta_http_equiv(self):
+        filename = self._create_file(
+            '<html><head><meta http-equiv="Content-Type" '
+            'content="text/html; charset=ISO-8859-15"></head></html>')
+        self.assertEquals('iso-8859-15', detect_encoding(filename))
+
+    def test_uses_xml_declaration(self):
+        filename = self._create_file(
+            "<?xml version='1.0' encoding='latin1'?><html></html>")
+        self.assertEquals('latin1', detect_encoding(filename))
+
+    def test_ignores_unknown_encodings(self):
+        filename = self._create_file(
+            '<html><head><meta charset="utf-8"></head></html>')
+        self.assertEquals('utf-8', detect_encoding(filename, 'bogus'))
+
+    def test_treats_declared_utf16_as_utf8(self):
+        filename = self._create_file(
+            '<html><head><meta charset="utf-16"></head></html>')
+        self.assertEquals('utf-8', detect_encoding(filename))
+
+    @patch('ftw.crawler.xml_utils.sniff_encoding', return_value='utf-8')
+    def test_sniffs_whole_document_only_as_last_resort(self, sniff):
+        filename = self._create_file(
+            '<html><head><meta charset="utf-8"></head></html>')
+        detect_encoding(filename)
+        self.assertFalse(sniff.called)
+
+        # A declaration after the prefix isn't found
+        filename = self._create_file(
+            '<html>' + ' ' * ENCODING_PREFIX_SIZE +
+            '<meta charset="utf-8"></html>')
+        self.assertEquals('utf-8', detect_encoding(filename))
+        sniff.assert_called_once_with(filename)
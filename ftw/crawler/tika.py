@@ -1,26 +1,250 @@
+from ftw.crawler.exceptions import ConversionError
 from ftw.crawler.metadata import SimpleMetadata
+from ftw.crawler.resource import METADATA
+from ftw.crawler.resource import TEXT
+from ftw.crawler.utils import create_session
 import csv
 import io
+import itertools
+import json
 import logging
 import requests
+import threading
+import time
 
 
 log = logging.getLogger(__name__)
 
 
+# Number of connections to Tika kept open for reuse, and the number of
+# seconds to wait for Tika to respond (converting large documents can take
+# a while)
+TIKA_POOL_SIZE = 10
+TIKA_TIMEOUT = 300
+
+# Number of seconds a Tika server that failed is taken out of rotation
+TIKA_COOLDOWN = 30
+
+# Prefix of the keys Tika adds to the recursive metadata about the parsing
+# itself (e.g. the extracted content), which aren't document metadata
+TIKA_KEY_PREFIX = 'X-TIKA:'
+TIKA_CONTENT_KEY = 'X-TIKA:content'
+
+
+def get_tika_urls(tika):
+    """Return the list of Tika URLs from a single URL, a comma separated
+    list of URLs or a list of URLs.
+    """
+    if isinstance(tika, basestring):
+        tika = tika.split(',')
+    return [url.strip().rstrip('/') for url in tika if url.strip()]
+
+
+def get_resource_name(resource_info):
+    """Return the URL of a resource (or its filename) for error messages.
+    """
+    if resource_info.url_info is not None:
+        return resource_info.url_info.get('loc')
+    return resource_info.filename
+
+
+class TikaServer(object):
+
+    def __init__(self, url, max_concurrency=None):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.failed_until = 0
+        self.last_used = 0
+
+    @property
+    def full(self):
+        return (self.max_concurrency is not None and
+                self.outstanding >= self.max_concurrency)
+
+    def __repr__(self):
+        return '<TikaServer {} outstanding={}>'.format(
+            self.url, self.outstanding)
+
+
+class TikaServerPool(object):
+    """Spreads requests across several Tika servers.
+
+    Every request goes to the server with the fewest outstanding requests
+    (the least recently used one if there's a tie), but at most
+    `max_concurrency` requests (unlimited if ``None``) are sent to a server
+    at the same time; further requests wait until a server becomes
+    available. A server that failed is taken out of rotation for
+    `cooldown` seconds, unless all servers failed.
+    """
+
+    def __init__(self, urls, max_concurrency=None, cooldown=TIKA_COOLDOWN):
+        self.servers = [TikaServer(url, max_concurrency) for url in urls]
+        self.cooldown = cooldown
+        self._counter = itertools.count(1)
+        self._condition = threading.Condition()
+
+    def acquire(self, exclude=()):
+        """Wait for a server to become available, count the request against
+        it and return it. Servers in `exclude` aren't considered, unless
+        there's no other server left.
+        """
+        with self._condition:
+            while True:
+                server = self._choose(exclude)
+                if server is not None:
+                    server.outstanding += 1
+                    server.last_used = next(self._counter)
+                    return server
+                self._condition.wait()
+
+    def release(self, server, failed=False):
+        with self._condition:
+            server.outstanding -= 1
+            if failed:
+                server.failed_until = time.time() + self.cooldown
+            self._condition.notify_all()
+
+        if failed:
+            log.warn(u"Tika server {} failed, taking it out of rotation for "
+                     u"{}s.".format(server.url, self.cooldown))
+
+    def _choose(self, exclude):
+        candidates = [server for server in self.servers
+                      if server not in exclude]
+        if not candidates:
+            candidates = self.servers
+
+        now = time.time()
+        healthy = [server for server in candidates
+                   if server.failed_until <= now]
+        if not healthy:
+            # All servers failed recently, try the one that failed first
+            healthy = [min(candidates, key=lambda s: s.failed_until)]
+
+        available = [server for server in healthy if not server.full]
+        if not available:
+            return None
+        return min(available,
+                   key=lambda server: (server.outstanding, server.last_used))
+
+
 class TikaConverter(object):
+    """Talks to the Tika JAXRS server through a pooled session that keeps
+    connections alive and can be shared by concurrent workers.
 
-    def __init__(self, tika_url):
-        self.tika_url = tika_url.rstrip('/')
+    By default, metadata and text are extracted with two separate requests
+    to the ``meta`` and ``tika`` endpoints. With `single_pass`, both are
+    extracted from a single upload to the recursive metadata endpoint
+    (``rmeta/text``, Tika 1.15 or later) instead.
+
+    If a `ConversionCache` is given, results are looked up there first, so
+    documents with the same content are only uploaded to Tika once.
+
+    `tika_url` may also be a list (or a comma separated string) of several
+    Tika servers, which are then used as a `TikaServerPool`. A request to a
+    server that can't be reached or is unavailable (503) is repeated with
+    the next server. A request that times out while Tika converts the
+    document fails for that document only.
+
+    If Tika doesn't respond with 200 OK, a `ConversionError` is raised and
+    nothing is cached.
+    """
+
+    def __init__(self, tika_url, pool_size=TIKA_POOL_SIZE,
+                 timeout=TIKA_TIMEOUT, single_pass=False, cache=None,
+                 max_concurrency=None, cooldown=TIKA_COOLDOWN):
+        self.tika_urls = get_tika_urls(tika_url)
+        self.tika_url = self.tika_urls[0]
+        self.timeout = timeout
+        self.single_pass = single_pass
+        self.cache = cache
+        self.servers = TikaServerPool(
+            self.tika_urls, max_concurrency=max_concurrency,
+            cooldown=cooldown)
+        self.session = create_session(pool_size=pool_size)
 
     def _tika_request(self, endpoint, resource_info, headers):
-        tika_endpoint = '/'.join((self.tika_url, endpoint))
-        with open(resource_info.filename) as fileobj:
-            response = requests.put(
-                tika_endpoint, data=fileobj, headers=headers)
-        return response
+        tried = []
+        while True:
+            server = self.servers.acquire(exclude=tried)
+            tried.append(server)
+            tika_endpoint = '/'.join((server.url, endpoint))
+            try:
+                with open(resource_info.filename) as fileobj:
+                    response = self.session.put(
+                        tika_endpoint, data=fileobj, headers=headers,
+                        timeout=self.timeout)
+            except requests.ConnectionError:
+                # Includes connect timeouts: the server is unreachable
+                self.servers.release(server, failed=True)
+                if len(tried) >= len(self.servers.servers):
+                    raise
+                continue
+            except requests.RequestException, e:
+                # E.g. a read timeout, caused by the document rather than
+                # the server, so it's not uploaded to the next server again
+                self.servers.release(server)
+                raise ConversionError(
+                    u"Tika failed to convert {}: {}".format(
+                        get_resource_name(resource_info), e))
+
+            if (response.status_code == 503 and
+                    len(tried) < len(self.servers.servers)):
+                self.servers.release(server, failed=True)
+                continue
+
+            self.servers.release(server)
+            if response.status_code != 200:
+                raise ConversionError(
+                    u"Tika responded with {} to {} for {}".format(
+                        response.status_code, endpoint,
+                        get_resource_name(resource_info)))
+            return response
+
+    def extract(self, resource_info):
+        """Extract metadata and plain text from a resource and return them
+        as a ``(metadata, text)`` tuple.
+        """
+        if not self.single_pass:
+            return (self.extract_metadata(resource_info),
+                    self.extract_text(resource_info))
+
+        metadata = self._get_cached(resource_info, METADATA)
+        text = self._get_cached(resource_info, TEXT)
+        if metadata is None or text is None:
+            metadata, text = self.extract_recursive(resource_info)
+            self._set_cached(resource_info, METADATA, metadata)
+            self._set_cached(resource_info, TEXT, text)
+        return metadata, text
 
     def extract_metadata(self, resource_info):
+        metadata = self._get_cached(resource_info, METADATA)
+        if metadata is None:
+            metadata = self._extract_metadata(resource_info)
+            self._set_cached(resource_info, METADATA, metadata)
+        return metadata
+
+    def extract_text(self, resource_info):
+        text = self._get_cached(resource_info, TEXT)
+        if text is None:
+            text = self._extract_text(resource_info)
+            self._set_cached(resource_info, TEXT, text)
+        return text
+
+    def _get_cached(self, resource_info, part):
+        if self.cache is None:
+            return None
+        value = self.cache.get(resource_info, part)
+        if value is not None and part == METADATA:
+            value = SimpleMetadata(value)
+        return value
+
+    def _set_cached(self, resource_info, part, value):
+        if self.cache is not None:
+            self.cache.set(resource_info, part, value)
+
+    def _extract_metadata(self, resource_info):
         log.debug(u"Extracting metadata from '{}' with "
                   "tika JAXRS server.".format(resource_info.filename))
 
@@ -45,7 +269,7 @@ class TikaConverter(object):
 
         return SimpleMetadata(metadata)
 
-    def extract_text(self, resource_info):
+    def _extract_text(self, resource_info):
         log.debug(u"Extracting plain text from '{}' with "
                   "tika JAXRS server.".format(resource_info.filename))
 
@@ -57,3 +281,39 @@ class TikaConverter(object):
         # body in unicode, but Tika uses UTF-8 *without declaring it*.
         # See https://issues.apache.org/jira/browse/TIKA-912
         return response.content.decode('utf-8')
+
+    def extract_recursive(self, resource_info):
+        """Extract metadata and plain text with a single request to Tika's
+        recursive metadata endpoint, and return them as a ``(metadata,
+        text)`` tuple just like the ``meta`` and ``tika`` endpoints would.
+        """
+        log.debug(u"Extracting metadata and plain text from '{}' with "
+                  "tika JAXRS server.".format(resource_info.filename))
+
+        headers = {'Content-type': resource_info.content_type,
+                   'Accept': 'application/json'}
+        response = self._tika_request('rmeta/text', resource_info, headers)
+
+        # The first entry is the document itself, followed by the documents
+        # embedded in it (e.g. attachments).
+        try:
+            entries = json.loads(response.content.decode('utf-8'))
+        except ValueError, e:
+            raise ConversionError(
+                u"Tika responded with invalid JSON for {}: {}".format(
+                    get_resource_name(resource_info), e))
+        if not entries:
+            return SimpleMetadata({}), u''
+
+        metadata = {}
+        for key, value in entries[0].items():
+            if key.startswith(TIKA_KEY_PREFIX):
+                continue
+            # Multiple values are joined, like the CSV from the meta endpoint
+            if isinstance(value, list):
+                value = u' '.join(value)
+            metadata[key] = value
+
+        text = u'\n'.join(entry.get(TIKA_CONTENT_KEY) or u''
+                          for entry in entries)
+        return SimpleMetadata(metadata), text
@@ -1,3 +1,4 @@
+from requests.adapters import HTTPAdapter
 from urlparse import urlsplit
 from wsgiref.handlers import format_date_time
 import calendar
@@ -9,6 +10,7 @@ import io
 import json
 import os
 import pytz
+import requests
 
 
 def to_utc(dt):
@@ -54,6 +56,47 @@ def from_http_datetime(datestring):
     return to_utc(dt)
 
 
+def create_session(pool_size=10):
+    """Create a requests session whose connection pool can hold
+    ``pool_size`` connections per host, so it can be shared between that many
+    concurrent workers without discarding connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def parse_retry_after(header_value, now=None):
+    """Parse the value of an HTTP Retry-After header, which is either a
+    number of seconds or an HTTP date, and return the number of seconds to
+    wait (never negative), or ``None`` if the value can't be parsed.
+    """
+    if header_value is None:
+        return None
+
+    header_value = header_value.strip()
+    if header_value.isdigit():
+        return int(header_value)
+
+    # HTTP dates always contain day and month names. Without them, dateutil
+    # would happily interpret garbage like '-5' as a date.
+    if not any(c.isalpha() for c in header_value):
+        return None
+
+    try:
+        retry_at = from_http_datetime(header_value)
+    except (ValueError, OverflowError):
+        return None
+
+    if now is None:
+        now = datetime.datetime.utcnow()
+    delta = retry_at - to_utc(now)
+    return max(0, delta.days * 86400 + delta.seconds)
+
+
 def get_content_type(header_value):
     """Helps deal with the fact that the HTTP Content-Type header may also
     contain a charset declaration. For example:
@@ -66,6 +109,19 @@ def get_content_type(header_value):
         return header_value.split(';')[0]
 
 
+def get_charset(header_value):
+    """Return the charset declared in an HTTP Content-Type header, e.g.
+    ``'utf-8'`` for ``text/html; charset=UTF-8``, or ``None``.
+    """
+    if header_value is None:
+        return None
+    for param in header_value.split(';')[1:]:
+        name, sep, value = param.partition('=')
+        if name.strip().lower() == 'charset' and value.strip():
+            return value.strip().strip('"\'').lower()
+    return None
+
+
 def is_gzipped(response):
     """Determine whether a response's content is gzipped.
 
@@ -0,0 +1,109 @@
+from Queue import Queue
+import logging
+import sys
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+_STOP = object()
+
+
+class WorkerPool(object):
+    """Calls ``func`` for every item put into the pool, using ``size`` worker
+    threads.
+
+    With a size of 1 (or less), items are processed synchronously in the
+    calling thread by default, which makes the pool behave exactly like a
+    plain loop. Pass ``threaded=True`` to use a worker thread anyway.
+
+    Items are handed to the workers through a queue holding at most
+    ``queue_size`` items (twice the number of workers by default), so
+    ``put()`` blocks while the workers are busy.
+
+    The first exception raised by ``func`` stops the pool: remaining items
+    are discarded, and the exception is re-raised in the calling thread by
+    ``join()``.
+    """
+
+    def __init__(self, func, size=1, name='worker', queue_size=None,
+                 threaded=None):
+        self.func = func
+        self.size = max(1, size)
+        self.name = name
+
+        if threaded is None:
+            threaded = self.size > 1
+        self.threaded = threaded
+
+        if queue_size is None:
+            queue_size = self.size * 2
+        self.queue = Queue(maxsize=queue_size)
+        self._threads = []
+        self._exc_info = None
+
+    @property
+    def failed(self):
+        return self._exc_info is not None
+
+    def start(self):
+        if not self.threaded:
+            return
+
+        for n in range(self.size):
+            thread = threading.Thread(
+                target=self._work, name='{}-{}'.format(self.name, n))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item):
+        """Submit an item for processing. Blocks while the pool is busy.
+        """
+        if self.failed:
+            return
+
+        if not self.threaded:
+            self.func(item)
+            return
+
+        self.queue.put(item)
+
+    def qsize(self):
+        """Number of items waiting to be processed.
+        """
+        return self.queue.qsize()
+
+    def join(self):
+        """Wait for all submitted items to be processed and stop the workers.
+        Re-raises the first exception raised by any of the workers.
+        """
+        for thread in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+        if self._exc_info is not None:
+            exc_type, exc_value, tb = self._exc_info
+            self._exc_info = None
+            raise exc_type, exc_value, tb
+
+    def _call(self, item):
+        try:
+            self.func(item)
+        except Exception:
+            if self._exc_info is None:
+                self._exc_info = sys.exc_info()
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                if not self.failed:
+                    self._call(item)
+            finally:
+                self.queue.task_done()
@@ -8,12 +8,17 @@ tests_require = [
     'mock',
     'testfixtures',
     'ftw.crawler [slack]',
+    'ftw.crawler [css]',
 ]
 
 slack_requires = [
     'slacker',
 ]
 
+css_requires = [
+    'cssselect',
+]
+
 setup(name='ftw.crawler',
       version=version,
       description='Crawl sites, extract text and metadata, index it in Solr',
@@ -50,7 +55,8 @@ setup(name='ftw.crawler',
       ],
 
       tests_require=tests_require,
-      extras_require=dict(tests=tests_require, slack=slack_requires),
+      extras_require=dict(tests=tests_require, slack=slack_requires,
+                          css=css_requires),
 
       entry_points='''
       [console_scripts]